@@ -0,0 +1,137 @@
+"""Compact, streamable campaign archives for backup and migration.
+
+An archive holds one campaign's memories, with their vectors, and
+optionally its GameState. After an 8-byte magic it is a sequence of
+frames, each a 12-byte header (a 4-byte tag and the lengths of its two
+parts) followed by those parts:
+
+- STAT: the campaign's state as zlib-compressed JSON
+- ROWS: up to a batch of items from one collection, as zlib-compressed
+  JSON columns (ids, documents, metadatas) plus the vectors as float16,
+  byte-shuffled (every low byte, then every high byte) so the sign and
+  exponent bytes compress, then zlib-compressed
+- END : the item counts per collection, so a truncated archive is caught
+
+Frames are written and read one at a time, so memory use follows the
+batch size rather than the campaign's size, and the vectors are loaded
+back as they are instead of being re-embedded.
+"""
+
+import json
+import struct
+import zlib
+from typing import TYPE_CHECKING, BinaryIO, Dict, Iterator, List, Tuple
+
+from config import ARCHIVE_COMPRESSION_LEVEL
+
+if TYPE_CHECKING:
+    import numpy as np
+
+MAGIC = b"ADMARCH1"
+FRAME_HEADER = struct.Struct("<4sII")
+COLLECTIONS = ("story", "characters", "locations")  # MemoryManager's collection keys
+
+
+def _pack_vectors(vectors: "np.ndarray", level: int) -> bytes:
+    import numpy as np
+    halves = np.ascontiguousarray(vectors, dtype=np.float16)
+    return zlib.compress(halves.view(np.uint8).reshape(-1, 2).T.tobytes(), level)
+
+
+def _unpack_vectors(data: bytes, rows: int, dim: int) -> "np.ndarray":
+    import numpy as np
+    shuffled = np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(2, -1)
+    return np.ascontiguousarray(shuffled.T).view(np.float16).reshape(rows, dim).astype(np.float32)
+
+
+def _read_exact(file: BinaryIO, size: int) -> bytes:
+    data = file.read(size)
+    if len(data) != size:
+        raise ValueError("Campaign archive is truncated")
+    return data
+
+
+class ArchiveWriter:
+    """Writes an archive frame by frame to a file opened for binary writing."""
+    
+    def __init__(self, file: BinaryIO, level: int = ARCHIVE_COMPRESSION_LEVEL):
+        self.file = file
+        self.level = level
+        self.counts: Dict[str, int] = {}
+        file.write(MAGIC)
+    
+    def _frame(self, tag: bytes, columns: Dict, vectors: bytes = b""):
+        data = zlib.compress(json.dumps(columns, separators=(",", ":")).encode("utf-8"), self.level)
+        self.file.write(FRAME_HEADER.pack(tag, len(data), len(vectors)))
+        self.file.write(data)
+        self.file.write(vectors)
+    
+    def write_state(self, state: Dict):
+        """Write the campaign's state; it must be JSON-serializable."""
+        self._frame(b"STAT", state)
+    
+    def write_rows(self, collection: str, ids: List[str], documents: List[str], metadatas: List[Dict],
+                   embeddings):
+        """Write one batch of a collection's items."""
+        import numpy as np
+        if not ids:
+            return
+        if collection not in COLLECTIONS:
+            raise ValueError(f"Unknown collection {collection!r}")
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        self._frame(b"ROWS", {
+            "collection": collection,
+            "rows": len(ids),
+            "dim": vectors.shape[1],
+            "ids": ids,
+            "documents": documents,
+            "metadatas": metadatas
+        }, _pack_vectors(vectors, self.level))
+        self.counts[collection] = self.counts.get(collection, 0) + len(ids)
+    
+    def finish(self):
+        """Write the closing frame. An archive without it is rejected as truncated."""
+        self._frame(b"END ", {"counts": self.counts})
+
+
+def _check_rows(columns: Dict) -> int:
+    """Check a ROWS frame's collection and column lengths. Returns its row count."""
+    rows = columns["rows"]
+    if columns["collection"] not in COLLECTIONS:
+        raise ValueError(f"Campaign archive has an unknown collection {columns['collection']!r}")
+    if not all(len(columns[name]) == rows for name in ("ids", "documents", "metadatas")):
+        raise ValueError("Campaign archive is damaged")
+    return rows
+
+
+def read_archive(file: BinaryIO) -> Iterator[Tuple[str, Dict]]:
+    """Read an archive one frame at a time.
+    
+    Yields ("state", state) and ("rows", batch) pairs; a batch has the
+    collection, ids, documents, metadatas and float32 embeddings. Raises
+    ValueError if the file isn't an archive, ends early or is damaged.
+    """
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a campaign archive")
+    counts: Dict[str, int] = {}
+    while True:
+        tag, columns_size, vectors_size = FRAME_HEADER.unpack(_read_exact(file, FRAME_HEADER.size))
+        columns_data = _read_exact(file, columns_size)
+        vectors = _read_exact(file, vectors_size)
+        try:
+            columns = json.loads(zlib.decompress(columns_data))
+            if tag == b"ROWS":
+                rows = _check_rows(columns)
+                columns["embeddings"] = _unpack_vectors(vectors, rows, columns["dim"])
+                counts[columns["collection"]] = counts.get(columns["collection"], 0) + rows
+            elif tag == b"END " and columns["counts"] != counts:
+                raise ValueError("Campaign archive is incomplete")
+        except (zlib.error, KeyError, TypeError, AttributeError):
+            raise ValueError("Campaign archive is damaged")
+        if tag == b"END ":
+            return
+        if tag == b"STAT":
+            yield "state", columns
+        elif tag == b"ROWS":
+            yield "rows", columns
+        # Frames with other tags come from newer versions and are skipped
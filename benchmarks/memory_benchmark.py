@@ -0,0 +1,183 @@
+"""Benchmark the memory layer and full turns against the offline stub server.
+
+For each store size this fills a fresh store with synthetic story events
+(older ones are folded into chapters, as in a real campaign), then in a
+separate process measures the MemoryManager hot paths and
+StoryTeller.process_action against stub_server.py, reporting throughput,
+p50/p95/p99 latency and RSS.
+
+Usage:
+    python benchmarks/memory_benchmark.py --sizes 10 1000 10000 --backend numpy
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from telemetry import percentile
+
+BATCH = 256
+WORDS = ("goblin dragon tavern sword shield castle forest river cave torch map key door guard merchant "
+         "wizard spell potion ring bridge tower ruin crypt village storm shadow bell ship gold scroll").split()
+
+
+def sentence(rng: random.Random, words: int = 14) -> str:
+    """A synthetic line of narration."""
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def rss_mb():
+    """Current and peak resident set size of this process in MB."""
+    # ru_maxrss survives exec, so it would report the parent's peak; prefer /proc
+    values = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    values[line.split(":")[0]] = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if not values:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return peak, peak
+    return values["VmRSS"], values["VmHWM"]
+
+
+def open_memory(backend: str, directory: str, write_behind: bool = True):
+    from memory import MemoryManager
+    from vector_store import create_store
+    return MemoryManager(directory, namespace="bench", store=create_store(backend, directory),
+                         write_behind=write_behind)
+
+
+def populate(backend: str, directory: str, size: int):
+    """Fill a fresh store with synthetic events, characters and locations in bulk."""
+    rng = random.Random(0)
+    memory = open_memory(backend, directory, write_behind=False)
+    for start in range(0, size, BATCH):
+        ids = [f"turn_{i}" for i in range(start, min(size, start + BATCH))]
+        memory._write_batch("story", ids,
+                            [f"Turn {i[5:]}: {sentence(rng)} Result: {sentence(rng, 30)}" for i in ids],
+                            [{"turn": int(i[5:]), "type": "story_event"} for i in ids])
+    extras = max(1, min(size, 50))
+    memory._write_batch("characters", [f"npc_{i}" for i in range(extras)],
+                        [f"NPC {i}: {sentence(rng)}" for i in range(extras)],
+                        [{"type": "character"} for _ in range(extras)])
+    memory._write_batch("locations", [f"loc_{i}" for i in range(extras)],
+                        [f"Location {i}: {sentence(rng)}" for i in range(extras)],
+                        [{"type": "location"} for _ in range(extras)])
+
+
+def timed(operation, count: int) -> dict:
+    """Run an operation count times and summarize its latency."""
+    latencies = []
+    start = time.perf_counter()
+    for i in range(count):
+        t = time.perf_counter()
+        operation(i)
+        latencies.append(time.perf_counter() - t)
+    total = time.perf_counter() - start
+    return {
+        "ops_per_s": count / total if total else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000
+    }
+
+
+def measure(backend: str, directory: str, ops: int, turns: int, latency: float, token_rate: float) -> dict:
+    """Measure every hot path against an already populated store. Runs in a fresh process."""
+    from openai import OpenAI
+    from stub_server import start_stub_server
+    from storyteller import StoryTeller
+    
+    rng = random.Random(1)
+    memory = open_memory(backend, directory)
+    memory.warmup()
+    results = {}
+    
+    queries = [sentence(rng, 6) for _ in range(ops)]
+    results["search_relevant_memories"] = timed(lambda i: memory.search_relevant_memories(queries[i]), ops)
+    results["search (cached)"] = timed(lambda i: memory.search_relevant_memories(queries[0]), ops)
+    queries = [sentence(rng, 6) for _ in range(ops)]
+    results["get_context_string"] = timed(lambda i: memory.get_context_string(queries[i]), ops)
+    
+    server, base_url = start_stub_server(latency=latency, token_rate=token_rate)
+    storyteller = StoryTeller(client=OpenAI(api_key="stub", base_url=base_url, max_retries=0), memory=memory)
+    storyteller.set_character("Bench", "Human", "Warrior", "A traveller who exists to be measured.")
+    actions = [sentence(rng, 8) for _ in range(turns)]
+    results["process_action"] = timed(lambda i: storyteller.process_action(actions[i]), turns)
+    storyteller.compactor.wait()
+    memory.flush()
+    server.shutdown()
+    
+    # Enqueue latency with write-behind; throughput includes draining the queue
+    start = time.perf_counter()
+    queued = timed(lambda i: memory.add_story_event(f"bench_{i}", sentence(rng, 30), {"turn": i}), ops)
+    memory.flush()
+    queued["ops_per_s"] = ops / (time.perf_counter() - start)
+    results["add_story_event (write-behind)"] = queued
+    
+    memory.write_behind = False
+    results["add_story_event"] = timed(lambda i: memory.add_story_event(f"sync_{i}", sentence(rng, 30), {"turn": i}), ops)
+    results["add_character"] = timed(lambda i: memory.add_character(f"npc_b{i}", sentence(rng)), ops)
+    results["add_location"] = timed(lambda i: memory.add_location(f"loc_b{i}", sentence(rng)), ops)
+    
+    current, peak = rss_mb()
+    return {"operations": results, "rss_mb": current, "peak_rss_mb": peak}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", default="numpy", choices=["chroma", "numpy"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10, 1000, 10000])
+    parser.add_argument("--ops", type=int, default=200, help="calls per memory operation")
+    parser.add_argument("--turns", type=int, default=30, help="process_action calls")
+    parser.add_argument("--latency", type=float, default=0.0, help="stub first-token latency in seconds")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="stub tokens per second, 0 for instant")
+    parser.add_argument("--json", action="store_true", help="print raw results as JSON")
+    parser.add_argument("--measure", metavar="DIRECTORY", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.measure:
+        print(json.dumps(measure(args.backend, args.measure, args.ops, args.turns, args.latency, args.token_rate)))
+        return
+    
+    report = {}
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            t = time.perf_counter()
+            populate(args.backend, directory, size)
+            fill = time.perf_counter() - t
+            output = subprocess.run(
+                [sys.executable, __file__, "--measure", directory, "--backend", args.backend,
+                 "--ops", str(args.ops), "--turns", str(args.turns),
+                 "--latency", str(args.latency), "--token-rate", str(args.token_rate)],
+                check=True, capture_output=True, text=True, cwd=ROOT
+            ).stdout
+            report[size] = json.loads(output.strip().splitlines()[-1])
+            report[size]["fill_s"] = fill
+    
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    
+    for size, r in report.items():
+        print(f"\n{args.backend}, {size} stored events (fill {r['fill_s']:.2f}s, "
+              f"RSS {r['rss_mb']:.1f} MB, peak {r['peak_rss_mb']:.1f} MB)")
+        print(f"{'operation':<32} {'ops/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for name, o in r["operations"].items():
+            print(f"{name:<32} {o['ops_per_s']:>9.1f} {o['p50_ms']:>8.2f} {o['p95_ms']:>8.2f} {o['p99_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Compare the ChromaDB and NumPy memory backends.
+
+For each backend and store size this fills a fresh store with random
+vectors, then measures in a separate process how long it takes to import
+the backend and open the collection, the peak RSS, and query latency.
+
+Usage:
+    python benchmarks/vector_store_benchmark.py --sizes 100 10000 100000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DIM = 384  # all-MiniLM-L6-v2, ChromaDB's default embedding model
+BATCH = 5000
+
+
+def populate(backend: str, directory: str, size: int):
+    """Fill a fresh store with random normalized vectors."""
+    import numpy as np
+    from vector_store import create_store
+    
+    rng = np.random.default_rng(0)
+    collection = create_store(backend, directory).get_or_create_collection("story_events")
+    for start in range(0, size, BATCH):
+        n = min(BATCH, size - start)
+        vectors = rng.standard_normal((n, DIM)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        collection.upsert(
+            ids=[f"turn_{i}" for i in range(start, start + n)],
+            embeddings=vectors,
+            documents=[f"Turn {i}: something happened" for i in range(start, start + n)],
+            metadatas=[{"turn": i, "type": "story_event"} for i in range(start, start + n)]
+        )
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB."""
+    # ru_maxrss survives exec, so it would report the parent's peak; prefer VmHWM
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(backend: str, directory: str, queries: int, n_results: int) -> dict:
+    """Measure startup, RSS and query latency. Runs in a fresh process."""
+    start = time.perf_counter()
+    from vector_store import create_store
+    collection = create_store(backend, directory).get_or_create_collection("story_events")
+    collection.count()
+    startup = time.perf_counter() - start
+    
+    import numpy as np
+    rng = np.random.default_rng(1)
+    latencies = []
+    for _ in range(queries):
+        query = rng.standard_normal(DIM).astype(np.float32)
+        query /= np.linalg.norm(query)
+        t = time.perf_counter()
+        collection.query(query_embeddings=[query.tolist()], n_results=n_results)
+        latencies.append(time.perf_counter() - t)
+    
+    latencies.sort()
+    return {
+        "startup_ms": startup * 1000,
+        "rss_mb": peak_rss_mb(),
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", nargs="+", default=["chroma", "numpy"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--n-results", type=int, default=5)
+    parser.add_argument("--measure", nargs=2, metavar=("BACKEND", "DIRECTORY"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.measure:
+        print(json.dumps(measure(args.measure[0], args.measure[1], args.queries, args.n_results)))
+        return
+    
+    print(f"{'backend':<8} {'memories':>9} {'fill s':>8} {'startup ms':>11} {'RSS MB':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for size in args.sizes:
+        for backend in args.backends:
+            with tempfile.TemporaryDirectory() as directory:
+                t = time.perf_counter()
+                populate(backend, directory, size)
+                fill = time.perf_counter() - t
+                output = subprocess.run(
+                    [sys.executable, __file__, "--measure", backend, directory,
+                     "--queries", str(args.queries), "--n-results", str(args.n_results)],
+                    check=True, capture_output=True, text=True, cwd=ROOT
+                ).stdout
+                r = json.loads(output.strip().splitlines()[-1])
+                print(f"{backend:<8} {size:>9} {fill:>8.2f} {r['startup_ms']:>11.1f} {r['rss_mb']:>8.1f} "
+                      f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
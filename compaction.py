@@ -0,0 +1,83 @@
+"""Background compaction of old conversation turns into a rolling synopsis."""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from config import SUMMARY_BATCH_TURNS
+
+logger = logging.getLogger(__name__)
+
+# Shared by every session; summaries are off the critical path so a couple of workers is plenty
+_COMPACTION_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="compaction")
+
+
+class HistoryCompactor:
+    """Folds turns evicted from the history window into GameState.synopsis.
+    
+    Evicted messages are collected and summarized in one background call
+    once batch_turns turns have built up, so the player's turn never waits.
+    """
+    
+    def __init__(self, summarize: Callable[[str, List[Dict]], Optional[str]], batch_turns: int = SUMMARY_BATCH_TURNS):
+        """Create a compactor.
+        
+        summarize(previous_synopsis, messages) returns the new synopsis, or None on failure.
+        """
+        self.summarize = summarize
+        self.batch_turns = batch_turns
+        self._pending: List[Dict] = []
+        self._running = None
+        self._running_batch: List[Dict] = []
+        self._lock = threading.Lock()
+    
+    def evict(self, messages: List[Dict], game_state):
+        """Queue messages that fell out of the history window."""
+        with self._lock:
+            self._pending.extend(messages)
+            self._maybe_start(game_state)
+    
+    def _maybe_start(self, game_state):
+        """Start a summary job if a full batch is waiting and none is running. Needs the lock."""
+        turns = sum(1 for m in self._pending if m["role"] == "assistant")
+        if self._running is None and turns >= self.batch_turns:
+            batch, self._pending = self._pending, []
+            self._running_batch = batch
+            self._running = _COMPACTION_POOL.submit(self._run, batch, game_state)
+    
+    def _run(self, batch: List[Dict], game_state):
+        synopsis = None
+        try:
+            synopsis = self.summarize(game_state.synopsis, batch)
+        except Exception:
+            logger.exception("History compaction failed")
+        
+        with self._lock:
+            if synopsis:
+                game_state.synopsis = synopsis
+            else:
+                # Keep the turns so the next batch retries them
+                self._pending[:0] = batch
+            self._running = None
+            if synopsis:
+                self._maybe_start(game_state)
+    
+    def backlog(self) -> List[Dict]:
+        """Messages evicted from the history but not yet folded into the synopsis."""
+        with self._lock:
+            running = list(self._running_batch) if self._running is not None else []
+            return running + list(self._pending)
+    
+    def restore(self, messages: List[Dict]):
+        """Reload a saved backlog; it is summarized along with the next eviction."""
+        with self._lock:
+            self._pending = list(messages)
+    
+    def wait(self, timeout: Optional[float] = None):
+        """Block until no summary job is running, including any a finished job started for the next batch."""
+        while True:
+            running = self._running
+            if running is None:
+                return
+            running.result(timeout)
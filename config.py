@@ -7,11 +7,138 @@ load_dotenv()
 
 # OpenAI Settings
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None  # any OpenAI-compatible endpoint, e.g. stub_server.py
+if OPENAI_BASE_URL and not OPENAI_API_KEY:
+    OPENAI_API_KEY = "local"  # local endpoints don't check the key
 MODEL_NAME = "gpt-3.5-turbo"
 
 # Game Settings
-MAX_MEMORY_ITEMS = 50
+MAX_MEMORY_ITEMS = 50  # recent story events kept verbatim; older ones are folded into chapters
 NARRATIVE_TEMPERATURE = 0.8
+MAX_RESPONSE_TOKENS = 1000
+
+# Prompt token budgets per model; the response gets MAX_RESPONSE_TOKENS on top.
+# Tokens are counted with tiktoken when it is installed, otherwise estimated.
+PROMPT_TOKEN_BUDGETS = {
+    "gpt-3.5-turbo": 3000,
+    "gpt-4o-mini": 6000,
+    "gpt-4o": 6000,
+    "gpt-4": 6000
+}
+DEFAULT_PROMPT_TOKEN_BUDGET = 3000
+HISTORY_WINDOW = 16  # messages kept in conversation history
+# "classic", or "cache" to order prompts from most to least stable so provider prompt caching hits;
+# the cache layout keeps between HISTORY_WINDOW - 2 * HISTORY_CHUNK_TURNS and HISTORY_WINDOW messages
+PROMPT_LAYOUT = os.getenv("PROMPT_LAYOUT", "classic")
+HISTORY_CHUNK_TURNS = 4  # turns dropped from history at a time in the cache layout
+SUMMARY_BATCH_TURNS = 4  # evicted turns folded into the synopsis per summary call
+SYNOPSIS_MAX_TOKENS = 300
+
+# Memory Settings
+MEMORY_BACKEND = os.getenv("MEMORY_BACKEND", "chroma")  # "chroma" or "numpy"
+MEMORY_DIRECTORY = os.getenv("MEMORY_DIRECTORY", "./chroma_data" if MEMORY_BACKEND == "chroma" else "./memory_data")
+NUMPY_VECTOR_DTYPE = "float32"  # or "float16" to halve the vector file
+EMBEDDING_CACHE_SIZE = 512  # query embeddings, keyed by normalized text
+EMBEDDING_CACHE_TTL = 3600  # seconds
+QUERY_CACHE_SIZE = 128  # search results per collection, cleared when it changes
+QUERY_CACHE_TTL = 600  # seconds
+WRITE_BEHIND = True  # persist memory writes in the background
+WRITE_BATCH_SIZE = 32  # writes per upsert
+WRITE_MAX_DELAY = 0.5  # seconds a write may wait for its batch to fill
+CHAPTER_TURNS = 25  # old story events folded into each chapter document
+MAX_CHAPTERS = 40  # beyond this the two oldest chapters are merged, so story memory stays bounded
+CHAPTER_MAX_CHARS = 2000
+# Embeddings: a local ONNX sentence-embedding model (all-MiniLM-L6-v2 by default).
+# Point EMBEDDING_MODEL_DIR at another export (model.onnx + tokenizer.json) for a smaller model;
+# vectors from different models don't mix, so switch models with a fresh memory directory.
+EMBEDDING_MODEL_DIR = os.getenv("EMBEDDING_MODEL_DIR", "~/.cache/chroma/onnx_models/all-MiniLM-L6-v2/onnx")
+EMBEDDING_DOWNLOAD = os.getenv("EMBEDDING_DOWNLOAD", "1") == "1"  # fetch the default model if missing; 0 on air-gapped hosts
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))  # onnxruntime intra-op threads; 0 uses every core
+EMBEDDING_BATCH_SIZE = 32  # documents per forward pass
+EMBEDDING_QUANTIZED = os.getenv("EMBEDDING_QUANTIZED", "0") == "1"  # int8 model_quantized.onnx: smaller, faster on CPU
+EMBEDDING_MAX_TOKENS = 256  # longer documents are truncated
+# Seconds an unsaved campaign's memories may sit unused before garbage collection deletes them
+MEMORY_GC_MAX_IDLE = float(os.getenv("MEMORY_GC_MAX_IDLE", str(7 * 24 * 3600)))
+# Fuse BM25 matches with vector search; queries naming a known NPC or location skip the embedding
+HYBRID_SEARCH = True
+HYBRID_RRF_K = 60  # reciprocal rank fusion constant; larger flattens the gap between ranks
+# Campaign archives (MemoryManager.export_campaign / import_campaign)
+ARCHIVE_BATCH_SIZE = 4096  # items per frame; export and import hold one frame in memory at a time
+ARCHIVE_COMPRESSION_LEVEL = 3  # zlib level, 1 (fastest) to 9 (smallest)
+
+# Server Settings
+SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8080"))
+SESSION_IDLE_TIMEOUT = 3600  # seconds before an idle session is evicted
+
+# LLM response cache: "off", "read-through", "record" or "replay-only"
+LLM_CACHE_MODE = os.getenv("LLM_CACHE_MODE", "off")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "./llm_cache/responses.jsonl")
+LLM_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# LLM transport: deadlines, retries, hedging and the circuit breaker
+LLM_DEADLINE = 60.0  # seconds for a whole call, retries included
+LLM_ATTEMPT_TIMEOUT = 20.0  # seconds per attempt; while streaming, per chunk
+LLM_MAX_RETRIES = 3  # retries on timeouts, connection errors, 429 and 5xx
+LLM_BACKOFF_BASE = 0.5  # seconds; retry n waits up to base * 2**n, fully jittered
+LLM_BACKOFF_MAX = 8.0
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"  # duplicate calls still running after the p95 latency
+LLM_HEDGE_MIN_SAMPLES = 20  # latencies needed before hedging starts
+BREAKER_FAILURE_THRESHOLD = 5  # consecutive failures that open the circuit
+BREAKER_RESET_TIMEOUT = 30.0  # seconds the circuit stays open before a trial call
+
+# Model routing: each call goes to a tier by its kind and, for turns, by how pivotal the action looks.
+# Numbered choices and short actions are routine "turn"s; longer or dramatic ones are "pivotal".
+# A tier has its own response budget, deadline (seconds) and a fallback model tried if it fails.
+FAST_MODEL = os.getenv("FAST_MODEL", MODEL_NAME)
+STRONG_MODEL = os.getenv("STRONG_MODEL", MODEL_NAME)
+MODEL_TIERS = {
+    "fast": {"model": FAST_MODEL, "max_tokens": 700, "timeout": 30.0, "fallback": STRONG_MODEL},
+    "strong": {"model": STRONG_MODEL, "max_tokens": MAX_RESPONSE_TOKENS, "timeout": LLM_DEADLINE, "fallback": FAST_MODEL}
+}
+MODEL_ROUTES = {
+    "opening": "strong",
+    "pivotal": "strong",
+    "turn": "fast",
+    "character": "fast",
+    "summary": "fast",
+    "speculative": "fast"
+}
+ROUTINE_ACTION_WORDS = 8  # actions up to this long, without a pivotal verb, take the "turn" route
+
+# Rate limits shared by every session and background job in the process. Each attempt draws one request
+# and its estimated tokens (prompt characters / 4 + max_tokens) from per-minute token buckets;
+# 0 learns the limit from the provider's x-ratelimit-* headers, and is unlimited until then
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))
+LLM_TPM = int(os.getenv("LLM_TPM", "0"))
+BACKGROUND_ROUTES = {"summary", "speculative"}  # queued behind every player turn
+BACKGROUND_RESERVE = 0.2  # share of each bucket background calls leave free for player turns
+
+# Telemetry: comma-separated extra sinks, "jsonl" and/or "prometheus".
+# The in-memory ring buffer behind the stats command is always on.
+TELEMETRY_SINKS = os.getenv("TELEMETRY_SINKS", "")
+TELEMETRY_JSONL_PATH = os.getenv("TELEMETRY_JSONL_PATH", "./telemetry.jsonl")
+TELEMETRY_RING_SIZE = 2000  # events kept per session
+PROMETHEUS_PORT = int(os.getenv("PROMETHEUS_PORT", "0"))  # 0 disables the /metrics endpoint
+
+# Stream narration to the terminal as it is generated
+STREAM_NARRATION = True
+
+# Speculatively generate each numbered choice's follow-up while the player reads.
+# Costs up to SPECULATIVE_BRANCHES extra calls per turn; 0 turns it off.
+SPECULATIVE_BRANCHES = int(os.getenv("SPECULATIVE_BRANCHES", "0"))
+SPECULATIVE_MAX_TOKENS = 600  # per branch; a branch cut off before its choices is discarded
+SPECULATIVE_MAX_WAIT = 5.0  # seconds a picked branch still generating is waited for before a live call instead
+
+# Entity extraction: NPCs, locations and quest hooks are pulled from narration
+# by a local rule-based pass in the background, so turns never wait for it
+ENTITY_EXTRACTION = True
+ENTITY_MAX_CHARS = 600  # description kept per NPC or location; newer sentences push out older ones
+MAX_ACTIVE_QUESTS = 8  # oldest quest hooks are dropped past this
+
+# Saved campaigns: an append-only journal per campaign plus periodic snapshots
+SAVE_DIRECTORY = os.getenv("SAVE_DIRECTORY", "./saves")
+JOURNAL_SNAPSHOT_INTERVAL = 50  # turns between snapshots; resume replays at most this many
 
 # System Prompts
 DUNGEON_MASTER_PROMPT = """You are an expert Dungeon Master for an interactive text-based adventure game. 
@@ -29,3 +156,8 @@ Remember all previous events and character details provided in the context."""
 CHARACTER_CREATION_PROMPT = """Help the player create their character for the adventure.
 Ask for: Name, Race (Human, Elf, Dwarf, etc.), Class (Warrior, Mage, Rogue, etc.), and a brief backstory.
 Be encouraging and creative with suggestions."""
+
+SUMMARY_PROMPT = """You maintain the running synopsis of an interactive adventure.
+Given the synopsis so far and the latest exchanges between the player and the Dungeon Master,
+write an updated synopsis in at most two short paragraphs. Keep names of characters, places,
+items and open quests, and the consequences of the player's choices. Drop flavor text."""
@@ -0,0 +1,177 @@
+"""Local ONNX sentence embeddings shared by every MemoryManager in the process.
+
+ChromaDB's default embedding function loads all-MiniLM-L6-v2 on first use,
+downloads it if missing and pads every document to 256 tokens. This runs
+the same kind of model from a configured directory instead: it never
+downloads unless allowed, pads each batch only to its longest document,
+can use an int8-quantized copy of the model and loads at warmup rather
+than on the first turn.
+"""
+
+import logging
+import os
+import threading
+from typing import TYPE_CHECKING, Any, List, Optional
+
+from profiling import phase
+from config import (
+    EMBEDDING_MODEL_DIR,
+    EMBEDDING_DOWNLOAD,
+    EMBEDDING_THREADS,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_QUANTIZED,
+    EMBEDDING_MAX_TOKENS
+)
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+
+
+def _default_model_dir() -> str:
+    """Where ChromaDB keeps its copy of all-MiniLM-L6-v2."""
+    from chromadb.utils.embedding_functions.onnx_mini_lm_l6_v2 import ONNXMiniLM_L6_V2
+    return os.path.join(str(ONNXMiniLM_L6_V2.DOWNLOAD_PATH), ONNXMiniLM_L6_V2.EXTRACTED_FOLDER_NAME)
+
+
+class LocalEmbeddingFunction:
+    """Mean-pooled, L2-normalized sentence embeddings from an ONNX model.
+    
+    model_dir holds model.onnx and a Hugging Face tokenizer.json, as in the
+    sentence-transformers ONNX exports; a smaller model is used by pointing
+    it at another export. With quantized, model_quantized.onnx is used and
+    created from model.onnx on first load if the onnx package is installed.
+    """
+    
+    def __init__(self, model_dir: str = EMBEDDING_MODEL_DIR, threads: int = EMBEDDING_THREADS,
+                 batch_size: int = EMBEDDING_BATCH_SIZE, quantized: bool = EMBEDDING_QUANTIZED,
+                 max_tokens: int = EMBEDDING_MAX_TOKENS, download: bool = EMBEDDING_DOWNLOAD):
+        self.model_dir = os.path.expanduser(model_dir)
+        self.threads = threads
+        self.batch_size = batch_size
+        self.quantized = quantized
+        self.max_tokens = max_tokens
+        self.download = download
+        self.documents = 0
+        self.forward_passes = 0
+        self._session: Any = None
+        self._tokenizer: Any = None
+        self._inputs: List[str] = []
+        self._lock = threading.Lock()
+    
+    def _ensure_files(self):
+        """Make sure the model and tokenizer are on disk, fetching the default model if allowed."""
+        if os.path.exists(os.path.join(self.model_dir, MODEL_FILE)):
+            return
+        if self.download and os.path.abspath(self.model_dir) == os.path.abspath(_default_model_dir()):
+            from chromadb.utils.embedding_functions.onnx_mini_lm_l6_v2 import ONNXMiniLM_L6_V2
+            with phase("download embedding model"):
+                ONNXMiniLM_L6_V2()._download_model_if_not_exists()
+            return
+        raise FileNotFoundError(
+            f"No embedding model in {self.model_dir}: copy an ONNX export ({MODEL_FILE} and {TOKENIZER_FILE}) "
+            "there or point EMBEDDING_MODEL_DIR at one"
+        )
+    
+    def _model_path(self) -> str:
+        """The model file to load, quantizing model.onnx first if needed."""
+        path = os.path.join(self.model_dir, MODEL_FILE)
+        if not self.quantized:
+            return path
+        quantized = os.path.join(self.model_dir, QUANTIZED_MODEL_FILE)
+        if not os.path.exists(quantized):
+            try:
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+            except ImportError:
+                raise FileNotFoundError(
+                    f"No {QUANTIZED_MODEL_FILE} in {self.model_dir}; install onnx to create it from {MODEL_FILE}"
+                )
+            with phase("quantize embedding model"):
+                quantize_dynamic(path, quantized + ".tmp", weight_type=QuantType.QInt8)
+                os.replace(quantized + ".tmp", quantized)
+        return quantized
+    
+    def _load(self):
+        """Open the inference session and tokenizer once."""
+        with self._lock:
+            if self._session is not None:
+                return
+            import onnxruntime
+            from tokenizers import Tokenizer
+            
+            self._ensure_files()
+            tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, TOKENIZER_FILE))
+            tokenizer.enable_truncation(max_length=self.max_tokens)
+            tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")  # to the longest document in each batch
+            
+            options = onnxruntime.SessionOptions()
+            options.log_severity_level = 3
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+            with phase("load embedding model"):
+                session = onnxruntime.InferenceSession(self._model_path(), sess_options=options,
+                                                       providers=["CPUExecutionProvider"])
+            self._inputs = [model_input.name for model_input in session.get_inputs()]
+            self._tokenizer = tokenizer
+            self._session = session
+    
+    def warmup(self):
+        """Load the model and run one forward pass, so the first turn doesn't pay for either."""
+        self(["warmup"])
+    
+    def _forward(self, documents: List[str]) -> "np.ndarray":
+        """Embed one batch in a single forward pass."""
+        import numpy as np
+        encoded = self._tokenizer.encode_batch(documents)
+        input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+        feed = {"input_ids": input_ids, "attention_mask": attention_mask,
+                "token_type_ids": np.zeros_like(input_ids)}
+        hidden = self._session.run(None, {name: feed[name] for name in self._inputs})[0]
+        self.forward_passes += 1
+        
+        if hidden.ndim == 3:
+            mask = attention_mask[:, :, None].astype(np.float32)
+            hidden = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(hidden, axis=1, keepdims=True)
+        norms[norms == 0] = 1e-12
+        return (hidden / norms).astype(np.float32)
+    
+    def __call__(self, input: List[str]) -> List["np.ndarray"]:
+        """Embed documents, batching those of similar length together to keep padding short."""
+        if self._session is None:
+            self._load()
+        if not input:
+            return []
+        self.documents += len(input)
+        order = sorted(range(len(input)), key=lambda i: len(input[i]))
+        embeddings: List[Optional["np.ndarray"]] = [None] * len(input)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            for i, embedding in zip(batch, self._forward([input[i] for i in batch])):
+                embeddings[i] = embedding
+        return embeddings
+    
+    def stats(self) -> dict:
+        """Documents embedded and forward passes run so far."""
+        return {"documents": self.documents, "forward_passes": self.forward_passes}
+
+
+_embedding_function: Optional[LocalEmbeddingFunction] = None
+_embedding_lock = threading.Lock()
+
+
+def get_embedding_function() -> LocalEmbeddingFunction:
+    """The process-wide embedding function, so sessions share one loaded model."""
+    global _embedding_function
+    with _embedding_lock:
+        if _embedding_function is None:
+            _embedding_function = LocalEmbeddingFunction()
+        return _embedding_function
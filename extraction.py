@@ -0,0 +1,284 @@
+"""Background rule-based extraction of NPCs, locations and quest hooks from narration."""
+
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import ENTITY_MAX_CHARS, MAX_ACTIVE_QUESTS
+from speculation import CHOICE_PATTERN
+
+logger = logging.getLogger(__name__)
+
+# Shared by every session; extraction is a few regex passes per turn
+_EXTRACTION_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="extraction")
+
+NAME = r"[A-Z][a-z'’]+(?:[ -][A-Z][a-z'’]+){0,2}"
+
+TITLES = ("Captain|Lord|Lady|Sir|Dame|King|Queen|Prince|Princess|Duke|Duchess|Baron|Baroness|Count|Countess|"
+          "Brother|Sister|Father|Mother|Master|Mistress|Elder|Magister|Sergeant|General|Commander|Archmage|"
+          "Priestess|Doctor|Madam|Old")
+
+ROLES = ("innkeeper|merchant|blacksmith|smith|guard|wizard|priest|priestess|knight|bard|hunter|farmer|captain|"
+         "sailor|thief|healer|witch|mage|sorcerer|sorceress|scholar|librarian|alchemist|ranger|druid|elder|mayor|"
+         "stranger|warrior|mercenary|barkeep|bartender|king|queen|prince|princess|lord|lady|hermit|monk|oracle|"
+         "seer|sage|trader|peddler|soldier|noble|beggar|cultist|necromancer|dwarf|elf|orc|goblin|halfling|gnome|"
+         "paladin|cleric|rogue|assassin|archer|squire|steward|jailer|ferryman|fisherman|herbalist|tinker|"
+         "cartographer|apprentice|shopkeeper|baker|miner|woodcutter|shepherd|pilgrim|wanderer|traveler|traveller")
+
+PERSON_NOUNS = ("man|woman|figure|stranger|dwarf|elf|orc|goblin|halfling|gnome|knight|merchant|girl|boy|child|"
+                "priest|wizard|traveler|traveller|creature|warrior|mage|guard|innkeeper|dragon|spirit|ghost")
+
+SPEECH_VERBS = ("says|said|whispers|whispered|growls|growled|replies|replied|asks|asked|shouts|shouted|mutters|"
+                "muttered|laughs|laughed|smiles|smiled|nods|nodded|explains|explained|warns|warned|hisses|hissed|"
+                "murmurs|murmured|exclaims|exclaimed|snarls|snarled|sighs|sighed|beckons|beckoned|greets|greeted")
+
+PLACE_NOUNS = ("Keep|Castle|Tower|Forest|Wood|Woods|Moor|Moors|Library|Inn|Tavern|Village|Town|City|Temple|Shrine|"
+               "Cave|Caves|Cavern|Caverns|Mountains|Mountain|Peak|Hills|River|Lake|Sea|Crypt|Ruins|Citadel|"
+               "Fortress|Fort|Harbor|Harbour|Port|Market|Hall|Halls|Mine|Mines|Swamp|Marsh|Fen|Vale|Valley|Pass|"
+               "Bridge|Gate|Gates|Abbey|Monastery|Sanctum|Dungeon|Catacombs|Tomb|Academy|Manor|Palace|Isle|"
+               "Island|Coast|Desert|Wastes|Glade|Grove|Road|Square|Quarter|District|Docks|Arena|Spire|Hollow|"
+               "Falls|Canyon|Gorge|Chapel|Cathedral|Outpost|Camp|Barrow|Labyrinth|Sewers|Archive|Observatory")
+
+PLACE_KINDS = ("village|town|city|tavern|inn|keep|castle|fortress|temple|forest|port|hamlet|kingdom|realm|land|"
+               "lands|island|isle|cave|mine|tower|valley|swamp|citadel|capital|outpost|shrine|monastery")
+
+NPC_PATTERNS = [
+    re.compile(rf"\b((?:{TITLES}) {NAME})"),
+    re.compile(rf"\b({NAME}),? (?:the|an?) (?:[a-z]+[ -]){{0,2}}(?:{ROLES})\b"),
+    re.compile(rf"\b(?:{PERSON_NOUNS}) (?:named|called|known as) ({NAME})"),
+    re.compile(rf"\b({NAME}) (?:{SPEECH_VERBS})\b")
+]
+
+LOCATION_PATTERNS = [
+    re.compile(rf"\b((?:[A-Z][a-z'’]+ ){{1,3}}(?:{PLACE_NOUNS}))\b"),
+    re.compile(rf"\b((?:{PLACE_NOUNS}) of (?:the )?{NAME})"),
+    re.compile(rf"\b(?:{PLACE_KINDS}) (?:of|named|called|known as) (?:the )?({NAME})")
+]
+
+# The player being somewhere, rather than a place merely being mentioned
+ARRIVAL_PATTERN = re.compile(
+    r"\b(?:you|your party)\b[^.!?]*?\b(?:arrive|reach|enter|step into|step inside|stand|find yourself|"
+    r"are in|are at|walk into|make your way|return to|emerge|descend into|climb|push open|cross into)\b"
+    r"|\bwelcome to\b", re.IGNORECASE)
+
+QUEST_PATTERNS = [
+    re.compile(r"\b(?:asks|begs|implores|urges|hires|charges|tasks|commissions|pleads with) you to ([^.!?\n]+)"),
+    re.compile(r"\byou must ([^.!?\n]+)"),
+    re.compile(r"\b(?:quest|mission|task|bounty|errand) (?:is |was )?to ([^.!?\n]+)")
+]
+
+# Capitalized words that start sentences or phrases rather than names
+STOPWORDS = {
+    "you", "your", "he", "she", "it", "they", "we", "i", "the", "a", "an", "his", "her", "their", "its", "this",
+    "that", "these", "those", "there", "then", "but", "and", "or", "as", "when", "while", "suddenly", "finally",
+    "beneath", "inside", "outside", "near", "beyond", "above", "below", "behind", "before", "after", "across",
+    "through", "within", "at", "in", "on", "to", "from", "into", "of", "with", "without", "deep", "far", "here",
+    "now", "still", "yet", "somewhere", "everyone", "someone", "something", "nothing", "no", "yes", "what",
+    "who", "where", "why", "how", "if", "rain", "wind", "night", "day", "dawn", "dusk", "around"
+}
+
+PLACE_NOUN_SET = set(PLACE_NOUNS.lower().split("|"))
+
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def normalize_name(name: str) -> str:
+    """Normalize a name so spelling variants map to the same entity."""
+    words = re.sub(r"[^\w\s-]", "", name.lower()).replace("-", " ").split()
+    while words and words[0] in ("the", "a", "an"):
+        words = words[1:]
+    return " ".join(words)
+
+
+def _clean(name: str) -> str:
+    """Strip leading sentence words and articles off a matched name."""
+    words = name.split()
+    while words and words[0].lower() in STOPWORDS:
+        words = words[1:]
+    return " ".join(words)
+
+
+def _sentences(narration: str) -> List[str]:
+    """The narration's sentences, without its numbered choices."""
+    prose = CHOICE_PATTERN.sub("", narration)
+    return [" ".join(s.split()) for s in SENTENCE_SPLIT.split(prose) if s.strip()]
+
+
+def extract(narration: str) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]], Optional[str], List[str]]:
+    """Find the entities in one narration.
+    
+    Returns (NPCs, locations, current location, quest hooks), where NPCs and
+    locations are (name, sentence) pairs in order of appearance and the
+    current location is the place the player arrived at, if any.
+    """
+    npcs, locations, quests = [], [], []
+    current = None
+    for sentence in _sentences(narration):
+        places = []
+        for pattern in LOCATION_PATTERNS:
+            for match in pattern.finditer(sentence):
+                name = _clean(match.group(1))
+                # A bare "Tower" is not a name
+                if name and name[0].isupper() and not set(name.lower().split()) <= PLACE_NOUN_SET:
+                    places.append(name)
+        # Keep "Tower of Dawn" rather than also "Dawn"
+        places = [p for p in dict.fromkeys(places) if not any(p != other and p in other for other in places)]
+        place_keys = {normalize_name(p) for p in places}
+        locations.extend((place, sentence) for place in places)
+        if places and current is None and ARRIVAL_PATTERN.search(sentence):
+            current = places[0]
+        
+        for pattern in NPC_PATTERNS:
+            for match in pattern.finditer(sentence):
+                name = _clean(match.group(1))
+                if name and name[0].isupper() and normalize_name(name) not in place_keys:
+                    npcs.append((name, sentence))
+        
+        for pattern in QUEST_PATTERNS:
+            for match in pattern.finditer(sentence):
+                hook = match.group(1).strip(" ,;:\"'")
+                if len(hook) > 8:
+                    quests.append(hook[0].upper() + hook[1:120])
+    return npcs, locations, current, quests
+
+
+class Entity:
+    """An NPC or location seen in the story, merged across mentions."""
+    
+    def __init__(self, name: str, description: str = ""):
+        self.name = name
+        self.description = description
+    
+    def merge(self, sentence: str) -> bool:
+        """Add a sentence about this entity. Returns whether the description changed."""
+        if normalize_name(sentence) in normalize_name(self.description):
+            return False
+        description = f"{self.description} {sentence}".strip()
+        if len(description) > ENTITY_MAX_CHARS:
+            # Drop the oldest sentences, keeping the newest whole
+            cut = description.find(" ", len(description) - ENTITY_MAX_CHARS)
+            description = description[cut + 1:] if cut >= 0 else description[-ENTITY_MAX_CHARS:]
+        self.description = description
+        return True
+
+
+class EntityExtractor:
+    """Feeds NPCs, locations and quest hooks from narration into memory.
+    
+    Each finished turn's narration is queued with submit() and processed on
+    a background thread with a local rule-based pass, so the player's turn
+    never waits and no extra LLM call is made. Whatever queued up meanwhile
+    is handled as one batch, and each changed entity is written once per
+    batch through add_npc(name, description) or add_location(name,
+    description). Mentions are deduplicated by normalized name and merged
+    into existing entries, including those already in memory when the
+    extractor starts, which load_existing() returns.
+    """
+    
+    def __init__(self, add_npc: Callable[[str, str], None], add_location: Callable[[str, str], None],
+                 load_existing: Optional[Callable[[], Dict[str, List[Tuple[str, str]]]]] = None):
+        self.add_npc = add_npc
+        self.add_location = add_location
+        self.load_existing = load_existing
+        self.npcs: Dict[str, Entity] = {}
+        self.locations: Dict[str, Entity] = {}
+        self._loaded = load_existing is None
+        self._pending: List[tuple] = []
+        self._running = None
+        self._lock = threading.Lock()
+        self.counts = {"turns": 0, "batches": 0, "npcs": 0, "locations": 0, "quests": 0}
+    
+    def submit(self, narration: str, game_state):
+        """Queue a turn's narration for extraction."""
+        with self._lock:
+            self._pending.append((narration, game_state))
+            if self._running is None:
+                self._running = _EXTRACTION_POOL.submit(self._drain)
+    
+    def _drain(self):
+        while True:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                if not batch:
+                    self._running = None
+                    return
+            try:
+                self._process(batch)
+            except Exception:
+                logger.exception("Entity extraction failed")
+    
+    def _load(self):
+        """Index the entities already in memory, so new mentions merge into them."""
+        self._loaded = True
+        existing = self.load_existing()
+        for name, description in existing.get("npcs", []):
+            self.npcs.setdefault(normalize_name(name), Entity(name, description))
+        for name, description in existing.get("locations", []):
+            self.locations.setdefault(normalize_name(name), Entity(name, description))
+    
+    def _resolve_npc(self, name: str) -> str:
+        """Key of the known NPC a name refers to, e.g. "Varro" for "Captain Varro"."""
+        key = normalize_name(name)
+        if key in self.npcs:
+            return key
+        words = set(key.split())
+        for known in self.npcs:
+            known_words = set(known.split())
+            if known.split()[-1] == key.split()[-1] and (words <= known_words or known_words <= words):
+                return known
+        return key
+    
+    def _process(self, batch: List[tuple]):
+        if not self._loaded:
+            self._load()
+        changed_npcs, changed_locations = {}, {}
+        for narration, game_state in batch:
+            player = normalize_name(game_state.player_character.get("name", ""))
+            npcs, locations, current, quests = extract(narration)
+            
+            for name, sentence in locations:
+                key = normalize_name(name)
+                entity = self.locations.get(key)
+                if entity is None:
+                    entity = self.locations[key] = Entity(name)
+                    self.counts["locations"] += 1
+                if entity.merge(sentence):
+                    changed_locations[key] = entity
+            
+            for name, sentence in npcs:
+                key = self._resolve_npc(name)
+                if not key or key in self.locations or (player and (key == player or key in player.split())):
+                    continue
+                entity = self.npcs.get(key)
+                if entity is None:
+                    entity = self.npcs[key] = Entity(name)
+                    self.counts["npcs"] += 1
+                if entity.merge(sentence):
+                    changed_npcs[key] = entity
+            
+            if current is not None:
+                game_state.current_location = self.locations[normalize_name(current)].name
+            elif game_state.current_location == "Unknown" and locations:
+                game_state.current_location = self.locations[normalize_name(locations[0][0])].name
+            
+            known = {normalize_name(q) for q in game_state.active_quests}
+            for hook in quests:
+                if normalize_name(hook) not in known:
+                    known.add(normalize_name(hook))
+                    game_state.active_quests = (game_state.active_quests + [hook])[-MAX_ACTIVE_QUESTS:]
+                    self.counts["quests"] += 1
+            self.counts["turns"] += 1
+        
+        for entity in changed_npcs.values():
+            self.add_npc(entity.name, entity.description)
+        for entity in changed_locations.values():
+            self.add_location(entity.name, entity.description)
+        self.counts["batches"] += 1
+    
+    def wait(self, timeout: Optional[float] = None):
+        """Block until every queued narration has been processed."""
+        running = self._running
+        if running is not None:
+            running.result(timeout)
@@ -1,12 +1,23 @@
 """Main game interface for AI Dungeon Master."""
 
+import profiling
 from rich.console import Console
 from rich.panel import Panel
 from rich.prompt import Prompt, Confirm
 from rich.markdown import Markdown
 from rich.text import Text
+from rich.live import Live
+from rich.table import Table
 from storyteller import StoryTeller
+from telemetry import Telemetry
+from transport import LLMFailure
+from scheduler import PRIORITIES
+from journal import list_campaigns
+from config import STREAM_NARRATION, SPECULATIVE_BRANCHES
+from typing import Iterable, Optional
+import argparse
 import sys
+import time
 
 
 console = Console()
@@ -23,9 +34,46 @@ def print_header():
     console.print(header, style="bold magenta")
 
 
+def story_panel(text: str) -> Panel:
+    """Build the panel used to display story text."""
+    return Panel(Markdown(text), border_style="green", padding=(1, 2))
+
+
 def print_story(text: str):
-    """Print story text in a nice panel."""
-    console.print(Panel(Markdown(text), border_style="green", padding=(1, 2)))
+    """Print story text in a nice panel, or the error if the LLM call failed."""
+    if isinstance(text, LLMFailure):
+        print_failure(text)
+        return
+    console.print(story_panel(text))
+
+
+def print_failure(failure: LLMFailure):
+    """Print a failed LLM call. Nothing was saved, so the player can simply try again."""
+    console.print(f"\n[bold red]{failure}[/bold red]\n[dim]Nothing was saved; try that again in a moment.[/dim]")
+
+
+def print_story_stream(chunks: Iterable[str], telemetry: Optional[Telemetry] = None) -> str:
+    """Paint story text into a panel incrementally as it streams in.
+    
+    Time spent rendering, excluding waiting for tokens, is reported to telemetry.
+    """
+    text = ""
+    failure = None
+    rendering = 0.0
+    with Live(story_panel("*...*"), console=console, refresh_per_second=12, vertical_overflow="visible") as live:
+        for chunk in chunks:
+            if isinstance(chunk, LLMFailure):
+                failure = chunk
+                continue
+            start = time.perf_counter()
+            text += chunk
+            live.update(story_panel(text))
+            rendering += time.perf_counter() - start
+    if telemetry:
+        telemetry.observe("render", rendering)
+    if failure is not None:
+        print_failure(failure)
+    return text
 
 
 def print_system(text: str):
@@ -126,6 +174,10 @@ def game_loop(storyteller: StoryTeller):
             # Check for special commands
             if player_input.lower() in ['quit', 'exit', 'q']:
                 if Confirm.ask("\n[bold red]Are you sure you want to quit?[/bold red]"):
+                    if storyteller.journal is not None:
+                        storyteller.save_game()
+                    else:
+                        storyteller.memory.flush()
                     console.print("\n[bold]Thanks for playing AI Dungeon Master![/bold]")
                     console.print("[dim]Your adventure will be remembered...[/dim]\n")
                     break
@@ -139,6 +191,46 @@ def game_loop(storyteller: StoryTeller):
                 show_status(storyteller)
                 continue
             
+            if player_input.lower() == 'stats':
+                show_stats(storyteller)
+                continue
+            
+            if player_input.lower() == 'save':
+                storyteller.save_game()
+                console.print(f"[green]Adventure saved[/green] [dim](campaign {storyteller.journal.campaign_id})[/dim]")
+                continue
+            
+            if player_input.lower() == 'load':
+                campaign_id = choose_campaign()
+                if campaign_id:
+                    if storyteller.journal is not None:
+                        storyteller.save_game()
+                    resume_campaign(storyteller, campaign_id)
+                continue
+            
+            if player_input.lower() == 'export':
+                name = storyteller.game_state.player_character.get("name", "campaign")
+                path = Prompt.ask("Export to", default=f"{name}.adm")
+                try:
+                    counts = storyteller.export_campaign(path)
+                except OSError as e:
+                    console.print(f"[red]Could not export to {path}: {e}[/red]")
+                    continue
+                console.print(f"[green]Adventure exported to {path}[/green] "
+                              f"[dim]({sum(counts.values())} memories)[/dim]")
+                continue
+            
+            if player_input.lower() == 'import':
+                path = Prompt.ask("Import from")
+                try:
+                    storyteller.import_campaign(path)
+                except (OSError, ValueError) as e:
+                    console.print(f"[red]Could not import {path}: {e}[/red]")
+                    continue
+                print_system("YOUR ADVENTURE CONTINUES")
+                console.print(Markdown(storyteller.get_story_so_far()))
+                continue
+            
             if not player_input.strip():
                 console.print("[dim]Please enter an action or type 'help' for commands.[/dim]")
                 continue
@@ -146,11 +238,15 @@ def game_loop(storyteller: StoryTeller):
             # Process the player's action
             console.print("\n[dim italic]The Dungeon Master weaves the tale...[/dim italic]\n")
             
-            with console.status("[bold green]Generating story...", spinner="dots"):
-                response = storyteller.process_action(player_input)
-            
-            print_story(response)
-            
+            if STREAM_NARRATION:
+                print_story_stream(storyteller.process_action_stream(player_input), storyteller.telemetry)
+            else:
+                with console.status("[bold green]Generating story...", spinner="dots"):
+                    response = storyteller.process_action(player_input)
+                
+                with storyteller.telemetry.span("render"):
+                    print_story(response)
+        
         except KeyboardInterrupt:
             console.print("\n\n[bold]Game interrupted. Type 'quit' to exit properly.[/bold]")
 
@@ -163,6 +259,11 @@ def show_help():
 - **quit/exit/q** - Exit the game
 - **help** - Show this help message
 - **status** - View your character status
+- **stats** - View turn latency and token usage for this session
+- **save** - Save your adventure (turns are also journaled as you play)
+- **load** - Resume a saved adventure
+- **export** - Back up your adventure to a single file
+- **import** - Continue an adventure from an exported file
 
 **Gameplay Tips:**
 
@@ -174,6 +275,40 @@ def show_help():
     console.print(Panel(Markdown(help_text), title="📖 Help", border_style="blue"))
 
 
+def choose_campaign() -> Optional[str]:
+    """Let the player pick a saved campaign. Returns its id, or None."""
+    campaigns = list_campaigns()
+    if not campaigns:
+        console.print("[dim]No saved adventures yet.[/dim]")
+        return None
+    
+    table = Table(title="💾 Saved Adventures", border_style="green")
+    table.add_column("#", justify="right")
+    table.add_column("Hero")
+    table.add_column("Turn", justify="right")
+    table.add_column("Location")
+    table.add_column("Saved")
+    for i, campaign in enumerate(campaigns, 1):
+        saved = time.strftime("%Y-%m-%d %H:%M", time.localtime(campaign["saved_at"]))
+        table.add_row(str(i), campaign["name"], str(campaign["turn"]), campaign["location"], saved)
+    console.print(table)
+    
+    choice = Prompt.ask("Select an adventure (or Enter to cancel)", default="")
+    if not choice.isdigit() or not 1 <= int(choice) <= len(campaigns):
+        return None
+    return campaigns[int(choice) - 1]["campaign_id"]
+
+
+def resume_campaign(storyteller: StoryTeller, campaign_id: str):
+    """Resume a saved campaign and replay the last scene."""
+    storyteller.load_game(campaign_id)
+    print_system("YOUR ADVENTURE CONTINUES")
+    last_scene = next((m["content"] for m in reversed(storyteller.conversation_history)
+                       if m["role"] == "assistant"), None)
+    if last_scene:
+        print_story(last_scene)
+
+
 def show_status(storyteller: StoryTeller):
     """Show current game status."""
     char = storyteller.game_state.player_character
@@ -190,9 +325,85 @@ Location: {storyteller.game_state.current_location}
         console.print("[dim]No character created yet.[/dim]")
 
 
+def show_stats(storyteller: StoryTeller):
+    """Show per-phase latency and token usage for the session."""
+    summary = storyteller.telemetry.summary()
+    if not summary["phases"]:
+        console.print("[dim]No turns played yet.[/dim]")
+        return
+    
+    table = Table(title="📈 Session Stats", border_style="cyan")
+    table.add_column("Phase")
+    table.add_column("Count", justify="right")
+    table.add_column("p50 (ms)", justify="right")
+    table.add_column("p95 (ms)", justify="right")
+    for name, phase in sorted(summary["phases"].items()):
+        table.add_row(name, str(phase["count"]), f"{phase['p50'] * 1000:.1f}", f"{phase['p95'] * 1000:.1f}")
+    console.print(table)
+    
+    tokens = summary["tokens"]
+    console.print(
+        f"[bold]Tokens:[/bold] {tokens['prompt']} prompt ({tokens['cached']} cached, {tokens['cache_hit_rate']:.0%}), "
+        f"{tokens['completion']} completion over {tokens['calls']} calls"
+    )
+    
+    speculator = storyteller.speculator
+    if speculator is not None and speculator.counts["turns"]:
+        counts = speculator.counts
+        console.print(
+            f"[bold]Speculation:[/bold] {speculator.hit_rate():.0%} hit rate "
+            f"({counts['hits']} hits, {counts['misses']} misses, {counts['late']} too late), "
+            f"{counts['branches']} branches, {counts['discarded']} discarded, {tokens['by_call'].get('speculative', 0)} tokens"
+        )
+    
+    routes = storyteller.router.stats()
+    if routes:
+        console.print("[bold]Routes:[/bold] " + ", ".join(
+            f"{name} ({route['tier']}) {route['calls']} calls, p50 {route['p50'] * 1000:.0f}ms, "
+            f"{route['prompt_tokens'] + route['completion_tokens']} tokens"
+            + (f", {route['fallbacks']} fallbacks" if route["fallbacks"] else "")
+            for name, route in sorted(routes.items())
+        ))
+    
+    scheduler = storyteller.transport.scheduler.stats()
+    if scheduler["throttled"] or any(scheduler[priority]["queued"] for priority in PRIORITIES):
+        console.print("[bold]Rate limits:[/bold] " + ", ".join(
+            f"{priority} {scheduler[priority]['queued']} queued (now {scheduler[priority]['depth']}), "
+            f"waited p95 {scheduler[priority]['wait_p95'] * 1000:.0f}ms"
+            for priority in PRIORITIES
+        ) + f", {scheduler['throttled']} throttled")
+    
+    transport = storyteller.transport.stats()
+    if transport["retries"] or transport["hedges"] or transport["failures"] or transport["circuit"] != "closed":
+        console.print(
+            f"[bold]Transport:[/bold] {transport['retries']} retries ({transport['timeouts']} timeouts), "
+            f"{transport['hedges']} hedged ({transport['hedge_wins']} won), {transport['failures']} failed, "
+            f"circuit {transport['circuit']}"
+        )
+
+
+def show_startup_profile():
+    """Show how long each startup phase took."""
+    table = Table(title="⏱️ Startup Profile", border_style="magenta")
+    table.add_column("Phase")
+    table.add_column("Thread")
+    table.add_column("Start (ms)", justify="right")
+    table.add_column("Duration (ms)", justify="right")
+    for p in profiling.report():
+        table.add_row(p["phase"], p["thread"], f"{p['start'] * 1000:.0f}", f"{p['duration'] * 1000:.1f}")
+    console.print(table)
+
+
 def main():
     """Main entry point."""
+    parser = argparse.ArgumentParser(description="AI Dungeon Master")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="report how long each startup phase took")
+    args = parser.parse_args()
+    
+    profiling.mark("imports done")
     print_header()
+    profiling.mark("header shown")
     
     # Check for API key
     from config import OPENAI_API_KEY
@@ -201,31 +412,55 @@ def main():
             "[bold red]OpenAI API key not configured![/bold red]\n\n"
             "Please set your API key in a .env file:\n"
             "[cyan]OPENAI_API_KEY=your_key_here[/cyan]\n\n"
-            "Get your API key from: https://platform.openai.com/api-keys",
+            "Get your API key from: https://platform.openai.com/api-keys\n"
+            "Or play offline against [cyan]stub_server.py[/cyan] by setting OPENAI_BASE_URL.",
             title="⚠️ Configuration Required",
             border_style="red"
         ))
         sys.exit(1)
     
+    # Open the OpenAI client, memory store and embedding model while the player creates a character
     storyteller = StoryTeller()
+    warmup = storyteller.start_warmup()
+    if SPECULATIVE_BRANCHES:
+        storyteller.enable_speculation()
     
     # Character creation
     print_system("Welcome, Adventurer!")
     console.print("[dim]Prepare to embark on an epic journey where your choices shape the story.[/dim]\n")
     
-    while not character_creation(storyteller):
-        console.print("[dim]Let's try again...[/dim]\n")
-    
-    # Choose setting
-    setting = choose_setting()
+    campaign_id = None
+    if list_campaigns() and Confirm.ask("Continue a saved adventure?", default=True):
+        campaign_id = choose_campaign()
     
-    # Start the adventure
-    print_system("YOUR ADVENTURE BEGINS")
-    
-    with console.status("[bold green]The Dungeon Master prepares your adventure...", spinner="dots"):
-        opening = storyteller.start_adventure(setting)
+    if campaign_id:
+        resume_campaign(storyteller, campaign_id)
+    else:
+        while not character_creation(storyteller):
+            console.print("[dim]Let's try again...[/dim]\n")
+        
+        # Every new campaign is journaled so it can be saved and resumed
+        storyteller.start_journal()
+        
+        # Choose setting
+        setting = choose_setting()
+        
+        # Start the adventure
+        print_system("YOUR ADVENTURE BEGINS")
+        
+        with profiling.phase("opening scene"):
+            if STREAM_NARRATION:
+                print_story_stream(storyteller.start_adventure_stream(setting), storyteller.telemetry)
+            else:
+                with console.status("[bold green]The Dungeon Master prepares your adventure...", spinner="dots"):
+                    opening = storyteller.start_adventure(setting)
+                
+                print_story(opening)
     
-    print_story(opening)
+    if args.profile_startup:
+        warmup.join()
+        show_startup_profile()
+    profiling.finish()
     
     # Show help hint
     console.print("[dim]Type 'help' for commands, or describe your action to continue.[/dim]")
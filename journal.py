@@ -0,0 +1,182 @@
+"""Append-only per-campaign journal with periodic snapshots for save and resume."""
+
+import json
+import os
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from config import SAVE_DIRECTORY, JOURNAL_SNAPSHOT_INTERVAL, HISTORY_WINDOW
+
+JOURNAL_FILE = "journal.jsonl"
+SNAPSHOT_FILE = "snapshot.json"
+
+
+def campaign_namespace(campaign_id: str) -> str:
+    """Memory namespace holding a campaign's vectors."""
+    return f"c{campaign_id}"
+
+
+def _write_atomic(path: str, data: Dict):
+    """Replace a JSON file so readers never see it half written."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class Journal:
+    """One campaign's save file.
+    
+    Every turn appends one compact record to journal.jsonl: the player's
+    input, the narration and whichever GameState fields changed. Every
+    snapshot_interval turns the full state and history window are written
+    to snapshot.json along with the journal offset they cover, so resuming
+    reads one snapshot and replays at most snapshot_interval records.
+    Vector memories live in the campaign's own namespace and are reattached
+    as they are; nothing is re-embedded.
+    """
+    
+    def __init__(self, campaign_id: str, directory: str = SAVE_DIRECTORY,
+                 snapshot_interval: int = JOURNAL_SNAPSHOT_INTERVAL):
+        self.campaign_id = campaign_id
+        self.path = os.path.join(directory, campaign_id)
+        self.snapshot_interval = snapshot_interval
+        os.makedirs(self.path, exist_ok=True)
+        self._journal_path = os.path.join(self.path, JOURNAL_FILE)
+        self._snapshot_path = os.path.join(self.path, SNAPSHOT_FILE)
+        self._repair()
+        self._file = open(self._journal_path, "a", encoding="utf-8")
+        self._offset = self._file.tell()
+        self._last_state: Dict = {}
+        self._since_snapshot = 0
+    
+    @classmethod
+    def create(cls, directory: str = SAVE_DIRECTORY) -> "Journal":
+        """Start a journal for a new campaign."""
+        return cls(uuid.uuid4().hex[:12], directory)
+    
+    @classmethod
+    def open(cls, campaign_id: str, directory: str = SAVE_DIRECTORY) -> "Journal":
+        """Open an existing campaign's journal."""
+        if not os.path.exists(os.path.join(directory, campaign_id, JOURNAL_FILE)):
+            raise FileNotFoundError(f"No saved campaign {campaign_id!r} in {directory}")
+        return cls(campaign_id, directory)
+    
+    @property
+    def namespace(self) -> str:
+        """Memory namespace holding this campaign's vectors."""
+        return campaign_namespace(self.campaign_id)
+    
+    def _repair(self):
+        """Drop a half-written last record left by a crash."""
+        if not os.path.exists(self._journal_path):
+            return
+        with open(self._journal_path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+    
+    def append_turn(self, player_input: str, response: str, state: Dict, opening: bool = False):
+        """Append one turn, storing only the state fields that changed since the last record."""
+        changed = {key: value for key, value in state.items() if self._last_state.get(key) != value}
+        record = {"input": player_input, "response": response, "state": changed}
+        if opening:
+            record["opening"] = True
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._file.flush()
+        self._offset = self._file.tell()
+        self._last_state = json.loads(json.dumps(state))
+        self._since_snapshot += 1
+    
+    def snapshot_due(self) -> bool:
+        """Whether enough turns have been appended to take another snapshot."""
+        return self._since_snapshot >= self.snapshot_interval
+    
+    def snapshot(self, state: Dict, history: List[Dict], backlog: Optional[List[Dict]] = None):
+        """Write the full state as of the end of the journal."""
+        os.fsync(self._file.fileno())
+        _write_atomic(self._snapshot_path, {
+            "campaign_id": self.campaign_id,
+            "saved_at": time.time(),
+            "offset": self._offset,
+            "game_state": state,
+            "history": history,
+            "backlog": backlog or []
+        })
+        self._last_state = json.loads(json.dumps(state))
+        self._since_snapshot = 0
+    
+    def resume(self, history_overflow: Optional[Callable[[int], int]] = None) -> Tuple[Dict, List[Dict], List[Dict]]:
+        """Rebuild the state, history window and unsummarized backlog.
+        
+        Starts from the snapshot and replays only the records appended after it.
+        history_overflow gives how many messages to evict from a history of a
+        given length, as in live play (PromptAssembler.history_overflow);
+        without it history is trimmed to HISTORY_WINDOW messages.
+        """
+        if history_overflow is None:
+            history_overflow = lambda length: max(0, length - HISTORY_WINDOW)
+        snapshot = {"offset": 0, "game_state": {}, "history": [], "backlog": []}
+        if os.path.exists(self._snapshot_path):
+            with open(self._snapshot_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+        
+        state = snapshot["game_state"]
+        history = snapshot["history"]
+        backlog = snapshot["backlog"]
+        with open(self._journal_path, "rb") as f:
+            f.seek(snapshot["offset"])
+            for line in f:
+                record = json.loads(line)
+                state.update(record["state"])
+                turn = [{"role": "user", "content": record["input"]},
+                        {"role": "assistant", "content": record["response"]}]
+                if record.get("opening"):
+                    history = turn
+                else:
+                    history = history + turn
+                self._since_snapshot += 1
+                # Mirror StoryTeller._record_action: old turns wait for the next summary
+                excess = history_overflow(len(history))
+                if excess > 0:
+                    backlog.extend(history[:excess])
+                    history = history[excess:]
+        
+        self._last_state = json.loads(json.dumps(state))
+        return state, history, backlog
+    
+    def close(self):
+        self._file.close()
+
+
+def list_campaigns(directory: str = SAVE_DIRECTORY) -> List[Dict]:
+    """Describe the saved campaigns, most recently saved first."""
+    campaigns = []
+    if not os.path.isdir(directory):
+        return campaigns
+    for campaign_id in os.listdir(directory):
+        snapshot_path = os.path.join(directory, campaign_id, SNAPSHOT_FILE)
+        if not os.path.exists(snapshot_path):
+            continue
+        with open(snapshot_path, encoding="utf-8") as f:
+            snapshot = json.load(f)
+        state = snapshot["game_state"]
+        campaigns.append({
+            "campaign_id": campaign_id,
+            "name": state.get("player_character", {}).get("name", "Unknown"),
+            "turn": state.get("turn_count", 0),
+            "location": state.get("current_location", "Unknown"),
+            "saved_at": snapshot["saved_at"]
+        })
+    return sorted(campaigns, key=lambda c: c["saved_at"], reverse=True)
+
+
+def saved_namespaces(directory: str = SAVE_DIRECTORY) -> Set[str]:
+    """Memory namespaces of every journaled campaign, including those not snapshotted yet."""
+    if not os.path.isdir(directory):
+        return set()
+    return {campaign_namespace(campaign_id) for campaign_id in os.listdir(directory)
+            if os.path.exists(os.path.join(directory, campaign_id, JOURNAL_FILE))}
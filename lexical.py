@@ -0,0 +1,136 @@
+"""In-memory BM25 index that sits beside each vector collection.
+
+Player actions usually name who or where they mean ("talk to Mirelle"),
+and an exact term lookup finds those memories faster and more reliably
+than an embedding. The index is updated with every write, never touches
+disk, and is rebuilt from the collection when a campaign is opened.
+"""
+
+import math
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from vector_store import _matches
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "but", "of", "to", "in", "on", "at", "for", "from", "with", "into", "onto",
+    "by", "as", "is", "are", "was", "were", "be", "been", "it", "its", "this", "that", "these", "those", "i",
+    "me", "my", "you", "your", "he", "she", "him", "her", "his", "they", "them", "their", "we", "us", "our",
+    "s", "t", "not", "no", "so", "then", "there", "here", "up", "down", "out", "back", "again", "what", "who",
+    "where", "how", "do", "does", "did", "can", "will", "would", "should", "let", "go", "ask", "about"
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase terms of a text, without stopwords and with plurals folded."""
+    terms = []
+    for term in TOKEN_PATTERN.findall(text.lower()):
+        if term in STOPWORDS:
+            continue
+        if len(term) > 4 and term.endswith("s") and not term.endswith("ss"):
+            term = term[:-1]
+        terms.append(term)
+    return terms
+
+
+class LexicalIndex:
+    """BM25 over one collection's documents.
+    
+    Documents carrying a "name" in their metadata (NPCs and locations) are
+    also indexed by name, so a query can be checked for naming them outright.
+    """
+    
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._documents: Dict[str, Tuple[str, Dict, Counter, int]] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._names: Dict[str, Tuple[str, ...]] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._documents)
+    
+    def _remove(self, item_id: str):
+        old = self._documents.pop(item_id, None)
+        if old is None:
+            return
+        for term in old[2]:
+            postings = self._postings[term]
+            del postings[item_id]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= old[3]
+        self._names.pop(item_id, None)
+    
+    def upsert(self, ids: List[str], documents: List[str], metadatas: List[Dict]):
+        """Add documents, replacing any with the same id."""
+        with self._lock:
+            for item_id, document, metadata in zip(ids, documents, metadatas):
+                self._remove(item_id)
+                counts = Counter(tokenize(document))
+                length = sum(counts.values())
+                self._documents[item_id] = (document, metadata or {}, counts, length)
+                for term, count in counts.items():
+                    self._postings.setdefault(term, {})[item_id] = count
+                self._total_length += length
+                name = (metadata or {}).get("name")
+                if name and tokenize(name):
+                    self._names[item_id] = tuple(tokenize(name))
+    
+    def delete(self, ids: Iterable[str]):
+        """Remove documents by id."""
+        with self._lock:
+            for item_id in ids:
+                self._remove(item_id)
+    
+    def named_in(self, terms: List[str]) -> Set[str]:
+        """Ids of the documents whose whole name appears among the query terms."""
+        present = set(terms)
+        with self._lock:
+            return {item_id for item_id, name in self._names.items() if present.issuperset(name)}
+    
+    def search(self, terms: List[str], n: int, where: Optional[Dict] = None) -> List[Tuple[str, float, str]]:
+        """Best n matches for the query terms as (id, score, document), highest score first."""
+        with self._lock:
+            total = len(self._documents)
+            if not total or not terms:
+                return []
+            average_length = self._total_length / total or 1.0
+            scores: Dict[str, float] = {}
+            for term in set(terms):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1.0 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                for item_id, count in postings.items():
+                    norm = self.k1 * (1.0 - self.b + self.b * self._documents[item_id][3] / average_length)
+                    scores[item_id] = scores.get(item_id, 0.0) + idf * count * (self.k1 + 1.0) / (count + norm)
+            
+            ranked = sorted(scores.items(), key=lambda item: -item[1])
+            hits = []
+            for item_id, score in ranked:
+                document, metadata, _, _ = self._documents[item_id]
+                if where and not _matches(metadata, where):
+                    continue
+                hits.append((item_id, score, document))
+                if len(hits) == n:
+                    break
+            return hits
+
+
+def fuse(rankings: List[List[Tuple[str, str]]], n: int, k: int = 60) -> List[str]:
+    """Reciprocal rank fusion of several (id, document) rankings. Returns the best n documents."""
+    scores: Dict[str, float] = {}
+    documents: Dict[str, str] = {}
+    for ranking in rankings:
+        for rank, (item_id, document) in enumerate(ranking):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank + 1)
+            documents.setdefault(item_id, document)
+    best = sorted(scores, key=lambda item_id: -scores[item_id])[:n]
+    return [documents[item_id] for item_id in best]
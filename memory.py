@@ -1,123 +1,666 @@
 """Vector database memory system for maintaining narrative consistency."""
 
-import chromadb
+from concurrent.futures import Future, ThreadPoolExecutor
+import atexit
 import json
-from typing import List, Dict, Optional
+import logging
+import re
+import threading
+import time
+import uuid
+from typing import List, Dict, Iterable, Optional, Tuple, Union
 import os
+from archive import ArchiveWriter, read_archive
+from cache import LRUCache
+from embeddings import get_embedding_function
+from lexical import LexicalIndex, fuse, tokenize
+from profiling import phase
+from vector_store import VectorStore, get_store
+from config import (
+    MEMORY_BACKEND,
+    MEMORY_DIRECTORY,
+    EMBEDDING_CACHE_SIZE,
+    EMBEDDING_CACHE_TTL,
+    QUERY_CACHE_SIZE,
+    QUERY_CACHE_TTL,
+    WRITE_BEHIND,
+    WRITE_BATCH_SIZE,
+    WRITE_MAX_DELAY,
+    MAX_MEMORY_ITEMS,
+    CHAPTER_TURNS,
+    MAX_CHAPTERS,
+    CHAPTER_MAX_CHARS,
+    MEMORY_GC_MAX_IDLE,
+    HYBRID_SEARCH,
+    HYBRID_RRF_K,
+    ARCHIVE_BATCH_SIZE
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Shared by every MemoryManager so many sessions don't each hold their own threads
+_QUERY_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="memory-query")
+
+# The framing StoryTeller puts around the narration in story event documents
+EVENT_PREFIX = re.compile(r"^(?:Turn \d+: Player chose '.*?'\. Result: |Adventure begins: )", re.DOTALL)
+CHAPTER_PREFIX = re.compile(r"^CHAPTER \(turns \d+-\d+\): ")
+SENTENCE_END = re.compile(r"[.!?][\"']?(?=\s|$)")
+
+
+def _event_gist(document: str, limit: int) -> str:
+    """The narration of a story event, without its framing, cut at a word boundary to about limit characters."""
+    text = EVENT_PREFIX.sub("", document, count=1).strip()
+    if text.endswith("..."):
+        text = text[:-3].rstrip()
+    if len(text) > limit:
+        text = text[:limit - 3].rsplit(" ", 1)[0].rstrip(",;:")
+    if not text.endswith((".", "!", "?", '"', "'")):
+        text += "..."
+    return text
+
+
+def _chapter_gist(document: str, limit: int) -> str:
+    """The text of a chapter, without its heading, cut at the last sentence end (or word) within limit characters."""
+    text = CHAPTER_PREFIX.sub("", document, count=1).strip()
+    if len(text) <= limit:
+        return text
+    ends = [m.end() for m in SENTENCE_END.finditer(text) if m.end() <= limit]
+    if ends:
+        return text[:ends[-1]]
+    return text[:limit - 3].rsplit(" ", 1)[0].rstrip(",;:") + "..."
+
+
+def _turn_span(metadata: Dict) -> Tuple[int, int]:
+    """First and last turn a story event or chapter covers."""
+    turn = metadata.get("turn", 0)
+    return metadata.get("turn_start", turn), metadata.get("turn_end", turn)
+
+
+class MemoryWriter:
+    """Background writer that batches memory writes into multi-id upserts.
+    
+    Writes are flushed once batch_size are queued or the oldest has waited
+    max_delay seconds. One writer thread is shared by every MemoryManager.
+    """
+    
+    def __init__(self, batch_size: int = WRITE_BATCH_SIZE, max_delay: float = WRITE_MAX_DELAY):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._queue: List[tuple] = []
+        self._queued_at = 0.0
+        self._outstanding: Dict[int, int] = {}
+        self._flushing = 0  # callers blocked in flush(); batches go out without delay while any wait
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+    
+    def submit(self, manager: "MemoryManager", key: str, item_id: str, document: str, metadata: Dict):
+        """Queue a write to one of a manager's collections."""
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="memory-writer", daemon=True)
+                self._thread.start()
+            if not self._queue:
+                self._queued_at = time.monotonic()
+            self._queue.append((manager, key, item_id, document, metadata))
+            self._outstanding[id(manager)] = self._outstanding.get(id(manager), 0) + 1
+            self._cond.notify_all()
+    
+    def pending(self, manager: "MemoryManager") -> int:
+        """Count writes for a manager that have not been persisted yet."""
+        return self._outstanding.get(id(manager), 0)
+    
+    def flush(self, manager: Optional["MemoryManager"] = None, timeout: Optional[float] = None) -> bool:
+        """Block until a manager's writes (or all writes) are persisted."""
+        def done():
+            if manager is None:
+                return not self._outstanding
+            return not self._outstanding.get(id(manager))
+        
+        with self._cond:
+            if done():
+                return True
+            self._flushing += 1
+            self._cond.notify_all()
+            try:
+                return self._cond.wait_for(done, timeout)
+            finally:
+                self._flushing -= 1
+    
+    def _next_batch(self) -> List[tuple]:
+        """Wait until a batch is due and take it off the queue."""
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            while len(self._queue) < self.batch_size and not self._flushing:
+                remaining = self._queued_at + self.max_delay - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._queue[:self.batch_size]
+            del self._queue[:self.batch_size]
+            self._queued_at = time.monotonic()
+            return batch
+    
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            
+            # Group by target collection; a later write to the same id wins
+            groups: Dict[tuple, Dict[str, tuple]] = {}
+            for manager, key, item_id, document, metadata in batch:
+                groups.setdefault((id(manager), key), {})[item_id] = (manager, document, metadata)
+            
+            # Embed the whole batch in one call, across collections and sessions
+            embeddings: Dict[tuple, List] = {}
+            by_function: Dict[int, List[tuple]] = {}
+            for target, items in groups.items():
+                by_function.setdefault(id(next(iter(items.values()))[0].embedding_function), []).append(target)
+            for targets in by_function.values():
+                documents = [document for target in targets for _, document, _ in groups[target].values()]
+                try:
+                    vectors = next(iter(groups[targets[0]].values()))[0].embedding_function(documents)
+                except Exception:
+                    logger.exception("Failed to embed %d memory writes", len(documents))
+                    continue
+                for target in targets:
+                    embeddings[target], vectors = vectors[:len(groups[target])], vectors[len(groups[target]):]
+            
+            for target, items in groups.items():
+                manager = next(iter(items.values()))[0]
+                try:
+                    manager._write_batch(
+                        target[1],
+                        list(items),
+                        [document for _, document, _ in items.values()],
+                        [metadata for _, _, metadata in items.values()],
+                        embeddings.get(target)
+                    )
+                except Exception:
+                    logger.exception("Failed to persist %d memory writes", len(items))
+            
+            with self._cond:
+                for manager, *_ in batch:
+                    remaining = self._outstanding[id(manager)] - 1
+                    if remaining:
+                        self._outstanding[id(manager)] = remaining
+                    else:
+                        del self._outstanding[id(manager)]
+                self._cond.notify_all()
+
+
+_WRITER = MemoryWriter()
+atexit.register(_WRITER.flush)
+
+
+# Collections every campaign namespace has
+COLLECTION_KINDS = ("story_events", "characters", "locations")
+
+CAMPAIGNS_FILE = "campaigns.json"
+REGISTRY_SAVE_INTERVAL = 60.0  # seconds between saves for last-used times; deletions save at once
+
+# Deletes abandoned campaigns off the critical path; one thread keeps store writes serialized
+_GC_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-gc")
+
+
+def new_namespace() -> str:
+    """Generate a namespace for a new campaign."""
+    return f"g{uuid.uuid4().hex[:12]}"
+
+
+def collection_name(namespace: str, kind: str) -> str:
+    """Get the namespaced name of a collection."""
+    return f"{namespace}_{kind}" if namespace else kind
+
+
+class CampaignRegistry:
+    """Tracks the campaign namespaces in one store, when each was last used and which are being deleted.
+    
+    Kept in campaigns.json next to the store. Deleting a campaign only marks
+    it here and drops its collections on a background thread, so switching
+    to a new campaign costs the same however large the old one was. A
+    deletion interrupted by a crash resumes when the registry is next opened.
+    """
+    
+    def __init__(self, store: VectorStore, directory: str):
+        self.store = store
+        self.path = os.path.join(directory, CAMPAIGNS_FILE)
+        self._campaigns: Dict[str, Dict] = {}
+        self._saved_at = 0.0
+        self._deleting: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self._campaigns = json.load(f)
+        for namespace, entry in list(self._campaigns.items()):
+            if entry.get("deleting"):
+                self._deleting[namespace] = _GC_POOL.submit(self._purge, namespace)
+    
+    def _save(self):
+        """Write the registry atomically. Needs the lock."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._campaigns, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+        self._saved_at = time.monotonic()
+    
+    def touch(self, namespace: str):
+        """Record that a campaign is in use."""
+        with self._lock:
+            now = time.time()
+            new = namespace not in self._campaigns
+            entry = self._campaigns.setdefault(namespace, {"created": now})
+            entry["last_used"] = now
+            if new or time.monotonic() - self._saved_at >= REGISTRY_SAVE_INTERVAL:
+                self._save()
+    
+    def _stored_namespaces(self) -> List[str]:
+        """Namespaces that have collections in the store."""
+        namespaces = set()
+        for name in self.store.list_collections():
+            for kind in COLLECTION_KINDS:
+                if name == kind:
+                    namespaces.add("")
+                elif name.endswith(f"_{kind}"):
+                    namespaces.add(name[:-len(kind) - 1])
+        return sorted(namespaces)
+    
+    def list(self) -> List[Dict]:
+        """Describe every campaign in the store, most recently used first."""
+        with self._lock:
+            campaigns = {ns: dict(entry) for ns, entry in self._campaigns.items()}
+        for namespace in self._stored_namespaces():
+            campaigns.setdefault(namespace, {})
+        return sorted(({
+            "namespace": namespace,
+            "created": entry.get("created"),
+            "last_used": entry.get("last_used", 0.0),
+            "deleting": bool(entry.get("deleting"))
+        } for namespace, entry in campaigns.items()), key=lambda c: c["last_used"], reverse=True)
+    
+    def delete(self, namespace: str) -> Future:
+        """Mark a campaign deleted and drop its collections in the background."""
+        with self._lock:
+            if namespace in self._deleting:
+                return self._deleting[namespace]
+            self._campaigns.setdefault(namespace, {})["deleting"] = True
+            self._save()
+            future = self._deleting[namespace] = _GC_POOL.submit(self._purge, namespace)
+            return future
+    
+    def _purge(self, namespace: str):
+        _WRITER.flush()  # writes queued before the deletion must not recreate anything
+        for kind in COLLECTION_KINDS:
+            try:
+                self.store.delete_collection(collection_name(namespace, kind))
+            except Exception:
+                pass  # never created, or already gone
+        with self._lock:
+            self._deleting.pop(namespace, None)
+            if self._campaigns.get(namespace, {}).get("deleting"):
+                del self._campaigns[namespace]
+            self._save()
+    
+    def collect_garbage(self, max_idle: float = MEMORY_GC_MAX_IDLE, keep: Iterable[str] = ()) -> List[str]:
+        """Delete, in the background, campaigns unused for max_idle seconds. Returns their namespaces.
+        
+        Campaigns in keep, e.g. those with a saved game, are never collected, and
+        neither are the unprefixed collections of older data directories, which
+        predate the registry and so have no record of being used.
+        """
+        keep = set(keep) | {""}
+        cutoff = time.time() - max_idle
+        abandoned = [c["namespace"] for c in self.list()
+                     if not c["deleting"] and c["namespace"] not in keep and c["last_used"] < cutoff]
+        for namespace in abandoned:
+            self.delete(namespace)
+        return abandoned
+    
+    def wait_for(self, namespace: str):
+        """Block until a pending deletion of a namespace has finished, so it can be reused."""
+        with self._lock:
+            future = self._deleting.get(namespace)
+        if future is not None:
+            future.result()
+    
+    def wait(self, timeout: Optional[float] = None):
+        """Block until every pending deletion has finished."""
+        with self._lock:
+            pending = list(self._deleting.values())
+        for future in pending:
+            future.result(timeout)
+
+
+_registries: Dict[str, CampaignRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(store: VectorStore, directory: str) -> CampaignRegistry:
+    """Get the process-wide campaign registry for a store's directory."""
+    key = os.path.abspath(directory)
+    with _registries_lock:
+        if key not in _registries:
+            _registries[key] = CampaignRegistry(store, directory)
+        return _registries[key]
 
 
 class MemoryManager:
-    """Manages game memory using ChromaDB vector database."""
+    """Manages game memory using a vector database (ChromaDB by default)."""
     
-    def __init__(self, persist_directory: str = "./chroma_data"):
-        """Initialize the memory manager with ChromaDB."""
+    def __init__(self, persist_directory: str = MEMORY_DIRECTORY, namespace: Optional[str] = None,
+                 store: Optional[VectorStore] = None, write_behind: bool = WRITE_BEHIND):
+        """Initialize the memory manager with the configured vector store.
+        
+        Every campaign keeps its memories in collections prefixed with its
+        namespace, so many games share one store without seeing each other's
+        memories. Without a namespace a new campaign is started; "" opens the
+        unprefixed collections of older data directories. The store is shared
+        by every manager on the same directory unless one is passed in. With
+        write_behind, writes are queued and persisted in batches by a
+        background thread.
+        """
         self.persist_directory = persist_directory
+        self.namespace = new_namespace() if namespace is None else namespace
+        self.write_behind = write_behind
+        
+        # Create the vector store with persistence
+        with phase("open vector store"):
+            self.store = store or get_store(MEMORY_BACKEND, persist_directory)
+            self.registry = get_registry(self.store, persist_directory)
         
-        # Create ChromaDB client with persistence
-        self.client = chromadb.PersistentClient(path=persist_directory)
+        # Documents and queries are embedded here, so every backend sees the same vectors.
+        # Every manager shares one model; it loads at warmup() or on first use.
+        self.embedding_function = get_embedding_function()
         
-        # Create collections for different memory types
-        self.story_collection = self.client.get_or_create_collection(
-            name="story_events",
+        with phase("open collections"):
+            self._open_collections()
+        
+        # Players repeat short actions, so cache their embeddings and search results.
+        # A collection's result cache is cleared whenever that collection is written.
+        self._embedding_cache = LRUCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL)
+        self._query_caches = {key: LRUCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL) for key in self._sizes}
+        self.search_counts = {"lexical": 0, "hybrid": 0}  # searches answered without and with the embedding
+    
+    def _open_collections(self):
+        """Open the collections for each memory type."""
+        self.story_collection = self.store.get_or_create_collection(
+            name=self._collection_name("story_events"),
             metadata={"description": "Story events and narrative moments"}
         )
         
-        self.character_collection = self.client.get_or_create_collection(
-            name="characters",
+        self.character_collection = self.store.get_or_create_collection(
+            name=self._collection_name("characters"),
             metadata={"description": "Character information and NPCs"}
         )
         
-        self.location_collection = self.client.get_or_create_collection(
-            name="locations",
+        self.location_collection = self.store.get_or_create_collection(
+            name=self._collection_name("locations"),
             metadata={"description": "Visited locations and their descriptions"}
         )
+        
+        # Collection sizes, kept up to date by the write methods
+        self._sizes = {key: collection.count() for key, collection in self._collections().items()}
+        self.registry.touch(self.namespace)
+        
+        # Rebuild the lexical indexes from what the campaign already stored
+        self._lexical = {key: LexicalIndex() for key in self._sizes}
+        for key, collection in self._collections().items():
+            if self._sizes[key]:
+                items = collection.get(include=["documents", "metadatas"])
+                self._lexical[key].upsert(items["ids"], items["documents"], items["metadatas"])
+    
+    def warmup(self):
+        """Load the embedding model now rather than on the first query."""
+        with phase("warm up embedding model"):
+            self.embedding_function.warmup()
+    
+    def _collection_name(self, name: str) -> str:
+        """Get the namespaced name of a collection."""
+        return collection_name(self.namespace, name)
+    
+    def _collections(self) -> Dict:
+        """Map result keys to their collections."""
+        return {
+            "story": self.story_collection,
+            "characters": self.character_collection,
+            "locations": self.location_collection
+        }
+    
+    def _refresh_size(self, key: str):
+        """Re-read the size of a collection after a write and invalidate its cached results."""
+        self._sizes[key] = self._collections()[key].count()
+        self._query_caches[key].clear()
+    
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        """Normalize a query so trivially different spellings share cache entries."""
+        return " ".join(query.lower().split())
+    
+    def embed_query(self, query: str) -> List[float]:
+        """Embed a query once so it can be reused across collections."""
+        key = self._normalize_query(query)
+        embedding = self._embedding_cache.get(key)
+        if embedding is None:
+            embedding = self.embedding_function([key])[0]
+            self._embedding_cache.put(key, embedding)
+        return embedding
+    
+    def cache_stats(self) -> Dict[str, Dict]:
+        """Get hit/miss counters for the embedding and per-collection result caches."""
+        stats = {"embeddings": self._embedding_cache.stats()}
+        for key, cache in self._query_caches.items():
+            stats[key] = cache.stats()
+        stats["searches"] = dict(self.search_counts)
+        return stats
+    
+    def _write(self, key: str, item_id: str, document: str, metadata: Dict):
+        """Write one item now, or queue it for the background writer."""
+        if self.write_behind:
+            self._query_caches[key].clear()
+            _WRITER.submit(self, key, item_id, document, metadata)
+        else:
+            self._write_batch(key, [item_id], [document], [metadata])
+    
+    def _write_batch(self, key: str, ids: List[str], documents: List[str], metadatas: List[Dict],
+                     embeddings: Optional[List] = None):
+        """Add or update several items in one collection with a single upsert."""
+        self._collections()[key].upsert(
+            ids=ids,
+            embeddings=embeddings if embeddings is not None else self.embedding_function(documents),
+            documents=documents,
+            metadatas=metadatas
+        )
+        self._lexical[key].upsert(ids, documents, metadatas)
+        self._refresh_size(key)
+        self.registry.touch(self.namespace)
+        if key == "story":
+            self._consolidate()
+    
+    def _consolidate(self):
+        """Keep story memory bounded.
+        
+        Once there are more than MAX_MEMORY_ITEMS raw events, the oldest are
+        folded CHAPTER_TURNS at a time into chapter documents, which keep the
+        start of each event's narration, and deleted.
+        Past MAX_CHAPTERS, the two oldest chapters are merged into one, so the
+        collection never holds much more than MAX_MEMORY_ITEMS + MAX_CHAPTERS items.
+        """
+        collection = self.story_collection
+        raw = collection.get(where={"type": "story_event"}, include=["documents", "metadatas"])
+        if len(raw["ids"]) > MAX_MEMORY_ITEMS:
+            events = sorted(zip(raw["ids"], raw["documents"], raw["metadatas"]), key=lambda e: _turn_span(e[2]))
+            chapters_due = -(-(len(events) - MAX_MEMORY_ITEMS) // CHAPTER_TURNS)
+            folded = events[:chapters_due * CHAPTER_TURNS]
+            for start in range(0, len(folded), CHAPTER_TURNS):
+                chunk = folded[start:start + CHAPTER_TURNS]
+                per_event = CHAPTER_MAX_CHARS // len(chunk)
+                self._write_chapter([meta for _, _, meta in chunk],
+                                    [_event_gist(doc, per_event) for _, doc, _ in chunk])
+            collection.delete(ids=[item_id for item_id, _, _ in folded])
+            self._lexical["story"].delete(item_id for item_id, _, _ in folded)
+        
+        chapters = collection.get(where={"type": "chapter"}, include=["documents", "metadatas"])
+        if len(chapters["ids"]) > MAX_CHAPTERS:
+            ordered = sorted(zip(chapters["ids"], chapters["documents"], chapters["metadatas"]),
+                             key=lambda c: _turn_span(c[2]))
+            excess = len(ordered) - MAX_CHAPTERS
+            merged = ordered[:excess + 1]
+            per_chapter = CHAPTER_MAX_CHARS // len(merged)
+            self._write_chapter([meta for _, _, meta in merged],
+                                [_chapter_gist(doc, per_chapter) for _, doc, _ in merged])
+            collection.delete(ids=[item_id for item_id, _, _ in merged])
+            self._lexical["story"].delete(item_id for item_id, _, _ in merged)
+        
+        self._refresh_size("story")
+    
+    def _write_chapter(self, metadatas: List[Dict], parts: List[str]):
+        """Store one chapter covering the turns of the given events or chapters."""
+        start = _turn_span(metadatas[0])[0]
+        end = max(_turn_span(meta)[1] for meta in metadatas)
+        document = f"CHAPTER (turns {start}-{end}): " + " ".join(parts)
+        meta = {"type": "chapter", "turn_start": start, "turn_end": end}
+        locations = [m["location"] for m in metadatas if m.get("location")]
+        if locations:
+            meta["location"] = locations[-1]
+        self.story_collection.upsert(
+            ids=[f"chapter_{start}_{end}"],
+            embeddings=self.embedding_function([document]),
+            documents=[document],
+            metadatas=[meta]
+        )
+        self._lexical["story"].upsert([f"chapter_{start}_{end}"], [document], [meta])
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every queued write from this manager is persisted."""
+        return _WRITER.flush(self, timeout)
     
     def add_story_event(self, event_id: str, event_text: str, metadata: Optional[Dict] = None):
         """Add a story event to memory."""
         meta = metadata or {}
         meta["type"] = "story_event"
+        if "turn" in meta:
+            meta.setdefault("turn_start", meta["turn"])
+            meta.setdefault("turn_end", meta["turn"])
         
-        self.story_collection.add(
-            ids=[event_id],
-            documents=[event_text],
-            metadatas=[meta]
-        )
+        self._write("story", event_id, event_text, meta)
     
     def add_character(self, char_id: str, char_info: str, metadata: Optional[Dict] = None):
         """Add or update character information."""
         meta = metadata or {}
         meta["type"] = "character"
         
-        # Try to update existing, otherwise add new
-        try:
-            self.character_collection.update(
-                ids=[char_id],
-                documents=[char_info],
-                metadatas=[meta]
-            )
-        except:
-            self.character_collection.add(
-                ids=[char_id],
-                documents=[char_info],
-                metadatas=[meta]
-            )
+        self._write("characters", char_id, char_info, meta)
     
     def add_location(self, loc_id: str, loc_description: str, metadata: Optional[Dict] = None):
         """Add a location to memory."""
         meta = metadata or {}
         meta["type"] = "location"
         
-        try:
-            self.location_collection.update(
-                ids=[loc_id],
-                documents=[loc_description],
-                metadatas=[meta]
-            )
-        except:
-            self.location_collection.add(
-                ids=[loc_id],
-                documents=[loc_description],
-                metadatas=[meta]
-            )
-    
-    def search_relevant_memories(self, query: str, n_results: int = 5) -> Dict[str, List[str]]:
-        """Search all collections for relevant memories."""
+        self._write("locations", loc_id, loc_description, meta)
+    
+    def list_entries(self, key: str) -> List[Tuple[str, str, Dict]]:
+        """Get every stored item of one collection as (id, document, metadata)."""
+        self.flush()
+        items = self._collections()[key].get(include=["documents", "metadatas"])
+        return list(zip(items["ids"], items["documents"], items["metadatas"]))
+    
+    @staticmethod
+    def _filters(turn_range: Optional[Tuple[int, int]] = None, location: Optional[str] = None,
+                 is_player: Optional[bool] = None) -> Dict[str, Optional[Dict]]:
+        """Build the metadata filter for each collection."""
+        clauses = {"story": [], "characters": [], "locations": []}
+        if turn_range is not None:
+            # Events cover one turn and chapters a range; keep anything overlapping
+            clauses["story"] += [{"turn_start": {"$lte": turn_range[1]}}, {"turn_end": {"$gte": turn_range[0]}}]
+        if location is not None:
+            clauses["story"].append({"location": location})
+            clauses["locations"].append({"name": location})
+        if is_player is not None:
+            clauses["characters"].append({"is_player": is_player})
+        return {
+            key: (None if not found else found[0] if len(found) == 1 else {"$and": found})
+            for key, found in clauses.items()
+        }
+    
+    def search_relevant_memories(self, query: str, n_results: Union[int, Dict[str, int]] = 5,
+                                 turn_range: Optional[Tuple[int, int]] = None, location: Optional[str] = None,
+                                 is_player: Optional[bool] = None) -> Dict[str, List[str]]:
+        """Search all collections for relevant memories.
+        
+        With HYBRID_SEARCH, each collection's lexical (BM25) matches are fused
+        with its nearest vectors. A query that names a known NPC or location
+        is answered from the lexical matches alone, without embedding it.
+        Otherwise the query is embedded once and the collections are searched
+        concurrently. n_results may be a single limit or a per-collection dict keyed like the result.
+        turn_range (inclusive), location and is_player narrow the search to
+        matching story events and chapters, locations and characters.
+        """
         results = {
             "story": [],
             "characters": [],
             "locations": []
         }
         
-        # Search story events
-        if self.story_collection.count() > 0:
-            story_results = self.story_collection.query(
-                query_texts=[query],
-                n_results=min(n_results, self.story_collection.count())
-            )
-            results["story"] = story_results["documents"][0] if story_results["documents"] else []
-        
-        # Search characters
-        if self.character_collection.count() > 0:
-            char_results = self.character_collection.query(
-                query_texts=[query],
-                n_results=min(n_results, self.character_collection.count())
-            )
-            results["characters"] = char_results["documents"][0] if char_results["documents"] else []
-        
-        # Search locations
-        if self.location_collection.count() > 0:
-            loc_results = self.location_collection.query(
-                query_texts=[query],
-                n_results=min(n_results, self.location_collection.count())
-            )
-            results["locations"] = loc_results["documents"][0] if loc_results["documents"] else []
+        # Read-your-writes: anything still queued must land before we search
+        if _WRITER.pending(self):
+            self.flush()
+        
+        limits = n_results if isinstance(n_results, dict) else {key: n_results for key in results}
+        filters = self._filters(turn_range, location, is_player)
+        normalized = self._normalize_query(query)
+        targets = {}
+        for key, collection in self._collections().items():
+            n = min(limits.get(key, 0), self._sizes[key])
+            if n <= 0:
+                continue
+            cache_key = (normalized, n, json.dumps(filters[key], sort_keys=True))
+            cached = self._query_caches[key].get(cache_key)
+            if cached is not None:
+                results[key] = cached
+            else:
+                targets[key] = (collection, n, cache_key)
+        
+        if not targets:
+            return results
+        
+        lexical = {}
+        if HYBRID_SEARCH:
+            terms = tokenize(query)
+            lexical = {key: self._lexical[key].search(terms, n, filters[key]) for key, (_, n, _) in targets.items()}
+            if self._lexical["characters"].named_in(terms) or self._lexical["locations"].named_in(terms):
+                self.search_counts["lexical"] += 1
+                for key, hits in lexical.items():
+                    results[key] = [document for _, _, document in hits]
+                    self._query_caches[key].put(targets[key][2], results[key])
+                return results
+            self.search_counts["hybrid"] += 1
+        
+        embedding = self.embed_query(query)
+        futures = {
+            key: _QUERY_POOL.submit(collection.query, query_embeddings=[embedding], n_results=n, where=filters[key])
+            for key, (collection, n, _) in targets.items()
+        }
+        
+        for key, future in futures.items():
+            query_results = future.result()
+            documents = query_results["documents"][0] if query_results["documents"] else []
+            if lexical.get(key):
+                vector = list(zip(query_results["ids"][0], documents))
+                documents = fuse([[(item_id, document) for item_id, _, document in lexical[key]], vector],
+                                 targets[key][1], HYBRID_RRF_K)
+            results[key] = documents
+            self._query_caches[key].put(targets[key][2], results[key])
         
         return results
     
-    def get_context_string(self, query: str) -> str:
-        """Get a formatted context string for the LLM."""
-        memories = self.search_relevant_memories(query)
-        
+    def get_context_string(self, query: str, **filters) -> str:
+        """Get a formatted context string for the LLM. Takes the same filters as search_relevant_memories."""
+        return self.format_context(self.search_relevant_memories(query, **filters))
+    
+    @staticmethod
+    def format_context(memories: Dict[str, List[str]]) -> str:
+        """Format retrieved memories as a context block for the LLM."""
         context_parts = []
         
         if memories["characters"]:
@@ -131,16 +674,144 @@ class MemoryManager:
         
         return "\n\n".join(context_parts) if context_parts else "No previous context available."
     
+    def use_namespace(self, namespace: str):
+        """Switch to another namespace's collections, reattaching stored memories as they are."""
+        self.flush()
+        self.registry.wait_for(namespace)
+        self.namespace = namespace
+        self._open_collections()
+        for cache in self._query_caches.values():
+            cache.clear()
+    
+    def start_campaign(self, namespace: Optional[str] = None) -> str:
+        """Switch to a new, empty campaign. Returns its namespace.
+        
+        Only three empty collections are opened, so this takes the same time
+        however much the previous campaign stored.
+        """
+        self.use_namespace(namespace or new_namespace())
+        return self.namespace
+    
+    def delete_namespace(self, namespace: str):
+        """Delete a campaign's memories in the background."""
+        if namespace == self.namespace:
+            raise ValueError("Cannot delete the namespace in use; switch campaigns first")
+        self.registry.delete(namespace)
+    
+    def export_campaign(self, path: str, game_state: Optional["GameState"] = None,
+                        batch_size: int = ARCHIVE_BATCH_SIZE) -> Dict[str, int]:
+        """Write the current campaign's memories, vectors included, and optionally its GameState to an archive.
+        
+        Each collection is read and written batch_size items at a time, so
+        memory use doesn't grow with the campaign; the file only appears
+        once it is complete. See archive.py for the format. Returns the
+        number of items exported per collection.
+        """
+        self.flush()
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                writer = ArchiveWriter(f)
+                writer.write_state({
+                    "namespace": self.namespace,
+                    "exported_at": time.time(),
+                    "game_state": game_state.to_dict() if game_state is not None else None
+                })
+                for key, collection in self._collections().items():
+                    offset = 0
+                    while True:
+                        items = collection.get(limit=batch_size, offset=offset,
+                                               include=["documents", "metadatas", "embeddings"])
+                        if not items["ids"]:
+                            break
+                        writer.write_rows(key, items["ids"], items["documents"], items["metadatas"],
+                                          items["embeddings"])
+                        offset += len(items["ids"])
+                writer.finish()
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass  # never created
+            raise
+        return dict(writer.counts)
+    
+    def import_campaign(self, path: str, namespace: Optional[str] = None,
+                        batch_size: int = ARCHIVE_BATCH_SIZE) -> Optional["GameState"]:
+        """Load an archive into a new campaign (or the given namespace) and switch to it.
+        
+        Items are upserted a frame at a time with their archived vectors;
+        nothing is re-embedded. Returns the archived GameState, if there
+        was one. If the archive is damaged or its vectors don't match the
+        embedding model, the partly imported campaign is deleted and this
+        manager goes back to the campaign it was on.
+        """
+        previous = self.namespace
+        self.start_campaign(namespace)
+        game_state = None
+        dimensions = None
+        try:
+            with open(path, "rb") as f:
+                for kind, frame in read_archive(f):
+                    if kind == "state":
+                        if frame.get("game_state") is not None:
+                            game_state = GameState()
+                            game_state.from_dict(frame["game_state"])
+                        continue
+                    if dimensions is None:
+                        dimensions = len(self.embed_query("dimensions"))
+                    if frame["dim"] != dimensions:
+                        raise ValueError(f"Archived vectors have {frame['dim']} dimensions, but the embedding "
+                                         f"model makes {dimensions}; import with the model that exported them")
+                    key = frame["collection"]
+                    for start in range(0, frame["rows"], batch_size):
+                        end = start + batch_size
+                        self._collections()[key].upsert(
+                            ids=frame["ids"][start:end],
+                            embeddings=frame["embeddings"][start:end],
+                            documents=frame["documents"][start:end],
+                            metadatas=frame["metadatas"][start:end]
+                        )
+                        self._lexical[key].upsert(frame["ids"][start:end], frame["documents"][start:end],
+                                                  frame["metadatas"][start:end])
+        except Exception:
+            failed = self.namespace
+            self.use_namespace(previous)
+            if failed != previous:
+                self.delete_namespace(failed)
+            raise
+        for key in self._sizes:
+            self._refresh_size(key)
+        self.registry.touch(self.namespace)
+        return game_state
+    
+    def list_namespaces(self) -> List[Dict]:
+        """Describe every campaign in the store, most recently used first."""
+        return self.registry.list()
+    
+    def collect_garbage(self, max_idle: float = MEMORY_GC_MAX_IDLE, keep: Iterable[str] = ()) -> List[str]:
+        """Delete, in the background, campaigns unused for max_idle seconds. Returns their namespaces.
+        
+        The current campaign and those in keep are never collected.
+        """
+        return self.registry.collect_garbage(max_idle, set(keep) | {self.namespace})
+    
     def clear_all(self):
-        """Clear all memories (for new game)."""
-        self.client.delete_collection("story_events")
-        self.client.delete_collection("characters")
-        self.client.delete_collection("locations")
+        """Clear all of the current campaign's memories now.
+        
+        Takes time proportional to what is stored; start_campaign() followed
+        by delete_namespace() does the same without the wait.
+        """
+        self.flush()
+        self.store.delete_collection(self._collection_name("story_events"))
+        self.store.delete_collection(self._collection_name("characters"))
+        self.store.delete_collection(self._collection_name("locations"))
         
         # Recreate collections
-        self.story_collection = self.client.get_or_create_collection(name="story_events")
-        self.character_collection = self.client.get_or_create_collection(name="characters")
-        self.location_collection = self.client.get_or_create_collection(name="locations")
+        self._open_collections()
+        for cache in self._query_caches.values():
+            cache.clear()
 
 
 class GameState:
@@ -152,6 +823,8 @@ class GameState:
         self.turn_count = 0
         self.story_summary = []
         self.active_quests = []
+        self.synopsis = ""
+        self.setting = ""
     
     def set_character(self, name: str, race: str, char_class: str, backstory: str):
         """Set player character details."""
@@ -187,7 +860,9 @@ class GameState:
             "current_location": self.current_location,
             "turn_count": self.turn_count,
             "story_summary": self.story_summary,
-            "active_quests": self.active_quests
+            "active_quests": self.active_quests,
+            "synopsis": self.synopsis,
+            "setting": self.setting
         }
     
     def from_dict(self, data: Dict):
@@ -197,3 +872,5 @@ class GameState:
         self.turn_count = data.get("turn_count", 0)
         self.story_summary = data.get("story_summary", [])
         self.active_quests = data.get("active_quests", [])
+        self.synopsis = data.get("synopsis", "")
+        self.setting = data.get("setting", "")
@@ -0,0 +1,56 @@
+"""Startup phase timing for --profile-startup.
+
+Phases are only recorded until finish() is called once startup is over,
+and at most MAX_PHASES of them, so code that also runs later (opening a
+session's memory, for one) doesn't grow the record forever.
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, List
+
+MAX_PHASES = 500
+
+_process_start = time.perf_counter()
+_phases: Deque[Dict] = deque(maxlen=MAX_PHASES)
+_finished = False
+_lock = threading.Lock()
+
+
+@contextmanager
+def phase(name: str):
+    """Time a named startup phase."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        with _lock:
+            if not _finished:
+                _phases.append({
+                    "phase": name,
+                    "thread": threading.current_thread().name,
+                    "start": start - _process_start,
+                    "duration": end - start
+                })
+
+
+def mark(name: str):
+    """Record a zero-length phase at the current moment."""
+    with phase(name):
+        pass
+
+
+def finish():
+    """Stop recording phases; startup is over."""
+    global _finished
+    with _lock:
+        _finished = True
+
+
+def report() -> List[Dict]:
+    """Get every recorded phase in start order. Times are in seconds."""
+    with _lock:
+        return sorted(_phases, key=lambda p: p["start"])
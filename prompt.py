@@ -0,0 +1,208 @@
+"""Token-budgeted prompt assembly for story turns."""
+
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from config import (
+    MODEL_NAME,
+    PROMPT_TOKEN_BUDGETS,
+    DEFAULT_PROMPT_TOKEN_BUDGET,
+    PROMPT_LAYOUT,
+    HISTORY_WINDOW,
+    HISTORY_CHUNK_TURNS
+)
+from memory import MemoryManager
+
+# Per-message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+ACTION_INSTRUCTIONS = ("Continue the story based on this action. Remember to maintain consistency with all "
+                       "previous events and character details. Create consequences for the player's choice "
+                       "and present new options.")
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    """Get the tiktoken encoding for a model, or None if tiktoken isn't installed."""
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: str = MODEL_NAME) -> int:
+    """Count the tokens in a piece of text, estimating if tiktoken isn't installed."""
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+def message_tokens(message: Dict, model: str = MODEL_NAME) -> int:
+    """Count the tokens a chat message costs."""
+    return count_tokens(message["content"], model) + MESSAGE_OVERHEAD_TOKENS
+
+
+def campaign_sheet(setting: str, character_summary: str) -> str:
+    """The campaign's setting and player character, which stay the same all game."""
+    return f"""SETTING: {setting or "a mysterious fantasy world"}
+
+PLAYER CHARACTER:
+{character_summary}"""
+
+
+def _snippet_body(snippet: str) -> str:
+    """Get the part of a memory snippet that would be copied from narration."""
+    body = snippet[:-3] if snippet.endswith("...") else snippet
+    for marker in ("Result: ", "Adventure begins: "):
+        if marker in body:
+            body = body.split(marker, 1)[1]
+    return body.strip()
+
+
+class PromptAssembler:
+    """Builds turn prompts that fit a hard token budget.
+    
+    The budget is filled by priority: system prompt, character, story
+    synopsis, recent turns (newest first), then retrieved memories. Memories that already appear
+    verbatim in the included history are dropped.
+    
+    The "classic" layout puts the retrieved context and character in the
+    final user message. The "cache" layout orders messages from most to
+    least stable (system prompt, campaign sheet, synopsis, history, then
+    context and action) and trims history a whole chunk of turns at a time,
+    so consecutive turns share a long byte-identical prefix that providers
+    can serve from their prompt cache.
+    """
+    
+    def __init__(self, model: str = MODEL_NAME, budget: Optional[int] = None, layout: str = PROMPT_LAYOUT,
+                 chunk_turns: int = HISTORY_CHUNK_TURNS):
+        if layout not in ("classic", "cache"):
+            raise ValueError(f"Unknown prompt layout: {layout}")
+        self.model = model
+        self.budget = budget or PROMPT_TOKEN_BUDGETS.get(model, DEFAULT_PROMPT_TOKEN_BUDGET)
+        self.layout = layout
+        self.chunk_turns = chunk_turns
+        self.last_prompt_tokens = 0
+    
+    def _tokens(self, message: Dict, model: Optional[str] = None) -> int:
+        return message_tokens(message, model or self.model)
+    
+    def budget_for(self, models: Optional[List[str]] = None) -> int:
+        """The prompt budget for a call that may go to any of models: the smallest of theirs.
+        
+        Without models, or for this assembler's own model, it is the assembler's budget.
+        """
+        if not models or models == [self.model]:
+            return self.budget
+        return min(self.budget if model == self.model
+                   else PROMPT_TOKEN_BUDGETS.get(model, DEFAULT_PROMPT_TOKEN_BUDGET) for model in models)
+    
+    def _action_prompt(self, context: str, character_summary: str, player_action: str) -> str:
+        if self.layout == "cache":
+            return f"""GAME CONTEXT:
+{context}
+
+PLAYER ACTION: {player_action}
+
+{ACTION_INSTRUCTIONS}"""
+        return f"""GAME CONTEXT:
+{context}
+
+PLAYER CHARACTER:
+{character_summary}
+
+PLAYER ACTION: {player_action}
+
+{ACTION_INSTRUCTIONS}"""
+
+    def history_overflow(self, length: int, window: int = HISTORY_WINDOW) -> int:
+        """Messages to evict from the front of a history of length messages; 0 if it fits the window.
+        
+        The cache layout evicts whole chunks, so the history prefix only changes every few turns.
+        """
+        excess = length - window
+        if excess <= 0:
+            return 0
+        if self.layout == "cache":
+            chunk = 2 * self.chunk_turns
+            excess = -(-excess // chunk) * chunk
+        return excess
+    
+    def _chunks(self, history: List[Dict]) -> List[List[Dict]]:
+        """Split history into chunks of chunk_turns turns, counted from its oldest message."""
+        size = max(1, self.chunk_turns) * 2
+        return [history[i:i + size] for i in range(0, len(history), size)]
+    
+    def build_action_messages(self, system_prompt: str, character_summary: str, history: List[Dict],
+                              memories: Dict[str, List[str]], player_action: str, synopsis: str = "",
+                              setting: str = "", models: Optional[List[str]] = None) -> List[Dict]:
+        """Assemble the messages for a player action within the token budget.
+        
+        models are those the call may be sent to, the routed model first;
+        tokens are counted for it and the budget is budget_for(models).
+        """
+        model = models[0] if models else self.model
+        budget = self.budget_for(models)
+        system = {"role": "system", "content": system_prompt}
+        bare_prompt = self._action_prompt("No previous context available.", character_summary, player_action)
+        used = self._tokens(system, model) + self._tokens({"role": "user", "content": bare_prompt}, model)
+        
+        preamble = [system]
+        if self.layout == "cache":
+            sheet = {"role": "system", "content": campaign_sheet(setting, character_summary)}
+            preamble.append(sheet)
+            used += self._tokens(sheet, model)
+        
+        # Everything older than the history window, folded into one compact message
+        if synopsis:
+            summary = {"role": "system", "content": f"STORY SO FAR:\n{synopsis}"}
+            if used + self._tokens(summary, model) <= budget:
+                preamble.append(summary)
+                used += self._tokens(summary, model)
+        
+        # Recent turns, newest first, keeping user/assistant pairs together.
+        # The cache layout drops whole chunks from the oldest end instead, so the kept prefix doesn't move.
+        included: List[Dict] = []
+        i = 0 if self.layout == "cache" else len(history)
+        for chunk in reversed(self._chunks(history) if self.layout == "cache" else []):
+            cost = sum(self._tokens(m, model) for m in chunk)
+            if used + cost > budget:
+                break
+            included[:0] = chunk
+            used += cost
+        while i > 0:
+            start = i - 2 if i >= 2 and history[i - 2]["role"] == "user" else i - 1
+            turn = history[start:i]
+            cost = sum(self._tokens(m, model) for m in turn)
+            if used + cost > budget:
+                break
+            included[:0] = turn
+            used += cost
+            i = start
+        
+        # Retrieved memories, once each, skipping what the history already says
+        history_text = "\n".join(m["content"] for m in included)
+        seen = set()
+        selected = {"story": [], "characters": [], "locations": []}
+        for key in ("characters", "locations", "story"):
+            for snippet in memories.get(key, []):
+                body = _snippet_body(snippet)
+                if snippet in seen or (body and body in history_text):
+                    continue
+                cost = count_tokens(snippet, model) + 1
+                if used + cost > budget:
+                    continue
+                seen.add(snippet)
+                selected[key].append(snippet)
+                used += cost
+        
+        context = MemoryManager.format_context(selected)
+        prompt = {"role": "user", "content": self._action_prompt(context, character_summary, player_action)}
+        messages = preamble + included + [prompt]
+        self.last_prompt_tokens = sum(self._tokens(m, model) for m in messages)
+        return messages
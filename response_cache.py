@@ -0,0 +1,143 @@
+"""Content-addressed on-disk cache of LLM responses for record/replay."""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from config import LLM_CACHE_MODE, LLM_CACHE_PATH, LLM_CACHE_MAX_BYTES
+
+MODES = ("off", "read-through", "record", "replay-only")
+
+
+class CacheMiss(Exception):
+    """Raised in replay-only mode when a request has no recorded response."""
+
+
+class ResponseCache:
+    """Append-only JSON-lines store of responses keyed by a hash of the request.
+    
+    Modes:
+        off           - never read or write
+        read-through  - serve hits, call the API and store misses
+        record        - always call the API and store the response
+        replay-only   - serve hits and raise CacheMiss instead of calling the API
+    
+    Only an in-memory index of offsets is kept. When the file grows past
+    max_bytes the oldest records are dropped until it is half that size.
+    """
+    
+    def __init__(self, path: str = LLM_CACHE_PATH, mode: str = LLM_CACHE_MODE, max_bytes: int = LLM_CACHE_MAX_BYTES):
+        if mode not in MODES:
+            raise ValueError(f"Unknown LLM cache mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._index: Dict[str, Tuple[int, int]] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        if mode != "off":
+            self._load()
+    
+    @property
+    def reads(self) -> bool:
+        return self.mode in ("read-through", "replay-only")
+    
+    @property
+    def writes(self) -> bool:
+        return self.mode in ("read-through", "record")
+    
+    @staticmethod
+    def key(model: str, messages: List[Dict], temperature: float, max_tokens: int) -> str:
+        """Hash a request into its cache key."""
+        payload = json.dumps(
+            {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+            sort_keys=True,
+            separators=(",", ":")
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def _load(self):
+        """Index the records already on disk; later records win."""
+        if not os.path.exists(self.path):
+            return
+        offset = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    self._index[json.loads(line)["key"]] = (offset, len(line))
+                except (ValueError, KeyError):
+                    pass  # torn write at the end of the file
+                offset += len(line)
+        self._size = offset
+    
+    def get(self, key: str) -> Optional[str]:
+        """Get a recorded response, or None."""
+        with self._lock:
+            location = self._index.get(key)
+            if location is None:
+                self.misses += 1
+                return None
+            with open(self.path, "rb") as f:
+                f.seek(location[0])
+                record = json.loads(f.read(location[1]))
+            self.hits += 1
+            return record["response"]
+    
+    def put(self, key: str, response: str):
+        """Append a response, evicting the oldest records if the file is too big."""
+        line = (json.dumps({"key": key, "response": response}) + "\n").encode("utf-8")
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "ab") as f:
+                f.write(line)
+            self._index[key] = (self._size, len(line))
+            self._size += len(line)
+            if self._size > self.max_bytes:
+                self._evict()
+    
+    def _evict(self):
+        """Rewrite the file with the newest records that fit in half of max_bytes. Needs the lock."""
+        keep = []
+        total = 0
+        for key, (offset, length) in sorted(self._index.items(), key=lambda item: -item[1][0]):
+            if total + length > self.max_bytes // 2:
+                break
+            keep.append((offset, length))
+            total += length
+        keep.reverse()
+        
+        tmp_path = self.path + ".tmp"
+        index = {}
+        with open(self.path, "rb") as src, open(tmp_path, "wb") as dst:
+            for offset, length in keep:
+                src.seek(offset)
+                line = src.read(length)
+                index[json.loads(line)["key"]] = (dst.tell(), length)
+                dst.write(line)
+        os.replace(tmp_path, self.path)
+        self._index = index
+        self._size = total
+    
+    def stats(self) -> Dict:
+        """Get the mode, entry count, file size and hit/miss counters."""
+        return {"mode": self.mode, "entries": len(self._index), "bytes": self._size,
+                "hits": self.hits, "misses": self.misses}
+
+
+_shared: Optional[ResponseCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Get the process-wide cache configured in config.py."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = ResponseCache()
+        return _shared
@@ -0,0 +1,120 @@
+"""Routes each LLM call to a model tier and keeps per-route latency and token metrics."""
+
+import re
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from config import MODEL_TIERS, MODEL_ROUTES, ROUTINE_ACTION_WORDS
+from telemetry import percentile
+
+LATENCY_SAMPLES = 500  # per route, for the percentiles
+
+NUMBERED_CHOICE = re.compile(r"^\s*\d+[.)]?\s*$")
+
+# Verbs that usually turn a scene, so the action gets the strong tier however short it is
+PIVOTAL_WORDS = {
+    "attack", "fight", "kill", "duel", "betray", "sacrifice", "confront", "cast", "steal", "flee", "surrender",
+    "propose", "confess", "reveal", "destroy", "summon", "assassinate", "ambush", "challenge", "negotiate",
+    "accuse", "marry", "execute", "unleash"
+}
+
+
+class Route:
+    """Where one call goes: the route's tier, model, response budget, deadline and fallback."""
+    
+    def __init__(self, name: str, tier: str, model: str, max_tokens: int, timeout: float,
+                 fallback: Optional[str] = None):
+        self.name = name
+        self.tier = tier
+        self.model = model
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        self.fallback = fallback if fallback != model else None
+    
+    @property
+    def models(self) -> List[str]:
+        """The model to try, then its fallback if it has one."""
+        return [self.model] + ([self.fallback] if self.fallback else [])
+
+
+class ModelRouter:
+    """Picks a model tier per call.
+    
+    Narration is routed as "opening" when there is no player action, as
+    "turn" for numbered choices and short routine actions, and as "pivotal"
+    otherwise; other calls are routed by their call type ("summary",
+    "character", "speculative"). routes maps route names to tiers, and
+    unknown routes use the "fast" tier.
+    """
+    
+    def __init__(self, tiers: Optional[Dict[str, Dict]] = None, routes: Optional[Dict[str, str]] = None,
+                 routine_words: int = ROUTINE_ACTION_WORDS):
+        self.tiers = tiers or MODEL_TIERS
+        self.routes = routes or MODEL_ROUTES
+        self.routine_words = routine_words
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+    
+    def classify(self, action: str) -> str:
+        """Route name for a player action: "turn" if routine, "pivotal" otherwise."""
+        if NUMBERED_CHOICE.match(action):
+            return "turn"
+        words = re.findall(r"[a-z']+", action.lower())
+        if len(words) <= self.routine_words and not PIVOTAL_WORDS.intersection(words):
+            return "turn"
+        return "pivotal"
+    
+    def route(self, call_type: str, action: Optional[str] = None) -> Route:
+        """Get the route for a call."""
+        if call_type == "narration":
+            name = "opening" if action is None else self.classify(action)
+        else:
+            name = call_type
+        tier_name = self.routes.get(name, "fast")
+        tier = self.tiers[tier_name]
+        return Route(name, tier_name, tier["model"], tier["max_tokens"], tier["timeout"], tier.get("fallback"))
+    
+    def record(self, route: Route, seconds: float, usage=None, model: Optional[str] = None, failed: bool = False):
+        """Account for a finished call on a route; model is the one that answered."""
+        with self._lock:
+            counts = self._counts.setdefault(route.name, {
+                "tier": route.tier, "calls": 0, "failures": 0, "fallbacks": 0,
+                "prompt_tokens": 0, "completion_tokens": 0, "models": {}
+            })
+            counts["calls"] += 1
+            if failed:
+                counts["failures"] += 1
+                return
+            self._latencies.setdefault(route.name, deque(maxlen=LATENCY_SAMPLES)).append(seconds)
+            model = model or route.model
+            if model != route.model:
+                counts["fallbacks"] += 1
+            counts["models"][model] = counts["models"].get(model, 0) + 1
+            if usage is not None:
+                counts["prompt_tokens"] += usage.prompt_tokens or 0
+                counts["completion_tokens"] += usage.completion_tokens or 0
+    
+    def stats(self) -> Dict[str, Dict]:
+        """Per-route call counts, p50/p95 latency and token totals."""
+        with self._lock:
+            stats = {}
+            for name, counts in self._counts.items():
+                latencies = list(self._latencies.get(name, ()))
+                stats[name] = {**counts, "models": dict(counts["models"]),
+                               "p50": percentile(latencies, 50), "p95": percentile(latencies, 95)}
+            return stats
+
+
+_shared: Optional[ModelRouter] = None
+_shared_lock = threading.Lock()
+
+
+def get_router() -> ModelRouter:
+    """Get the process-wide router, so route metrics cover every storyteller."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = ModelRouter()
+        return _shared
@@ -0,0 +1,399 @@
+"""Process-wide scheduling of LLM requests under one API key's rate limits.
+
+Every attempt the transport makes first draws one request and its
+estimated tokens from two token buckets, sized by the requests-per-minute
+and tokens-per-minute limits. When the buckets run dry callers queue:
+interactive calls (the player's turns) always go before background ones
+(summaries, speculative branches), and within a class sessions take turns
+so one busy campaign can't starve the others. The buckets follow the
+provider's x-ratelimit-* headers, and a 429 holds every caller back for
+its Retry-After.
+"""
+
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Set
+
+from config import (
+    LLM_RPM,
+    LLM_TPM,
+    BACKGROUND_ROUTES,
+    BACKGROUND_RESERVE,
+    LLM_BACKOFF_BASE,
+    LLM_BACKOFF_MAX
+)
+from telemetry import percentile, get_prometheus_exporter
+
+PRIORITIES = ("interactive", "background")  # highest first
+
+WAIT_SAMPLES = 500  # per priority, for the percentiles
+
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds in a rate-limit header value such as "20ms", "1.5s" or "6m0s"; bare numbers are seconds."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+
+def _header_int(headers, name: str) -> Optional[int]:
+    try:
+        return int(float(headers.get(name)))
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(messages: List[Dict], max_tokens: Optional[int]) -> int:
+    """Tokens a request counts against the limit up front: about four characters a token, plus max_tokens."""
+    return sum(len(message.get("content") or "") // 4 + 4 for message in messages) + (max_tokens or 0)
+
+
+class TokenBucket:
+    """Capacity that refills evenly over a minute. A limit of 0 is unlimited."""
+    
+    def __init__(self, per_minute: int = 0):
+        self.configured = per_minute
+        self.limit = per_minute
+        self.level = float(per_minute)
+        self._updated = time.monotonic()
+    
+    def refill(self, now: float):
+        if self.limit:
+            self.level = min(float(self.limit), self.level + (now - self._updated) * self.limit / 60.0)
+        self._updated = now
+    
+    def wait(self, amount: int, reserve: float = 0.0) -> float:
+        """Seconds until amount can be taken while leaving reserve (a share of the limit) behind."""
+        if not self.limit:
+            return 0.0
+        needed = min(float(self.limit), amount + reserve * self.limit)
+        if self.level >= needed:
+            return 0.0
+        return (needed - self.level) * 60.0 / self.limit
+    
+    def take(self, amount: int):
+        if self.limit:
+            self.level -= min(amount, self.limit)
+    
+    def sync(self, limit: Optional[int], remaining: Optional[int]):
+        """Follow the provider's view of the limit and what is left of it."""
+        if limit:
+            limit = min(limit, self.configured) if self.configured else limit
+            if not self.limit:
+                self.level = float(limit)
+            self.limit = limit
+        if remaining is not None and self.limit:
+            self.level = min(self.level, float(remaining))
+
+
+class _Waiter:
+    """A caller queued for capacity, woken by whoever changes the queue."""
+    
+    def __init__(self, priority: str, session: str, tokens: int, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.priority = priority
+        self.session = session
+        self.tokens = tokens
+        self.loop = loop
+        self.event: Any = asyncio.Event() if loop is not None else threading.Event()
+        self.queued_at = time.monotonic()
+    
+    def wake(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.event.set)
+        else:
+            self.event.set()
+
+
+class RateLimitScheduler:
+    """Admits LLM requests in priority order without going over the rate limits.
+    
+    The transport calls acquire() (or aacquire() on the event loop) before
+    every attempt. A caller is let through at once while nobody is queued
+    and both buckets have room. Otherwise it joins its session's queue in
+    its priority class; only the head of the whole queue, the next session
+    in turn in the highest class that has callers, waits for the buckets
+    to refill. Background calls also leave background_reserve of each
+    bucket untouched, so a player turn arriving after a burst of summaries
+    doesn't find it empty.
+    """
+    
+    def __init__(self, rpm: int = LLM_RPM, tpm: int = LLM_TPM, background_kinds: Optional[Set[str]] = None,
+                 background_reserve: float = BACKGROUND_RESERVE):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.background_kinds = BACKGROUND_ROUTES if background_kinds is None else background_kinds
+        self.background_reserve = background_reserve
+        self._queues: Dict[str, "OrderedDict[str, Deque[_Waiter]]"] = {p: OrderedDict() for p in PRIORITIES}
+        self._depth = {p: 0 for p in PRIORITIES}
+        self._waits: Dict[str, Deque[float]] = {p: deque(maxlen=WAIT_SAMPLES) for p in PRIORITIES}
+        self._paused_until = 0.0
+        self._throttle_streak = 0
+        self._lock = threading.Lock()
+        self.counts = {p: {"granted": 0, "queued": 0, "max_depth": 0, "expired": 0} for p in PRIORITIES}
+        self.throttled = 0
+    
+    def priority(self, kind: str) -> str:
+        """Priority class of a call kind (its route name)."""
+        return "background" if kind in self.background_kinds else "interactive"
+    
+    def _head(self) -> Optional[_Waiter]:
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            if queue:
+                return next(iter(queue.values()))[0]
+        return None
+    
+    def _delay(self, priority: str, tokens: int, now: float) -> float:
+        """Seconds until a call of this class and size could go out."""
+        if now < self._paused_until:
+            return self._paused_until - now
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        reserve = self.background_reserve if priority == "background" else 0.0
+        return max(self.requests.wait(1, reserve), self.tokens.wait(tokens, reserve))
+    
+    def _grant(self, priority: str, tokens: int, waited: float):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self.counts[priority]["granted"] += 1
+        self._waits[priority].append(waited)
+    
+    def _dequeue(self, waiter: _Waiter) -> bool:
+        """Take a waiter out of its queue. The session goes to the back of its class if it has more."""
+        sessions = self._queues[waiter.priority]
+        queue = sessions.get(waiter.session)
+        if queue is None or waiter not in queue:
+            return False
+        queue.remove(waiter)
+        if queue:
+            sessions.move_to_end(waiter.session)
+        else:
+            del sessions[waiter.session]
+        self._depth[waiter.priority] -= 1
+        return True
+    
+    def _wake_head(self):
+        head = self._head()
+        if head is not None:
+            head.wake()
+    
+    def _enter(self, waiter: _Waiter) -> Optional[float]:
+        """Let a caller through or queue it. Returns None once granted, else how long to sleep."""
+        with self._lock:
+            if self._head() is None and self._delay(waiter.priority, waiter.tokens, time.monotonic()) == 0:
+                self._grant(waiter.priority, waiter.tokens, 0.0)
+                return None
+            self._queues[waiter.priority].setdefault(waiter.session, deque()).append(waiter)
+            counts = self.counts[waiter.priority]
+            self._depth[waiter.priority] += 1
+            counts["queued"] += 1
+            counts["max_depth"] = max(counts["max_depth"], self._depth[waiter.priority])
+            head = self._head()
+        if head is not waiter:
+            head.wake()  # an interactive caller may have just taken over from a background head
+        return 0.0
+    
+    def _poll(self, waiter: _Waiter) -> Optional[float]:
+        """Grant a queued caller if it is the head and there is room. Returns None once granted, else the sleep."""
+        with self._lock:
+            if self._head() is not waiter:
+                return float("inf")  # woken when it becomes the head
+            now = time.monotonic()
+            delay = self._delay(waiter.priority, waiter.tokens, now)
+            if delay > 0:
+                return delay
+            self._dequeue(waiter)
+            self._grant(waiter.priority, waiter.tokens, now - waiter.queued_at)
+            self._wake_head()
+            return None
+    
+    def _leave(self, waiter: _Waiter):
+        """Drop a caller that gave up waiting."""
+        with self._lock:
+            if self._dequeue(waiter):
+                self.counts[waiter.priority]["expired"] += 1
+                self._wake_head()
+    
+    def acquire(self, kind: str, session: str = "", tokens: int = 0, deadline_at: Optional[float] = None) -> bool:
+        """Block until a request may go out. Returns False if deadline_at (monotonic) passes first."""
+        waiter = _Waiter(self.priority(kind), session, tokens)
+        delay = self._enter(waiter)
+        try:
+            while delay is not None:
+                remaining = (deadline_at - time.monotonic()) if deadline_at is not None else float("inf")
+                if remaining <= 0:
+                    return False
+                waiter.event.wait(min(delay, remaining, 60.0))
+                waiter.event.clear()
+                delay = self._poll(waiter)
+            return True
+        finally:
+            if delay is not None:
+                self._leave(waiter)
+    
+    async def aacquire(self, kind: str, session: str = "", tokens: int = 0,
+                       deadline_at: Optional[float] = None) -> bool:
+        """Wait on the event loop until a request may go out. Returns False if deadline_at passes first."""
+        waiter = _Waiter(self.priority(kind), session, tokens, asyncio.get_running_loop())
+        delay = self._enter(waiter)
+        try:
+            while delay is not None:
+                remaining = (deadline_at - time.monotonic()) if deadline_at is not None else float("inf")
+                if remaining <= 0:
+                    return False
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), min(delay, remaining, 60.0))
+                except asyncio.TimeoutError:
+                    pass
+                waiter.event.clear()
+                delay = self._poll(waiter)
+            return True
+        finally:
+            if delay is not None:
+                self._leave(waiter)
+    
+    def try_acquire(self, kind: str, session: str = "", tokens: int = 0) -> bool:
+        """Take capacity only if it is there now and nobody is queued, e.g. for a hedged duplicate."""
+        priority = self.priority(kind)
+        with self._lock:
+            if self._head() is not None or self._delay(priority, tokens, time.monotonic()) > 0:
+                return False
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            return True
+    
+    def _sync(self, headers, now: float):
+        for bucket, unit in ((self.requests, "requests"), (self.tokens, "tokens")):
+            bucket.refill(now)
+            remaining = _header_int(headers, f"x-ratelimit-remaining-{unit}")
+            bucket.sync(_header_int(headers, f"x-ratelimit-limit-{unit}"), remaining)
+            reset = parse_duration(headers.get(f"x-ratelimit-reset-{unit}"))
+            if remaining == 0 and reset:
+                self._paused_until = max(self._paused_until, now + reset)
+    
+    def observe(self, headers):
+        """Follow the rate-limit headers of a successful response."""
+        if headers is None:
+            return
+        with self._lock:
+            self._throttle_streak = 0
+            self._sync(headers, time.monotonic())
+            self._wake_head()
+    
+    def throttled_for(self, headers=None) -> float:
+        """Record a 429 and hold every caller back. Returns the seconds until requests resume.
+        
+        The pause is the response's Retry-After, or exponential backoff
+        when it doesn't say.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.throttled += 1
+            pause = None
+            if headers is not None:
+                self._sync(headers, now)
+                pause = parse_duration(headers.get("retry-after"))
+                retry_after_ms = parse_duration(headers.get("retry-after-ms"))
+                if retry_after_ms is not None:
+                    pause = retry_after_ms / 1000.0
+            if pause is None:
+                pause = min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** self._throttle_streak)
+            self._throttle_streak += 1
+            self._paused_until = max(self._paused_until, now + pause)
+            return self._paused_until - now
+    
+    def stats(self) -> Dict:
+        """Queue depth, wait percentiles and grants per priority class, plus the limits and what is left."""
+        with self._lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            stats: Dict[str, Any] = {}
+            for priority in PRIORITIES:
+                waits = list(self._waits[priority])
+                stats[priority] = {**self.counts[priority], "depth": self._depth[priority],
+                                   "wait_p50": percentile(waits, 50), "wait_p95": percentile(waits, 95)}
+            stats.update({
+                "rpm": self.requests.limit,
+                "tpm": self.tokens.limit,
+                "requests_left": int(self.requests.level) if self.requests.limit else None,
+                "tokens_left": int(self.tokens.level) if self.tokens.limit else None,
+                "throttled": self.throttled,
+                "paused": max(0.0, self._paused_until - now)
+            })
+            return stats
+    
+    def prometheus_lines(self) -> List[str]:
+        """Queue depth, wait times and 429s in the Prometheus text format."""
+        stats = self.stats()
+        lines = [
+            "# HELP dungeon_master_llm_queue_depth LLM calls waiting for rate-limit capacity.",
+            "# TYPE dungeon_master_llm_queue_depth gauge"
+        ]
+        for priority in PRIORITIES:
+            lines.append(f'dungeon_master_llm_queue_depth{{priority="{priority}"}} {stats[priority]["depth"]}')
+        lines.append("# HELP dungeon_master_llm_queue_wait_seconds Time LLM calls waited for rate-limit capacity.")
+        lines.append("# TYPE dungeon_master_llm_queue_wait_seconds summary")
+        for priority in PRIORITIES:
+            for quantile, key in ((0.5, "wait_p50"), (0.95, "wait_p95")):
+                lines.append(f'dungeon_master_llm_queue_wait_seconds{{priority="{priority}",quantile="{quantile}"}} '
+                             f'{stats[priority][key]}')
+            lines.append(f'dungeon_master_llm_queue_wait_seconds_count{{priority="{priority}"}} '
+                         f'{stats[priority]["granted"]}')
+        lines.append("# HELP dungeon_master_llm_throttled_total Responses rejected with 429.")
+        lines.append("# TYPE dungeon_master_llm_throttled_total counter")
+        lines.append(f"dungeon_master_llm_throttled_total {stats['throttled']}")
+        return lines
+
+
+def http_client(scheduler: Optional[RateLimitScheduler] = None):
+    """An httpx client for OpenAI(http_client=...) that reports each response's rate-limit headers."""
+    from openai import DefaultHttpxClient
+    scheduler = scheduler or get_scheduler()
+    
+    def report(response):
+        if response.status_code < 400:
+            scheduler.observe(response.headers)
+    
+    return DefaultHttpxClient(event_hooks={"response": [report]})
+
+
+def async_http_client(scheduler: Optional[RateLimitScheduler] = None):
+    """An httpx client for AsyncOpenAI(http_client=...) that reports each response's rate-limit headers."""
+    from openai import DefaultAsyncHttpxClient
+    scheduler = scheduler or get_scheduler()
+    
+    async def report(response):
+        if response.status_code < 400:
+            scheduler.observe(response.headers)
+    
+    return DefaultAsyncHttpxClient(event_hooks={"response": [report]})
+
+
+_shared: Optional[RateLimitScheduler] = None
+_shared_lock = threading.Lock()
+
+
+def get_scheduler() -> RateLimitScheduler:
+    """Get the process-wide scheduler, so every session and background job shares the rate limits."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = RateLimitScheduler()
+            exporter = get_prometheus_exporter()
+            if exporter is not None:
+                exporter.collectors.append(_shared.prometheus_lines)
+        return _shared
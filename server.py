@@ -0,0 +1,287 @@
+"""Asyncio HTTP/WebSocket server hosting many AI Dungeon Master sessions."""
+
+import asyncio
+import logging
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from aiohttp import web, WSMsgType
+from openai import OpenAI, AsyncOpenAI
+
+from config import (
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    MEMORY_BACKEND,
+    MEMORY_DIRECTORY,
+    SERVER_HOST,
+    SERVER_PORT,
+    SESSION_IDLE_TIMEOUT,
+    MEMORY_GC_MAX_IDLE
+)
+from embeddings import get_embedding_function
+from memory import MemoryManager, get_registry
+import profiling
+from scheduler import http_client, async_http_client
+from storyteller import StoryTeller
+from vector_store import create_store
+from telemetry import get_prometheus_exporter
+from transport import LLMFailure
+
+
+logger = logging.getLogger(__name__)
+
+
+class GameSession:
+    """A single player's game hosted by the server."""
+    
+    def __init__(self, session_id: str, storyteller: StoryTeller):
+        self.session_id = session_id
+        self.storyteller = storyteller
+        # Serializes requests for this game; other games proceed in parallel
+        self.lock = asyncio.Lock()
+        self.last_active = time.monotonic()
+    
+    def touch(self):
+        """Mark the session as recently used."""
+        self.last_active = time.monotonic()
+    
+    def to_dict(self) -> Dict:
+        """Describe the session for API responses."""
+        return {
+            "session_id": self.session_id,
+            "game_state": self.storyteller.game_state.to_dict()
+        }
+
+
+class SessionManager:
+    """Creates, looks up and evicts game sessions.
+    
+    All sessions share one OpenAI client pair and one vector store, so an
+    idle session only costs its game state, history and collection handles.
+    """
+    
+    def __init__(self, persist_directory: str = MEMORY_DIRECTORY, idle_timeout: float = SESSION_IDLE_TIMEOUT):
+        # The shared transport retries, so the clients don't
+        self.client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, max_retries=0,
+                             http_client=http_client())
+        self.async_client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, max_retries=0,
+                                        http_client=async_http_client())
+        self.store = create_store(MEMORY_BACKEND, persist_directory)
+        self.persist_directory = persist_directory
+        self.idle_timeout = idle_timeout
+        self.sessions: Dict[str, GameSession] = {}
+    
+    def _create_storyteller(self, session_id: str) -> StoryTeller:
+        """Build a storyteller with its own memory namespace."""
+        memory = MemoryManager(self.persist_directory, namespace=f"s{session_id}", store=self.store)
+        return StoryTeller(client=self.client, async_client=self.async_client, memory=memory, session=session_id)
+    
+    async def create(self) -> GameSession:
+        """Create a new session."""
+        session_id = uuid.uuid4().hex[:12]
+        storyteller = await asyncio.to_thread(self._create_storyteller, session_id)
+        session = GameSession(session_id, storyteller)
+        self.sessions[session_id] = session
+        return session
+    
+    def get(self, session_id: str) -> Optional[GameSession]:
+        """Look up a session by id."""
+        session = self.sessions.get(session_id)
+        if session:
+            session.touch()
+        return session
+    
+    def remove(self, session_id: str) -> bool:
+        """End a session. Its memories are deleted in the background."""
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        get_registry(self.store, self.persist_directory).delete(session.storyteller.memory.namespace)
+        return True
+    
+    def evict_idle(self) -> int:
+        """Drop sessions that have been idle longer than the timeout.
+        
+        Their memories stay in the store until collect_garbage() finds them abandoned.
+        """
+        cutoff = time.monotonic() - self.idle_timeout
+        idle = [sid for sid, session in self.sessions.items()
+                if session.last_active < cutoff and not session.lock.locked()]
+        for sid in idle:
+            del self.sessions[sid]
+        return len(idle)
+    
+    def collect_garbage(self, max_idle: float = MEMORY_GC_MAX_IDLE) -> List[str]:
+        """Delete, in the background, memories of campaigns no live session has used for max_idle seconds."""
+        live = {session.storyteller.memory.namespace for session in list(self.sessions.values())}
+        return get_registry(self.store, self.persist_directory).collect_garbage(max_idle, keep=live)
+    
+    async def reap_forever(self, interval: float = 60.0):
+        """Periodically evict idle sessions and collect abandoned memories."""
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_idle()
+            await asyncio.to_thread(self.collect_garbage)
+
+
+def _get_session(request: web.Request) -> GameSession:
+    """Get the session named in the URL or fail with 404."""
+    session = request.app["sessions"].get(request.match_info["session_id"])
+    if session is None:
+        raise web.HTTPNotFound(text="Unknown session")
+    return session
+
+
+async def create_session(request: web.Request) -> web.Response:
+    """POST /sessions - create a game, optionally with a character."""
+    data = await request.json() if request.can_read_body else {}
+    session = await request.app["sessions"].create()
+    if data.get("name"):
+        await asyncio.to_thread(
+            session.storyteller.set_character,
+            data["name"],
+            data.get("race", "Human"),
+            data.get("class", "Warrior"),
+            data.get("backstory", "A wandering adventurer seeking fortune and glory")
+        )
+    return web.json_response(session.to_dict(), status=201)
+
+
+def _failure_response(failure: LLMFailure, turn: int) -> web.Response:
+    """Report a failed LLM call; nothing was stored, so the client can retry the request."""
+    return web.json_response({"error": str(failure), "reason": failure.reason, "turn": turn}, status=503)
+
+
+async def get_session(request: web.Request) -> web.Response:
+    """GET /sessions/{id} - show the game state."""
+    return web.json_response(_get_session(request).to_dict())
+
+
+async def delete_session(request: web.Request) -> web.Response:
+    """DELETE /sessions/{id} - end a session."""
+    if not request.app["sessions"].remove(request.match_info["session_id"]):
+        raise web.HTTPNotFound(text="Unknown session")
+    return web.json_response({"deleted": True})
+
+
+async def start_adventure(request: web.Request) -> web.Response:
+    """POST /sessions/{id}/start - generate the opening scene."""
+    session = _get_session(request)
+    data = await request.json() if request.can_read_body else {}
+    async with session.lock:
+        narration = await session.storyteller.astart_adventure(data.get("setting"))
+    if isinstance(narration, LLMFailure):
+        return _failure_response(narration, 0)
+    return web.json_response({"narration": narration, "turn": 0})
+
+
+async def take_action(request: web.Request) -> web.Response:
+    """POST /sessions/{id}/action - process a player action."""
+    session = _get_session(request)
+    data = await request.json()
+    action = (data.get("action") or "").strip()
+    if not action:
+        raise web.HTTPBadRequest(text="Missing action")
+    async with session.lock:
+        narration = await session.storyteller.aprocess_action(action)
+        turn = session.storyteller.game_state.turn_count
+    if isinstance(narration, LLMFailure):
+        return _failure_response(narration, turn)
+    return web.json_response({"narration": narration, "turn": turn})
+
+
+async def session_socket(request: web.Request) -> web.WebSocketResponse:
+    """GET /sessions/{id}/ws - stream narration token by token.
+    
+    Clients send {"type": "start", "setting": ...} or {"type": "action", "action": ...}
+    and receive {"type": "token", "text": ...} messages followed by {"type": "done"}, or
+    {"type": "error", "error": ..., "reason": ...} if the LLM call failed.
+    """
+    session = _get_session(request)
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+    
+    async for msg in ws:
+        if msg.type != WSMsgType.TEXT:
+            continue
+        try:
+            data = msg.json()
+        except ValueError:
+            await ws.send_json({"type": "error", "error": "Invalid JSON"})
+            continue
+        
+        if data.get("type") == "start":
+            stream = session.storyteller.astart_adventure_stream(data.get("setting"))
+        elif data.get("type") == "action" and (data.get("action") or "").strip():
+            stream = session.storyteller.aprocess_action_stream(data["action"].strip())
+        else:
+            await ws.send_json({"type": "error", "error": "Expected a start or action message"})
+            continue
+        
+        session.touch()
+        async with session.lock:
+            failure = None
+            async for chunk in stream:
+                if isinstance(chunk, LLMFailure):
+                    failure = chunk
+                else:
+                    await ws.send_json({"type": "token", "text": chunk})
+            turn = session.storyteller.game_state.turn_count
+        if failure is not None:
+            await ws.send_json({"type": "error", "error": str(failure), "reason": failure.reason, "turn": turn})
+        else:
+            await ws.send_json({"type": "done", "turn": turn})
+    
+    return ws
+
+
+async def metrics(request: web.Request) -> web.Response:
+    """GET /metrics - Prometheus metrics, when the prometheus telemetry sink is enabled."""
+    exporter = get_prometheus_exporter()
+    if exporter is None:
+        raise web.HTTPNotFound(text="Add prometheus to TELEMETRY_SINKS to enable metrics")
+    return web.Response(text=exporter.render(), content_type="text/plain")
+
+
+async def _warm_embeddings(app: web.Application):
+    """Load the shared embedding model before the first request needs it."""
+    try:
+        await asyncio.to_thread(get_embedding_function().warmup)
+    except Exception:
+        logger.exception("Embedding warmup failed")
+    profiling.finish()  # sessions open their memory with timed phases too
+
+
+async def _start_reaper(app: web.Application):
+    app["reaper"] = asyncio.create_task(app["sessions"].reap_forever())
+
+
+async def _stop_reaper(app: web.Application):
+    app["reaper"].cancel()
+
+
+def create_app(sessions: Optional[SessionManager] = None) -> web.Application:
+    """Build the web application."""
+    app = web.Application()
+    app["sessions"] = sessions or SessionManager()
+    app.router.add_post("/sessions", create_session)
+    app.router.add_get("/sessions/{session_id}", get_session)
+    app.router.add_delete("/sessions/{session_id}", delete_session)
+    app.router.add_post("/sessions/{session_id}/start", start_adventure)
+    app.router.add_post("/sessions/{session_id}/action", take_action)
+    app.router.add_get("/sessions/{session_id}/ws", session_socket)
+    app.router.add_get("/metrics", metrics)
+    app.on_startup.append(_warm_embeddings)
+    app.on_startup.append(_start_reaper)
+    app.on_cleanup.append(_stop_reaper)
+    return app
+
+
+def main():
+    """Run the game server."""
+    web.run_app(create_app(), host=SERVER_HOST, port=SERVER_PORT)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+"""Headless load test: many concurrent campaigns against one LLM endpoint.
+
+Each campaign gets its own StoryTeller, GameState and memory namespace,
+while the OpenAI clients and vector store are shared the way server.py
+shares them. Campaigns run as asyncio tasks, creating a character,
+opening an adventure and then playing scripted or randomly chosen turns.
+
+Usage:
+    python stub_server.py &
+    OPENAI_BASE_URL=http://127.0.0.1:8090/v1 python simulate.py --campaigns 20 --turns 10
+    python simulate.py --stub --campaigns 50 --turns 10 --latency 0.5 --token-rate 40
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from config import OPENAI_API_KEY, OPENAI_BASE_URL, MEMORY_BACKEND, PROMPT_LAYOUT
+from telemetry import percentile
+from router import get_router
+from scheduler import PRIORITIES, get_scheduler
+from transport import LLMFailure, get_transport
+
+SCRIPT = [
+    "Look around carefully",
+    "Talk to the nearest stranger",
+    "Search for hidden passages",
+    "Follow the road north",
+    "Rest and tend to my wounds",
+    "Draw my weapon and advance"
+]
+
+CHOICE_PATTERN = re.compile(r"^\s*(\d+)[.)]\s+(.+)$", re.MULTILINE)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def choose_action(policy: str, rng: random.Random, narration: str, turn: int) -> str:
+    """Pick the next action: the script in order, or a random numbered choice."""
+    if policy == "scripted":
+        return SCRIPT[turn % len(SCRIPT)]
+    choices = CHOICE_PATTERN.findall(narration)
+    if choices:
+        return rng.choice(choices)[1].strip()
+    return rng.choice(SCRIPT)
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process in MB."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def directory_mb(path: str) -> float:
+    """Size of a directory tree on disk in MB."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total / (1024 * 1024)
+
+
+def histogram(latencies: List[float]) -> List[tuple]:
+    """Count latencies into fixed buckets, as (upper bound, count) pairs."""
+    counts = [0] * (len(LATENCY_BUCKETS) + 1)
+    for value in latencies:
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    return list(zip(LATENCY_BUCKETS + (float("inf"),), counts))
+
+
+class Simulation:
+    """Runs campaigns concurrently and samples resource usage while they play."""
+    
+    def __init__(self, campaigns: int, turns: int, concurrency: int, policy: str, base_url: Optional[str],
+                 backend: str, directory: str, seed: int = 0, prompt_layout: str = PROMPT_LAYOUT):
+        from openai import OpenAI, AsyncOpenAI
+        from scheduler import http_client, async_http_client
+        from vector_store import create_store
+        
+        self.campaigns = campaigns
+        self.turns = turns
+        self.policy = policy
+        self.directory = directory
+        self.seed = seed
+        self.prompt_layout = prompt_layout
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.client = OpenAI(api_key=OPENAI_API_KEY or "local", base_url=base_url, max_retries=0,
+                             http_client=http_client())
+        self.async_client = AsyncOpenAI(api_key=OPENAI_API_KEY or "local", base_url=base_url, max_retries=0,
+                                        http_client=async_http_client())
+        self.store = create_store(backend, directory)
+        self.storytellers = []
+        self.turn_latencies: List[float] = []
+        self.failures = 0
+        self.samples: List[Dict] = []
+    
+    def _create_storyteller(self, index: int):
+        """Build a storyteller with its own memory namespace on the shared store."""
+        from memory import MemoryManager
+        from storyteller import StoryTeller
+        
+        memory = MemoryManager(self.directory, namespace=f"sim{index}", store=self.store)
+        storyteller = StoryTeller(client=self.client, async_client=self.async_client, memory=memory,
+                                  prompt_layout=self.prompt_layout, session=f"sim{index}")
+        storyteller.set_character(f"Hero{index}", "Human", "Warrior", "A wandering adventurer seeking glory")
+        return storyteller
+    
+    async def play(self, index: int):
+        """Play one campaign from character creation to its last turn."""
+        rng = random.Random(self.seed * 100003 + index)
+        async with self.semaphore:
+            storyteller = await asyncio.to_thread(self._create_storyteller, index)
+            self.storytellers.append(storyteller)
+            narration = await storyteller.astart_adventure()
+            for turn in range(self.turns):
+                action = choose_action(self.policy, rng, narration, turn)
+                started = time.perf_counter()
+                try:
+                    result = await storyteller.aprocess_action(action)
+                except Exception:
+                    self.failures += 1
+                    continue
+                if isinstance(result, LLMFailure):
+                    self.failures += 1
+                    continue
+                narration = result
+                self.turn_latencies.append(time.perf_counter() - started)
+    
+    def stored_memories(self) -> int:
+        """Total items stored across every campaign's collections."""
+        return sum(sum(s.memory._sizes.values()) for s in list(self.storytellers))
+    
+    def pending_writes(self) -> int:
+        """Writes queued in the background writer across every campaign."""
+        from memory import _WRITER
+        return sum(_WRITER.pending(s.memory) for s in list(self.storytellers))
+    
+    def sample(self, started: float):
+        """Record one point of resource usage."""
+        self.samples.append({
+            "seconds": time.perf_counter() - started,
+            "turns": len(self.turn_latencies),
+            "memories": self.stored_memories(),
+            "pending_writes": self.pending_writes(),
+            "rss_mb": rss_mb(),
+            "disk_mb": directory_mb(self.directory)
+        })
+    
+    async def sampler(self, started: float, interval: float):
+        """Sample resource usage until cancelled."""
+        while True:
+            self.sample(started)
+            await asyncio.sleep(interval)
+    
+    async def run(self, interval: float = 1.0) -> Dict:
+        """Run every campaign and summarize the results."""
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        sampler = asyncio.create_task(self.sampler(started, interval))
+        await asyncio.gather(*(self.play(i) for i in range(self.campaigns)))
+        elapsed = time.perf_counter() - started
+        
+        sampler.cancel()
+        for storyteller in self.storytellers:
+            await asyncio.to_thread(storyteller.memory.flush)
+        drained = time.perf_counter() - started
+        self.sample(started)
+        
+        return self.report(elapsed, drained, time.process_time() - cpu_started)
+    
+    def phase_summary(self) -> Dict:
+        """p50/p95 per turn phase across every campaign."""
+        durations: Dict[str, List[float]] = {}
+        for storyteller in self.storytellers:
+            for event in list(storyteller.telemetry.ring.events):
+                if event["type"] == "span":
+                    durations.setdefault(event["phase"], []).append(event["seconds"])
+        return {
+            phase: {"count": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95)}
+            for phase, values in sorted(durations.items())
+        }
+    
+    def prompt_cache(self) -> Dict:
+        """Prompt tokens across every campaign and how many the provider served from its cache."""
+        prompt = cached = 0
+        for storyteller in self.storytellers:
+            tokens = storyteller.telemetry.summary()["tokens"]
+            prompt += tokens["prompt"]
+            cached += tokens["cached"]
+        return {"prompt_tokens": prompt, "cached_tokens": cached, "hit_rate": cached / prompt if prompt else 0.0}
+    
+    def report(self, elapsed: float, drained: float, cpu: float) -> Dict:
+        latencies = self.turn_latencies
+        return {
+            "campaigns": self.campaigns,
+            "turns": len(latencies),
+            "failures": self.failures,
+            "seconds": elapsed,
+            "drain_seconds": drained - elapsed,
+            "turns_per_second": len(latencies) / elapsed if elapsed else 0.0,
+            "cpu_utilization": cpu / drained if drained else 0.0,
+            "latency": {
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": max(latencies, default=0.0)
+            },
+            "histogram": histogram(latencies),
+            "phases": self.phase_summary(),
+            "transport": get_transport().stats(),
+            "prompt_cache": self.prompt_cache(),
+            "routes": get_router().stats(),
+            "scheduler": get_scheduler().stats(),
+            "growth": self.samples
+        }
+
+
+def print_report(report: Dict):
+    """Print a simulation report as plain text."""
+    latency = report["latency"]
+    print(f"{report['campaigns']} campaigns, {report['turns']} turns in {report['seconds']:.1f}s "
+          f"({report['failures']} failed)")
+    print(f"Throughput: {report['turns_per_second']:.2f} turns/s, CPU {report['cpu_utilization']:.0%} of one core, "
+          f"write backlog drained in {report['drain_seconds']:.2f}s")
+    print(f"Turn latency: p50 {latency['p50']:.3f}s  p95 {latency['p95']:.3f}s  "
+          f"p99 {latency['p99']:.3f}s  max {latency['max']:.3f}s")
+    transport = report["transport"]
+    print(f"Transport: {transport['retries']} retries ({transport['timeouts']} timeouts), "
+          f"{transport['hedges']} hedged ({transport['hedge_wins']} won), "
+          f"circuit {transport['circuit']} (opened {transport['circuit_opened']}x)")
+    scheduler = report["scheduler"]
+    print(f"Rate limits: {scheduler['rpm'] or 'no'} RPM, {scheduler['tpm'] or 'no'} TPM, "
+          f"{scheduler['throttled']} throttled (429)")
+    for priority in PRIORITIES:
+        queue = scheduler[priority]
+        print(f"  {priority}: {queue['queued']} of {queue['granted']} calls queued (max depth {queue['max_depth']}), "
+              f"waited p50 {queue['wait_p50'] * 1000:.0f}ms p95 {queue['wait_p95'] * 1000:.0f}ms")
+    cache = report["prompt_cache"]
+    print(f"Prompt cache: {cache['cached_tokens']} of {cache['prompt_tokens']} prompt tokens cached "
+          f"({cache['hit_rate']:.0%})")
+    
+    print("\nTurn latency histogram")
+    peak = max((count for _, count in report["histogram"]), default=0) or 1
+    for bound, count in report["histogram"]:
+        label = f"<= {bound:g}s" if bound != float("inf") else "> 30s"
+        print(f"  {label:>9} {count:>6} {'#' * round(40 * count / peak)}")
+    
+    if report["routes"]:
+        print(f"\n{'route':<12} {'tier':<7} {'calls':>6} {'failed':>6} {'fallback':>8} {'p50 ms':>9} {'p95 ms':>9} "
+              f"{'tokens':>9}")
+        for name, route in sorted(report["routes"].items()):
+            print(f"{name:<12} {route['tier']:<7} {route['calls']:>6} {route['failures']:>6} {route['fallbacks']:>8} "
+                  f"{route['p50'] * 1000:>9.1f} {route['p95'] * 1000:>9.1f} "
+                  f"{route['prompt_tokens'] + route['completion_tokens']:>9}")
+    
+    print(f"\n{'phase':<18} {'count':>6} {'p50 ms':>9} {'p95 ms':>9}")
+    for name, stats in report["phases"].items():
+        print(f"{name:<18} {stats['count']:>6} {stats['p50'] * 1000:>9.1f} {stats['p95'] * 1000:>9.1f}")
+    
+    print(f"\n{'seconds':>8} {'turns':>6} {'memories':>9} {'queued':>7} {'RSS MB':>8} {'disk MB':>8}")
+    for s in report["growth"]:
+        print(f"{s['seconds']:>8.1f} {s['turns']:>6} {s['memories']:>9} {s['pending_writes']:>7} "
+              f"{s['rss_mb']:>8.1f} {s['disk_mb']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run concurrent headless campaigns for load testing")
+    parser.add_argument("--campaigns", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, help="campaigns in flight at once (default: all)")
+    parser.add_argument("--policy", choices=["random", "scripted"], default="random",
+                        help="pick a random numbered choice, or follow a fixed script")
+    parser.add_argument("--base-url", default=OPENAI_BASE_URL, help="OpenAI-compatible endpoint")
+    parser.add_argument("--stub", action="store_true", help="start an in-process stub server as the endpoint")
+    parser.add_argument("--latency", type=float, default=0.3, help="stub first-token latency in seconds")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="stub tokens per second")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stub requests that fail with 503")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="fraction of stub requests that stall")
+    parser.add_argument("--tail-latency", type=float, default=5.0, help="extra seconds a stalled stub request takes")
+    parser.add_argument("--stub-rpm", type=int, default=0, help="stub requests per minute before 429s")
+    parser.add_argument("--stub-tpm", type=int, default=0, help="stub tokens per minute before 429s")
+    parser.add_argument("--backend", default=MEMORY_BACKEND, choices=["chroma", "numpy"])
+    parser.add_argument("--directory", help="memory directory (default: a temporary one)")
+    parser.add_argument("--sample-interval", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--prompt-layout", choices=["classic", "cache"], default=PROMPT_LAYOUT,
+                        help="prompt layout; cache keeps a stable prefix for provider prompt caching")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+    
+    base_url = args.base_url
+    if args.stub:
+        from stub_server import start_stub_server
+        _, base_url = start_stub_server(latency=args.latency, token_rate=args.token_rate, error_rate=args.error_rate,
+                                        tail_rate=args.tail_rate, tail_latency=args.tail_latency,
+                                        rpm=args.stub_rpm, tpm=args.stub_tpm)
+    if not base_url and not OPENAI_API_KEY:
+        parser.error("set OPENAI_API_KEY, OPENAI_BASE_URL or --base-url, or pass --stub")
+    
+    with tempfile.TemporaryDirectory() as scratch:
+        directory = args.directory or scratch
+        
+        async def run():
+            simulation = Simulation(args.campaigns, args.turns, args.concurrency or args.campaigns, args.policy,
+                                    base_url, args.backend, directory, args.seed, args.prompt_layout)
+            return await simulation.run(args.sample_interval)
+        
+        report = asyncio.run(run())
+    
+    if args.json:
+        print(json.dumps(report, indent=2, default=str))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
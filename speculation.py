@@ -0,0 +1,163 @@
+"""Speculative pre-generation of the follow-up to each numbered choice."""
+
+import logging
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import SPECULATIVE_BRANCHES, SPECULATIVE_MAX_TOKENS, SPECULATIVE_MAX_WAIT
+
+logger = logging.getLogger(__name__)
+
+# Shared by every storyteller; bounds how many speculative calls run at once
+_SPECULATION_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculation")
+
+CHOICE_PATTERN = re.compile(r"^\s*\**(\d+)[.)]\**\s+(.+?)\s*$", re.MULTILINE)
+
+
+def parse_choices(narration: str) -> List[Tuple[int, str]]:
+    """Get the numbered choices a narration ends with, as (number, text) pairs."""
+    choices = []
+    for number, text in CHOICE_PATTERN.findall(narration):
+        if choices and int(number) != choices[-1][0] + 1:
+            # A new list started, e.g. numbered steps earlier in the scene; keep the last one
+            choices = []
+        if not choices and int(number) != 1:
+            continue
+        choices.append((int(number), text.strip("* ")))
+    return choices
+
+
+class Branch:
+    """One speculative follow-up being generated."""
+    
+    def __init__(self, number: int, choice: str):
+        self.number = number
+        self.choice = choice
+        self.cancelled = threading.Event()
+        self.future: Optional[Future] = None
+
+
+class Speculator:
+    """Generates the follow-up to each numbered choice while the player reads.
+    
+    After every narration, up to max_branches choices are generated in the
+    background with generate(choice, max_tokens, cancelled). If the player
+    then picks one by number or by its text, its narration is returned and
+    the other branches are cancelled and discarded; anything else discards
+    them all. Branches never touch game state, so only the picked one is
+    ever committed. A picked branch still queued for a worker, or still
+    generating after max_wait seconds, is dropped for a live call, so a hit
+    is never slower than a miss by more than max_wait.
+    """
+    
+    def __init__(self, generate: Callable[[str, int, threading.Event], Optional[str]],
+                 max_branches: int = SPECULATIVE_BRANCHES, max_tokens: int = SPECULATIVE_MAX_TOKENS,
+                 telemetry=None, max_wait: float = SPECULATIVE_MAX_WAIT):
+        """Create a speculator.
+        
+        generate(action, max_tokens, cancelled) returns the narration for an
+        action, or None if it was cancelled or is unusable.
+        """
+        self.generate = generate
+        self.max_branches = max_branches
+        self.max_tokens = max_tokens
+        self.telemetry = telemetry
+        self.max_wait = max_wait
+        self._branches: Dict[int, Branch] = {}
+        self._lock = threading.Lock()
+        self.counts = {"turns": 0, "branches": 0, "hits": 0, "misses": 0, "late": 0, "discarded": 0}
+    
+    def start(self, narration: str):
+        """Discard any previous branches and start generating this narration's choices."""
+        self.cancel()
+        choices = parse_choices(narration)[:self.max_branches]
+        if not choices:
+            return
+        with self._lock:
+            for number, choice in choices:
+                branch = Branch(number, choice)
+                branch.future = _SPECULATION_POOL.submit(self._run, branch)
+                self._branches[number] = branch
+            self.counts["turns"] += 1
+            self.counts["branches"] += len(choices)
+    
+    def _run(self, branch: Branch) -> Optional[str]:
+        if branch.cancelled.is_set():
+            return None
+        try:
+            return self.generate(branch.choice, self.max_tokens, branch.cancelled)
+        except Exception:
+            logger.exception("Speculative generation failed")
+            return None
+    
+    @staticmethod
+    def _match(player_input: str, branches: Dict[int, Branch]) -> Optional[Branch]:
+        """Find the branch a player's input picks, by number or exact choice text."""
+        text = player_input.strip().rstrip(".").lower()
+        if text.isdigit():
+            return branches.get(int(text))
+        for branch in branches.values():
+            if branch.choice.rstrip(".").lower() == text:
+                return branch
+        return None
+    
+    def take(self, player_input: str) -> Optional[Tuple[str, str]]:
+        """Claim the prepared narration for a player's input.
+        
+        Returns (choice, narration) on a hit, waiting up to max_wait for the
+        branch if it is still generating, or None on a miss. Every other
+        branch is discarded.
+        """
+        with self._lock:
+            branches, self._branches = self._branches, {}
+        if not branches:
+            return None
+        picked = self._match(player_input, branches)
+        
+        self._discard([b for b in branches.values() if b is not picked])
+        started = time.perf_counter()
+        narration = None
+        late = False
+        if picked is not None:
+            # Still queued behind other sessions' branches, it would finish after a live call
+            late = picked.future.cancel()
+            if not late:
+                try:
+                    narration = picked.future.result(timeout=self.max_wait)
+                except FutureTimeoutError:
+                    late = True
+                except Exception:
+                    narration = None
+            if not narration:
+                picked.cancelled.set()
+        
+        outcome = "hit" if narration else "late" if late else "miss"
+        self.counts["hits" if narration else "misses"] += 1
+        if late:
+            self.counts["late"] += 1
+        if picked is not None and not narration:
+            self.counts["discarded"] += 1
+        if self.telemetry is not None:
+            self.telemetry.emit({"type": "speculation", "outcome": outcome,
+                                 "waited": time.perf_counter() - started})
+        return (picked.choice, narration) if narration else None
+    
+    def _discard(self, branches: List[Branch]):
+        for branch in branches:
+            branch.cancelled.set()
+            branch.future.cancel()
+        self.counts["discarded"] += len(branches)
+    
+    def cancel(self):
+        """Discard every outstanding branch."""
+        with self._lock:
+            branches, self._branches = list(self._branches.values()), {}
+        self._discard(branches)
+    
+    def hit_rate(self) -> float:
+        """Fraction of speculated turns where the player picked a prepared choice."""
+        decided = self.counts["hits"] + self.counts["misses"]
+        return self.counts["hits"] / decided if decided else 0.0
@@ -1,39 +1,367 @@
 """LLM-powered storytelling engine."""
 
-from openai import OpenAI
-from typing import Optional, List, Dict
+import asyncio
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import closing
+from typing import Optional, List, Dict, Tuple, Iterator, AsyncIterator, TYPE_CHECKING
 from config import (
     OPENAI_API_KEY, 
+    OPENAI_BASE_URL,
     MODEL_NAME, 
     DUNGEON_MASTER_PROMPT,
     CHARACTER_CREATION_PROMPT,
-    NARRATIVE_TEMPERATURE
+    NARRATIVE_TEMPERATURE,
+    PROMPT_LAYOUT,
+    SUMMARY_PROMPT,
+    SYNOPSIS_MAX_TOKENS,
+    SAVE_DIRECTORY,
+    SPECULATIVE_BRANCHES,
+    SPECULATIVE_MAX_TOKENS,
+    ENTITY_EXTRACTION,
+    MEMORY_GC_MAX_IDLE
 )
 from memory import MemoryManager, GameState
+from profiling import phase
+from prompt import PromptAssembler, campaign_sheet
+from router import ModelRouter, Route, get_router
+from scheduler import estimate_tokens, http_client, async_http_client
+from compaction import HistoryCompactor
+from journal import Journal, saved_namespaces
+from extraction import EntityExtractor, normalize_name
+from speculation import Speculator, parse_choices
+from response_cache import ResponseCache, CacheMiss, get_response_cache
+from telemetry import Telemetry
+from transport import LLMTransport, LLMFailure, LLMError, get_transport
+
+if TYPE_CHECKING:
+    from openai import OpenAI, AsyncOpenAI
+
+
+logger = logging.getLogger(__name__)
 
 
 class StoryTeller:
     """AI Dungeon Master storytelling engine."""
     
-    def __init__(self):
-        """Initialize the storyteller with OpenAI client."""
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
-        self.memory = MemoryManager()
+    def __init__(self, client: Optional["OpenAI"] = None, async_client: Optional["AsyncOpenAI"] = None,
+                 memory: Optional[MemoryManager] = None, response_cache: Optional[ResponseCache] = None,
+                 transport: Optional[LLMTransport] = None, prompt_layout: str = PROMPT_LAYOUT,
+                 router: Optional[ModelRouter] = None, session: str = ""):
+        """Initialize the storyteller.
+        
+        Clients and memory can be passed in so many storytellers can share them.
+        Otherwise they are created on first use, or ahead of time by start_warmup().
+        LLM calls go through the process-wide response cache, transport and
+        model router unless others are given. prompt_layout is "classic" or "cache" (see PromptAssembler).
+        session names this game in telemetry and is the unit the rate-limit scheduler queues fairly.
+        """
+        self._client = client
+        self._async_client = async_client
+        self._memory = memory
+        self.response_cache = response_cache or get_response_cache()
+        self.transport = transport or get_transport()
+        self.router = router or get_router()
+        self._client_lock = threading.Lock()
+        self._memory_lock = threading.Lock()
         self.game_state = GameState()
         self.conversation_history: List[Dict] = []
+        self.prompt_assembler = PromptAssembler(MODEL_NAME, layout=prompt_layout)
+        self.session = session or uuid.uuid4().hex[:12]
+        self.telemetry = Telemetry(session=self.session)
+        self.compactor = HistoryCompactor(self._summarize)
+        self.extractor = self._new_extractor()
+        self.journal: Optional[Journal] = None
+        self.speculator: Optional[Speculator] = None
+        self._speculative_assembler = PromptAssembler(MODEL_NAME, layout=prompt_layout)
+    
+    @property
+    def client(self) -> "OpenAI":
+        """Get the OpenAI client, creating it on first use."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    with phase("import openai"):
+                        from openai import OpenAI
+                    with phase("create OpenAI client"):
+                        self._client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, max_retries=0,
+                                              http_client=http_client())
+        return self._client
+    
+    @client.setter
+    def client(self, client: "OpenAI"):
+        self._client = client
+    
+    @property
+    def async_client(self) -> "AsyncOpenAI":
+        """Get the async OpenAI client, creating it on first use."""
+        if self._async_client is None:
+            from openai import AsyncOpenAI
+            self._async_client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, max_retries=0,
+                                             http_client=async_http_client())
+        return self._async_client
     
-    def _call_llm(self, messages: List[Dict], temperature: float = NARRATIVE_TEMPERATURE) -> str:
-        """Make a call to the LLM."""
+    @property
+    def memory(self) -> MemoryManager:
+        """Get the memory manager, opening it on first use.
+        
+        If warmup is opening it on another thread this waits for it to finish.
+        """
+        if self._memory is None:
+            with self._memory_lock:
+                if self._memory is None:
+                    self._memory = MemoryManager()
+        return self._memory
+    
+    @memory.setter
+    def memory(self, memory: MemoryManager):
+        self._memory = memory
+    
+    def warmup(self):
+        """Open the OpenAI client, memory store and embedding model, then collect abandoned memories.
+        
+        Failures are only logged; the first real use raises them to the player.
+        """
         try:
-            response = self.client.chat.completions.create(
-                model=MODEL_NAME,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=1000
-            )
-            return response.choices[0].message.content
+            self.client
+        except Exception:
+            logger.exception("OpenAI client warmup failed")
+        try:
+            self.memory.warmup()
+        except Exception:
+            logger.exception("Memory warmup failed")
+        try:
+            self.collect_garbage()
+        except Exception:
+            logger.exception("Memory garbage collection failed")
+    
+    def start_warmup(self) -> threading.Thread:
+        """Run warmup() on a background thread so startup stays responsive."""
+        thread = threading.Thread(target=self.warmup, name="warmup", daemon=True)
+        thread.start()
+        return thread
+    
+    def _cache_lookup(self, model: str, messages: List[Dict], temperature: float,
+                      max_tokens: int) -> Tuple[Optional[str], Optional[str]]:
+        """Check the response cache for a request. Returns (cache key, recorded response)."""
+        cache = self.response_cache
+        if cache.mode == "off":
+            return None, None
+        key = cache.key(model, messages, temperature, max_tokens)
+        cached = cache.get(key) if cache.reads else None
+        if cached is None and cache.mode == "replay-only":
+            raise CacheMiss(f"No recorded response for request {key[:12]}")
+        return key, cached
+    
+    def _cache_store(self, key: Optional[str], response: str):
+        """Record a successful response if the cache is writing."""
+        if key is not None and self.response_cache.writes:
+            self.response_cache.put(key, response)
+    
+    @staticmethod
+    def _llm_phase(call_type: str) -> str:
+        """Name of the telemetry phase for an LLM call."""
+        return "llm" if call_type == "narration" else f"llm_{call_type}"
+    
+    @staticmethod
+    def _first_token_phase(call_type: str) -> str:
+        """Name of the time-to-first-token phase for a streamed call; only narration's is what the player waits for."""
+        return "first_token" if call_type == "narration" else f"first_token_{call_type}"
+    
+    def _failed(self, error: LLMError, call_type: str) -> LLMFailure:
+        """Record a call that failed for good and get its failure result."""
+        self.telemetry.emit({"type": "llm_failure", "call_type": call_type, "reason": error.reason})
+        return error.failure()
+    
+    def _finished(self, route: Route, call_type: str, started: float, usage, model: str):
+        """Record a completed call's latency and token usage against its route."""
+        self.router.record(route, time.perf_counter() - started, usage, model)
+        self.telemetry.record_usage(usage, call_type, turn=self.game_state.turn_count, route=route.name, model=model)
+    
+    @staticmethod
+    def _join_stream(parts: List[str]) -> str:
+        """Join streamed text; a stream that ended in failure gives its LLMFailure."""
+        if parts and isinstance(parts[-1], LLMFailure):
+            return parts[-1]
+        return "".join(parts)
+    
+    def _call_llm(self, messages: List[Dict], temperature: float = NARRATIVE_TEMPERATURE,
+                  max_tokens: Optional[int] = None, call_type: str = "narration",
+                  action: Optional[str] = None) -> str:
+        """Make a call to the LLM on the route for call_type and action. Returns an LLMFailure if it failed.
+        
+        If the route's model fails for good, its fallback model is tried once.
+        """
+        route = self.router.route(call_type, action)
+        max_tokens = max_tokens or route.max_tokens
+        with self.telemetry.span(self._llm_phase(call_type), route=route.name):
+            key, cached = self._cache_lookup(route.model, messages, temperature, max_tokens)
+            if cached is not None:
+                return cached
+            tokens = estimate_tokens(messages, max_tokens)
+            started = time.perf_counter()
+            for model in route.models:
+                try:
+                    response = self.transport.call(lambda timeout, model=model: self.client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        timeout=timeout
+                    ), route.name, route.timeout, self.session, tokens)
+                    break
+                except LLMError as e:
+                    error = e
+            else:
+                self.router.record(route, time.perf_counter() - started, failed=True)
+                return self._failed(error, call_type)
+            content = response.choices[0].message.content
+        self._finished(route, call_type, started, response.usage, model)
+        self._cache_store(key, content)
+        return content
+    
+    def _stream_llm(self, messages: List[Dict], temperature: float = NARRATIVE_TEMPERATURE,
+                    call_type: str = "narration", max_tokens: Optional[int] = None,
+                    action: Optional[str] = None) -> Iterator[str]:
+        """Stream a call to the LLM on the route for call_type and action, yielding text as it arrives.
+        
+        If the call fails the last chunk is an LLMFailure. The fallback model
+        is only tried if the stream could not be opened. Closing the iterator
+        early closes the HTTP stream, so the rest isn't generated.
+        """
+        route = self.router.route(call_type, action)
+        max_tokens = max_tokens or route.max_tokens
+        started = time.perf_counter()
+        key, cached = self._cache_lookup(route.model, messages, temperature, max_tokens)
+        if cached is not None:
+            yield cached
+            self.telemetry.observe(self._llm_phase(call_type), time.perf_counter() - started, route=route.name)
+            return
+        parts = []
+        usage = None
+        tokens = estimate_tokens(messages, max_tokens)
+        for model in route.models:
+            try:
+                stream = self.transport.open_stream(lambda timeout, model=model: self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    timeout=timeout
+                ), route.name, route.timeout, self.session, tokens)
+                break
+            except LLMError as e:
+                error = e
+        else:
+            self.router.record(route, time.perf_counter() - started, failed=True)
+            yield self._failed(error, call_type)
+            return
+        try:
+            with closing(stream):
+                for chunk in stream:
+                    usage = getattr(chunk, "usage", None) or usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if not parts:
+                            self.telemetry.observe(self._first_token_phase(call_type), time.perf_counter() - started)
+                        parts.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+        except Exception as e:
+            self.transport.stream_failed(e)
+            self.router.record(route, time.perf_counter() - started, failed=True)
+            yield self._failed(LLMError("error", str(e) or type(e).__name__), call_type)
+            return
+        self.telemetry.observe(self._llm_phase(call_type), time.perf_counter() - started, route=route.name)
+        self._finished(route, call_type, started, usage, model)
+        self._cache_store(key, "".join(parts))
+    
+    async def _acall_llm(self, messages: List[Dict], temperature: float = NARRATIVE_TEMPERATURE,
+                         call_type: str = "narration", action: Optional[str] = None) -> str:
+        """Make a non-blocking call to the LLM on its route. Returns an LLMFailure if it failed."""
+        route = self.router.route(call_type, action)
+        with self.telemetry.span(self._llm_phase(call_type), route=route.name):
+            key, cached = self._cache_lookup(route.model, messages, temperature, route.max_tokens)
+            if cached is not None:
+                return cached
+            tokens = estimate_tokens(messages, route.max_tokens)
+            started = time.perf_counter()
+            for model in route.models:
+                try:
+                    response = await self.transport.acall(
+                        lambda timeout, model=model: self.async_client.chat.completions.create(
+                            model=model,
+                            messages=messages,
+                            temperature=temperature,
+                            max_tokens=route.max_tokens,
+                            timeout=timeout
+                        ), route.name, route.timeout, self.session, tokens)
+                    break
+                except LLMError as e:
+                    error = e
+            else:
+                self.router.record(route, time.perf_counter() - started, failed=True)
+                return self._failed(error, call_type)
+            content = response.choices[0].message.content
+        self._finished(route, call_type, started, response.usage, model)
+        self._cache_store(key, content)
+        return content
+    
+    async def _astream_llm(self, messages: List[Dict], temperature: float = NARRATIVE_TEMPERATURE,
+                           call_type: str = "narration", action: Optional[str] = None) -> AsyncIterator[str]:
+        """Stream a non-blocking call to the LLM on its route, yielding text as it arrives.
+        
+        If the call fails the last chunk is an LLMFailure.
+        """
+        route = self.router.route(call_type, action)
+        started = time.perf_counter()
+        key, cached = self._cache_lookup(route.model, messages, temperature, route.max_tokens)
+        if cached is not None:
+            yield cached
+            self.telemetry.observe(self._llm_phase(call_type), time.perf_counter() - started, route=route.name)
+            return
+        parts = []
+        usage = None
+        tokens = estimate_tokens(messages, route.max_tokens)
+        for model in route.models:
+            try:
+                stream = await self.transport.aopen_stream(
+                    lambda timeout, model=model: self.async_client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=route.max_tokens,
+                        stream=True,
+                        stream_options={"include_usage": True},
+                        timeout=timeout
+                    ), route.name, route.timeout, self.session, tokens)
+                break
+            except LLMError as e:
+                error = e
+        else:
+            self.router.record(route, time.perf_counter() - started, failed=True)
+            yield self._failed(error, call_type)
+            return
+        try:
+            async for chunk in stream:
+                usage = getattr(chunk, "usage", None) or usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if not parts:
+                        self.telemetry.observe(self._first_token_phase(call_type), time.perf_counter() - started)
+                    parts.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
         except Exception as e:
-            return f"Error communicating with AI: {str(e)}"
+            self.transport.stream_failed(e)
+            self.router.record(route, time.perf_counter() - started, failed=True)
+            yield self._failed(LLMError("error", str(e) or type(e).__name__), call_type)
+            return
+        self.telemetry.observe(self._llm_phase(call_type), time.perf_counter() - started, route=route.name)
+        self._finished(route, call_type, started, usage, model)
+        self._cache_store(key, "".join(parts))
     
     def create_character_interactive(self, user_input: str) -> str:
         """Handle character creation conversation."""
@@ -41,23 +369,37 @@ class StoryTeller:
             {"role": "system", "content": CHARACTER_CREATION_PROMPT},
             {"role": "user", "content": user_input}
         ]
-        return self._call_llm(messages, temperature=0.7)
+        return self._call_llm(messages, temperature=0.7, call_type="character")
     
     def set_character(self, name: str, race: str, char_class: str, backstory: str):
         """Set the player's character."""
         self.game_state.set_character(name, race, char_class, backstory)
-        
-        # Store character in memory
-        char_info = f"PLAYER CHARACTER: {name}, a {race} {char_class}. {backstory}"
+        self._remember_player()
+    
+    def _remember_player(self):
+        """Store the player character in memory."""
+        pc = self.game_state.player_character
+        char_info = f"PLAYER CHARACTER: {pc['name']}, a {pc['race']} {pc['class']}. {pc['backstory']}"
         self.memory.add_character("player", char_info, {"is_player": True})
     
-    def start_adventure(self, setting: Optional[str] = None) -> str:
-        """Begin a new adventure."""
+    def _build_opening_messages(self, setting: Optional[str] = None) -> List[Dict]:
+        """Build the messages for the opening scene."""
         self.game_state.turn_count = 0
         
         setting_prompt = setting or "a mysterious fantasy world"
+        self.game_state.setting = setting_prompt
         character_summary = self.game_state.get_character_summary()
         
+        if self.prompt_assembler.layout == "cache":
+            # The same system messages open every later turn's prompt
+            return [
+                {"role": "system", "content": DUNGEON_MASTER_PROMPT},
+                {"role": "system", "content": campaign_sheet(setting_prompt, character_summary)},
+                {"role": "user", "content": "Begin the adventure. Create an engaging opening scene that introduces "
+                                            "the setting and presents the character with an initial situation or "
+                                            "mystery. End with choices for the player."}
+            ]
+        
         start_prompt = f"""Begin an exciting adventure for this character:
 {character_summary}
 
@@ -65,94 +407,437 @@ Setting: {setting_prompt}
 
 Create an engaging opening scene that introduces the setting and presents the character with an initial situation or mystery. End with choices for the player."""
 
-        messages = [
+        return [
             {"role": "system", "content": DUNGEON_MASTER_PROMPT},
             {"role": "user", "content": start_prompt}
         ]
+    
+    def _record_opening(self, messages: List[Dict], response: str):
+        """Store the opening scene in memory and history. A failed call stores nothing."""
+        if isinstance(response, LLMFailure):
+            return
+        with self.telemetry.span("memory_write", turn=0):
+            self.memory.add_story_event(
+                f"turn_0",
+                f"Adventure begins: {response[:500]}...",
+                {"turn": 0, "location": self.game_state.current_location}
+            )
         
-        response = self._call_llm(messages)
-        
-        # Store the opening in memory
-        self.memory.add_story_event(
-            f"turn_0",
-            f"Adventure begins: {response[:500]}...",
-            {"turn": 0, "type": "opening"}
-        )
-        
-        self.conversation_history = messages + [{"role": "assistant", "content": response}]
+        # System messages are added per request, so history starts at the opening request
+        self.conversation_history = ([m for m in messages if m["role"] != "system"]
+                                     + [{"role": "assistant", "content": response}])
+        self._extract(response)
+        self._journal_turn(messages[-1]["content"], response, opening=True)
+        self._speculate(response)
+    
+    def start_adventure(self, setting: Optional[str] = None) -> str:
+        """Begin a new adventure."""
+        with self.telemetry.span("turn", turn=0):
+            messages = self._build_opening_messages(setting)
+            response = self._call_llm(messages)
+            self._record_opening(messages, response)
+            return response
+    
+    def start_adventure_stream(self, setting: Optional[str] = None) -> Iterator[str]:
+        """Begin a new adventure, yielding the opening scene as it is generated.
         
-        return response
+        Memory and history are only updated once the stream has finished.
+        """
+        with self.telemetry.span("turn", turn=0):
+            messages = self._build_opening_messages(setting)
+            parts = []
+            for chunk in self._stream_llm(messages):
+                parts.append(chunk)
+                yield chunk
+            self._record_opening(messages, self._join_stream(parts))
     
-    def process_action(self, player_action: str) -> str:
-        """Process a player action and generate the next story segment."""
+    def _build_action_messages(self, player_action: str) -> List[Dict]:
+        """Advance the turn counter and build the messages for a player action."""
         self.game_state.turn_count += 1
+        
         turn = self.game_state.turn_count
         
         # Get relevant context from memory
-        context = self.memory.get_context_string(player_action)
-        character_summary = self.game_state.get_character_summary()
+        with self.telemetry.span("memory_retrieval", turn=turn):
+            memories = self.memory.search_relevant_memories(player_action)
         
-        # Build the prompt with context
-        action_prompt = f"""GAME CONTEXT:
-{context}
-
-PLAYER CHARACTER:
-{character_summary}
-
-PLAYER ACTION: {player_action}
-
-Continue the story based on this action. Remember to maintain consistency with all previous events and character details. Create consequences for the player's choice and present new options."""
-
-        # Use conversation history for continuity
-        messages = [
-            {"role": "system", "content": DUNGEON_MASTER_PROMPT}
-        ]
+        with self.telemetry.span("prompt_build", turn=turn):
+            return self._assemble_action_messages(player_action, memories, self.prompt_assembler,
+                                                  self.router.route("narration", player_action))
+    
+    def _settle_for_cache(self):
+        """When recording or replaying responses, let a running summary finish before a prompt is built.
+        
+        The synopsis is part of the prompt and so of its cache key; without
+        this, whether a turn sees the old or new synopsis depends on thread
+        timing, and replays miss.
+        """
+        if self.response_cache.reads or self.response_cache.writes:
+            self.compactor.wait()
+    
+    def _assemble_action_messages(self, player_action: str, memories: Dict[str, List[str]],
+                                  assembler: PromptAssembler, route: Route) -> List[Dict]:
+        """Assemble the messages for a player action from the current state. Changes nothing.
+        
+        The prompt fits the budget of every model on the route, since a fallback gets the same prompt.
+        """
+        self._settle_for_cache()
+        return assembler.build_action_messages(
+            DUNGEON_MASTER_PROMPT,
+            self.game_state.get_character_summary(),
+            self.conversation_history,
+            memories,
+            player_action,
+            synopsis=self.game_state.synopsis,
+            setting=self.game_state.setting,
+            models=route.models
+        )
+    
+    def _generate_branch(self, player_action: str, max_tokens: int, cancelled: threading.Event) -> Optional[str]:
+        """Generate the narration an action would get next turn, without touching any state.
         
-        # Add recent conversation history (last 6 exchanges)
-        recent_history = self.conversation_history[-12:] if len(self.conversation_history) > 12 else self.conversation_history[1:]
-        messages.extend(recent_history)
-        messages.append({"role": "user", "content": action_prompt})
+        Returns None if cancelled, on error, or if the response was cut off before its choices.
+        """
+        memories = self.memory.search_relevant_memories(player_action)
+        messages = self._assemble_action_messages(player_action, memories, self._speculative_assembler,
+                                                  self.router.route("speculative"))
+        parts = []
+        with closing(self._stream_llm(messages, call_type="speculative", max_tokens=max_tokens)) as stream:
+            for chunk in stream:
+                if cancelled.is_set():
+                    return None
+                parts.append(chunk)
+        response = self._join_stream(parts)
+        if isinstance(response, LLMFailure) or not parse_choices(response):
+            return None
+        return response
+    
+    def enable_speculation(self, max_branches: int = SPECULATIVE_BRANCHES, max_tokens: int = SPECULATIVE_MAX_TOKENS):
+        """Pre-generate the follow-up to each numbered choice while the player reads."""
+        self.speculator = Speculator(self._generate_branch, max_branches, max_tokens, self.telemetry)
+    
+    def _speculate(self, narration: str):
+        """Start speculating on a narration's choices, if enabled."""
+        if self.speculator is not None and self.speculator.max_branches > 0 and not isinstance(narration, LLMFailure):
+            self.speculator.start(narration)
+    
+    def _take_speculation(self, player_action: str) -> Optional[Tuple[str, str]]:
+        """Claim a prepared (choice, narration) for the player's input, committing the turn on a hit."""
+        if self.speculator is None:
+            return None
+        prepared = self.speculator.take(player_action)
+        if prepared is not None:
+            self.game_state.turn_count += 1
+            self._record_action(*prepared)
+        return prepared
+    
+    def _record_action(self, player_action: str, response: str):
+        """Store a completed turn in memory and conversation history.
         
-        response = self._call_llm(messages)
+        A failed call stores nothing and takes back the turn, so the player can retry it.
+        """
+        if isinstance(response, LLMFailure):
+            self.game_state.turn_count -= 1
+            return
+        turn = self.game_state.turn_count
         
         # Store in memory
         event_summary = f"Turn {turn}: Player chose '{player_action[:100]}'. Result: {response[:300]}..."
-        self.memory.add_story_event(
-            f"turn_{turn}",
-            event_summary,
-            {"turn": turn, "action": player_action[:100]}
-        )
+        with self.telemetry.span("memory_write", turn=turn):
+            self.memory.add_story_event(
+                f"turn_{turn}",
+                event_summary,
+                {"turn": turn, "action": player_action[:100], "location": self.game_state.current_location}
+            )
         
-        # Update conversation history
-        self.conversation_history.append({"role": "user", "content": action_prompt})
+        # Only the raw action goes into history; context is rebuilt every turn
+        self.conversation_history.append({"role": "user", "content": player_action})
         self.conversation_history.append({"role": "assistant", "content": response})
         
-        # Keep conversation history manageable
-        if len(self.conversation_history) > 20:
-            self.conversation_history = self.conversation_history[-16:]
+        # Keep conversation history manageable; evicted turns are summarized in the background
+        excess = self.prompt_assembler.history_overflow(len(self.conversation_history))
+        if excess > 0:
+            self.compactor.evict(self.conversation_history[:excess], self.game_state)
+            self.conversation_history = self.conversation_history[excess:]
         
-        return response
+        self._extract(response)
+        self._journal_turn(player_action, response)
+    
+    def _new_extractor(self) -> Optional[EntityExtractor]:
+        """Create the entity extractor for the current campaign, if extraction is on."""
+        if not ENTITY_EXTRACTION:
+            return None
+        # Extracted places are only mentioned, not necessarily visited
+        mention_location = lambda name, description: self.add_location(name, description, visit=False)
+        return EntityExtractor(self.add_npc, mention_location, self._existing_entities)
+    
+    def _reset_extractor(self):
+        """Finish extracting into the current campaign's memory and start afresh for the next one."""
+        if self.extractor is not None:
+            self.extractor.wait()
+        self.extractor = self._new_extractor()
+    
+    def _existing_entities(self) -> Dict[str, List[Tuple[str, str]]]:
+        """NPCs and locations already in memory, as (name, description) pairs."""
+        existing = {"npcs": [], "locations": []}
+        for key, kind in (("characters", "npcs"), ("locations", "locations")):
+            for _, document, metadata in self.memory.list_entries(key):
+                if metadata.get("is_player") or ": " not in document:
+                    continue
+                label, description = document.split(": ", 1)
+                existing[kind].append((metadata.get("name") or label.split(" - ", 1)[-1], description))
+        return existing
+    
+    def _extract(self, narration: str):
+        """Queue a narration for background entity extraction."""
+        if self.extractor is not None:
+            self.extractor.submit(narration, self.game_state)
+    
+    def _journal_turn(self, player_input: str, response: str, opening: bool = False):
+        """Append a finished turn to the campaign journal, snapshotting when one is due."""
+        if self.journal is None:
+            return
+        self.journal.append_turn(player_input, response, self.game_state.to_dict(), opening)
+        if self.journal.snapshot_due():
+            self.journal.snapshot(self.game_state.to_dict(), self.conversation_history, self.compactor.backlog())
+    
+    def _summarize(self, synopsis: str, messages: List[Dict]) -> Optional[str]:
+        """Fold exchanges into the synopsis with one LLM call. Returns None on failure."""
+        transcript = "\n\n".join(
+            f"{'PLAYER' if m['role'] == 'user' else 'DUNGEON MASTER'}: {m['content']}" for m in messages
+        )
+        prompt = f"""SYNOPSIS SO FAR:
+{synopsis or "The adventure has just begun."}
+
+LATEST EXCHANGES:
+{transcript}"""
+
+        response = self._call_llm(
+            [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": prompt}],
+            temperature=0.3,
+            max_tokens=SYNOPSIS_MAX_TOKENS,
+            call_type="summary"
+        )
+        if not response or isinstance(response, LLMFailure):
+            return None
+        return response.strip()
+    
+    def process_action(self, player_action: str) -> str:
+        """Process a player action and generate the next story segment."""
+        with self.telemetry.span("turn"):
+            prepared = self._take_speculation(player_action)
+            if prepared is not None:
+                self._speculate(prepared[1])
+                return prepared[1]
+            messages = self._build_action_messages(player_action)
+            response = self._call_llm(messages, action=player_action)
+            self._record_action(player_action, response)
+            self._speculate(response)
+            return response
+    
+    def process_action_stream(self, player_action: str) -> Iterator[str]:
+        """Process a player action, yielding the story segment as it is generated.
+        
+        Memory and history are only updated once the stream has finished.
+        """
+        with self.telemetry.span("turn"):
+            prepared = self._take_speculation(player_action)
+            if prepared is not None:
+                yield prepared[1]
+                self._speculate(prepared[1])
+                return
+            messages = self._build_action_messages(player_action)
+            parts = []
+            for chunk in self._stream_llm(messages, action=player_action):
+                parts.append(chunk)
+                yield chunk
+            response = self._join_stream(parts)
+            self._record_action(player_action, response)
+            self._speculate(response)
+    
+    async def astart_adventure(self, setting: Optional[str] = None) -> str:
+        """Begin a new adventure without blocking the event loop."""
+        with self.telemetry.span("turn", turn=0):
+            messages = self._build_opening_messages(setting)
+            response = await self._acall_llm(messages)
+            await asyncio.to_thread(self._record_opening, messages, response)
+            return response
+    
+    async def astart_adventure_stream(self, setting: Optional[str] = None) -> AsyncIterator[str]:
+        """Begin a new adventure, asynchronously yielding the opening scene as it is generated."""
+        with self.telemetry.span("turn", turn=0):
+            messages = self._build_opening_messages(setting)
+            parts = []
+            async for chunk in self._astream_llm(messages):
+                parts.append(chunk)
+                yield chunk
+            await asyncio.to_thread(self._record_opening, messages, self._join_stream(parts))
+    
+    async def aprocess_action(self, player_action: str) -> str:
+        """Process a player action without blocking the event loop.
+        
+        Memory access runs in a worker thread and the LLM call uses the async client.
+        """
+        with self.telemetry.span("turn"):
+            prepared = await asyncio.to_thread(self._take_speculation, player_action)
+            if prepared is not None:
+                self._speculate(prepared[1])
+                return prepared[1]
+            messages = await asyncio.to_thread(self._build_action_messages, player_action)
+            response = await self._acall_llm(messages, action=player_action)
+            await asyncio.to_thread(self._record_action, player_action, response)
+            self._speculate(response)
+            return response
+    
+    async def aprocess_action_stream(self, player_action: str) -> AsyncIterator[str]:
+        """Process a player action, asynchronously yielding the story segment as it is generated."""
+        with self.telemetry.span("turn"):
+            prepared = await asyncio.to_thread(self._take_speculation, player_action)
+            if prepared is not None:
+                yield prepared[1]
+                self._speculate(prepared[1])
+                return
+            messages = await asyncio.to_thread(self._build_action_messages, player_action)
+            parts = []
+            async for chunk in self._astream_llm(messages, action=player_action):
+                parts.append(chunk)
+                yield chunk
+            response = self._join_stream(parts)
+            await asyncio.to_thread(self._record_action, player_action, response)
+            self._speculate(response)
     
     def add_npc(self, name: str, description: str):
-        """Add an NPC to the game memory."""
-        npc_id = name.lower().replace(" ", "_")
-        self.memory.add_character(npc_id, f"NPC - {name}: {description}", {"is_player": False})
+        """Add or update an NPC in the game memory."""
+        npc_id = normalize_name(name).replace(" ", "_")
+        self.memory.add_character(npc_id, f"NPC - {name}: {description}", {"is_player": False, "name": name})
     
-    def add_location(self, name: str, description: str):
-        """Add a location to the game memory."""
-        loc_id = name.lower().replace(" ", "_")
-        self.memory.add_location(loc_id, f"LOCATION - {name}: {description}")
-        self.game_state.current_location = name
+    def add_location(self, name: str, description: str, visit: bool = True):
+        """Add or update a location in the game memory, and make it the current one if visiting."""
+        loc_id = normalize_name(name).replace(" ", "_")
+        self.memory.add_location(loc_id, f"LOCATION - {name}: {description}", {"name": name})
+        if visit:
+            self.game_state.current_location = name
     
     def get_story_so_far(self) -> str:
         """Get a summary of the story so far."""
+        if self.game_state.synopsis:
+            return self.game_state.synopsis
+        
         if not self.game_state.story_summary:
             return "The adventure has just begun..."
         
         return "\n".join(self.game_state.story_summary[-10:])
     
+    def start_journal(self, directory: str = SAVE_DIRECTORY) -> Journal:
+        """Journal this campaign from now on, keeping its memories in their own namespace."""
+        if self.journal is not None:
+            self.journal.close()
+        self._reset_extractor()
+        self.journal = Journal.create(directory)
+        self._switch_namespace(self.journal.namespace, directory)
+        if self.game_state.player_character:
+            self._remember_player()
+        return self.journal
+    
+    def _switch_namespace(self, namespace: str, directory: str = SAVE_DIRECTORY):
+        """Move to another campaign's memories, deleting the ones left behind unless a saved campaign owns them.
+        
+        Memory is opened before the player picks a campaign, so without this
+        every launch would leave an unsaved namespace behind until garbage
+        collection. The unprefixed namespace of older data is always kept.
+        """
+        previous = self.memory.namespace
+        self.memory.use_namespace(namespace)
+        if previous and previous != namespace and previous not in saved_namespaces(directory):
+            self.memory.delete_namespace(previous)
+    
+    def save_game(self):
+        """Snapshot the journaled campaign so it resumes without replaying turns."""
+        if self.journal is None:
+            raise RuntimeError("This campaign has no journal; call start_journal() first")
+        if self.extractor is not None:
+            self.extractor.wait()
+        self.memory.flush()
+        self.journal.snapshot(self.game_state.to_dict(), self.conversation_history, self.compactor.backlog())
+    
+    def load_game(self, campaign_id: str, directory: str = SAVE_DIRECTORY):
+        """Resume a saved campaign from its snapshot and journal tail.
+        
+        The campaign's vector memories are reattached as they are; nothing is re-embedded.
+        """
+        journal = Journal.open(campaign_id, directory)
+        state, history, backlog = journal.resume(self.prompt_assembler.history_overflow)
+        if self.speculator is not None:
+            self.speculator.cancel()
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = journal
+        
+        self.game_state = GameState()
+        self.game_state.from_dict(state)
+        self.conversation_history = history
+        self.compactor = HistoryCompactor(self._summarize)
+        self.compactor.restore(backlog)
+        self._reset_extractor()
+        self._switch_namespace(journal.namespace, directory)
+    
+    def export_campaign(self, path: str) -> Dict[str, int]:
+        """Back up this campaign's memories and game state to one compact archive file."""
+        if self.extractor is not None:
+            self.extractor.wait()
+        with self.telemetry.span("export_campaign"):
+            return self.memory.export_campaign(path, self.game_state)
+    
+    def import_campaign(self, path: str, directory: str = SAVE_DIRECTORY):
+        """Restore an exported campaign as a new saved campaign and continue it.
+        
+        Memories keep their archived vectors; nothing is re-embedded. The
+        archive has no conversation history, so play picks up from the
+        synopsis and memories.
+        """
+        journal = Journal.create(directory)
+        previous = self.memory.namespace
+        try:
+            with self.telemetry.span("import_campaign"):
+                game_state = self.memory.import_campaign(path, journal.namespace)
+        except Exception:
+            journal.close()
+            shutil.rmtree(journal.path, ignore_errors=True)
+            raise
+        if self.speculator is not None:
+            self.speculator.cancel()
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = journal
+        
+        self.game_state = game_state or GameState()
+        self.conversation_history = []
+        self.compactor = HistoryCompactor(self._summarize)
+        self._reset_extractor()
+        self.save_game()
+        if previous and previous not in saved_namespaces(directory):
+            self.memory.delete_namespace(previous)
+    
+    def collect_garbage(self, max_idle: float = MEMORY_GC_MAX_IDLE, directory: str = SAVE_DIRECTORY) -> List[str]:
+        """Delete, in the background, memories of campaigns that went unused and were never saved."""
+        return self.memory.collect_garbage(max_idle, keep=saved_namespaces(directory))
+    
     def new_game(self):
-        """Start a completely new game."""
-        self.memory.clear_all()
+        """Start a completely new game in its own memory namespace.
+        
+        A journaled campaign stays saved and the new game gets its own journal;
+        otherwise the old memories are deleted in the background.
+        """
+        if self.speculator is not None:
+            self.speculator.cancel()
+        self.memory.flush()
         self.game_state = GameState()
         self.conversation_history = []
+        self.compactor = HistoryCompactor(self._summarize)
+        if self.journal is not None:
+            self.start_journal(os.path.dirname(self.journal.path))
+        else:
+            self._reset_extractor()
+            abandoned = self.memory.namespace
+            self.memory.start_campaign()
+            self.memory.delete_namespace(abandoned)
@@ -0,0 +1,288 @@
+"""Offline OpenAI-compatible chat completions server for development and benchmarks.
+
+Point the game at it with OPENAI_BASE_URL=http://127.0.0.1:8090/v1; any API
+key is accepted. Responses are canned Dungeon Master narration ending in
+numbered choices, delivered after a configurable first-token latency at a
+configurable token rate, with or without streaming. To rehearse a degraded
+provider, a fraction of requests can fail with 503 or stall for extra time.
+With --rpm or --tpm it enforces per-minute limits like a provider does:
+every response carries x-ratelimit-* headers, and requests over the limit
+get a 429 with Retry-After.
+Like a provider's prompt cache, usage reports the longest message-aligned
+prompt prefix seen before as cached tokens, in 128-token steps.
+
+Usage:
+    python stub_server.py --port 8090 --latency 0.3 --token-rate 50 --tokens 120
+    python stub_server.py --error-rate 0.1 --tail-rate 0.05 --tail-latency 5
+    python stub_server.py --rpm 60 --tpm 40000
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Deque, Dict, List, Optional, Tuple
+
+SCENES = [
+    "The torchlight flickers across the damp stone as a hooded figure steps from the shadows of Blackwater Keep.",
+    "Rain hammers the roof of the Gilded Tankard while Mirelle the innkeeper polishes a cracked mug and watches you.",
+    "A cold wind sweeps over the Ashen Moor, carrying the distant toll of a bell that should have been silent for centuries.",
+    "Deep beneath the Sunken Library, water laps at shelves of swollen books and something moves between the stacks."
+]
+
+CHOICES = [
+    "Draw your weapon and stand your ground",
+    "Speak to the stranger and ask what they want",
+    "Search the area for clues",
+    "Slip away quietly and follow the path north"
+]
+
+
+def narration(messages: List[dict], tokens: int) -> str:
+    """Build a deterministic response of roughly the requested number of tokens."""
+    seed = int(hashlib.md5(json.dumps(messages[-1:]).encode("utf-8")).hexdigest(), 16)
+    words = []
+    scene = seed % len(SCENES)
+    while len(words) < max(tokens - 24, 8):
+        words.extend(SCENES[scene].split())
+        scene = (scene + 1) % len(SCENES)
+    body = " ".join(words[:max(tokens - 24, 8)])
+    choices = "\n".join(f"{i + 1}. {choice}" for i, choice in enumerate(CHOICES[:3]))
+    return f"{body}\n\n{choices}"
+
+
+def split_tokens(text: str) -> List[str]:
+    """Split text into word-sized pieces that stand in for tokens."""
+    pieces = []
+    for i, word in enumerate(text.split(" ")):
+        pieces.append(word if i == 0 else " " + word)
+    return pieces
+
+
+class PrefixCache:
+    """Remembers prompt prefixes, ending at message boundaries, to report cached tokens."""
+    
+    STEP = 128  # providers cache prefixes in blocks of this many tokens
+    
+    def __init__(self, max_entries: int = 100000):
+        self.max_entries = max_entries
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def cached_tokens(self, messages: List[dict]) -> int:
+        """Tokens of the longest previously seen prefix of messages, then remember all of its prefixes."""
+        digest = hashlib.sha1()
+        tokens = 0
+        cached = 0
+        with self._lock:
+            for message in messages:
+                digest.update(json.dumps(message, sort_keys=True).encode("utf-8"))
+                tokens += len(message.get("content", "")) // 4
+                key = digest.hexdigest()
+                if key in self._seen:
+                    self._seen.move_to_end(key)
+                    cached = tokens
+                else:
+                    self._seen[key] = None
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+        return cached // self.STEP * self.STEP
+
+
+class RateLimiter:
+    """Requests and tokens per minute over a sliding window. A limit of 0 is unlimited.
+    
+    Like a provider, a request counts its prompt tokens plus max_tokens when it is admitted.
+    """
+    
+    def __init__(self, rpm: int = 0, tpm: int = 0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._window: Deque[Tuple[float, int]] = deque()
+        self._tokens = 0
+        self._lock = threading.Lock()
+    
+    def admit(self, tokens: int) -> Tuple[bool, Dict[str, str]]:
+        """Count a request if it fits. Returns whether it does and the rate-limit headers to send."""
+        with self._lock:
+            now = time.monotonic()
+            while self._window and now - self._window[0][0] >= 60.0:
+                self._tokens -= self._window.popleft()[1]
+            admitted = ((not self.rpm or len(self._window) < self.rpm)
+                        and (not self.tpm or self._tokens + tokens <= self.tpm))
+            if admitted:
+                self._window.append((now, tokens))
+                self._tokens += tokens
+            reset = 60.0 - (now - self._window[0][0]) if self._window else 0.0
+            headers = {}
+            for unit, limit, used in (("requests", self.rpm, len(self._window)), ("tokens", self.tpm, self._tokens)):
+                if limit:
+                    headers[f"x-ratelimit-limit-{unit}"] = str(limit)
+                    headers[f"x-ratelimit-remaining-{unit}"] = str(max(0, limit - used))
+                    headers[f"x-ratelimit-reset-{unit}"] = f"{reset:.3f}s"
+            if not admitted:
+                headers["retry-after-ms"] = str(int(reset * 1000) + 1)
+            return admitted, headers
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Serves POST /v1/chat/completions."""
+    
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers and body go out as separate writes
+    latency = 0.0
+    token_rate = 0.0
+    tokens = 120
+    error_rate = 0.0  # fraction of requests answered with 503
+    tail_rate = 0.0  # fraction of requests delayed by tail_latency on top
+    tail_latency = 0.0
+    prefix_cache = PrefixCache()
+    rate_limiter = RateLimiter()
+    
+    def log_message(self, *args):
+        pass
+    
+    def _send_json(self, status: int, payload: dict, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client gave up, e.g. a timed out or losing hedged request
+    
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+        
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        messages = request.get("messages", [])
+        model = request.get("model", "stub")
+        max_tokens = request.get("max_tokens") or self.tokens
+        text = narration(messages, min(self.tokens, max_tokens))
+        pieces = split_tokens(text)
+        usage = {
+            "prompt_tokens": sum(len(m.get("content", "")) for m in messages) // 4,
+            "completion_tokens": len(pieces),
+            "total_tokens": 0,
+            "prompt_tokens_details": {"cached_tokens": self.prefix_cache.cached_tokens(messages)}
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        
+        admitted, headers = self.rate_limiter.admit(usage["prompt_tokens"] + max_tokens)
+        if not admitted:
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                            "code": "rate_limit_exceeded"}}, headers)
+            return
+        if random.random() < self.error_rate:
+            self._send_json(503, {"error": {"message": "The stub is overloaded", "type": "server_error"}})
+            return
+        time.sleep(self.latency + (self.tail_latency if random.random() < self.tail_rate else 0.0))
+        
+        if not request.get("stream"):
+            if self.token_rate:
+                time.sleep(len(pieces) / self.token_rate)
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage
+            }, headers)
+            return
+        
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.close_connection = True
+        
+        def send(payload):
+            self.wfile.write(f"data: {payload}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        
+        def chunk(delta: dict, finish_reason=None) -> str:
+            return json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            })
+        
+        try:
+            send(chunk({"role": "assistant", "content": ""}))
+            for piece in pieces:
+                if self.token_rate:
+                    time.sleep(1 / self.token_rate)
+                send(chunk({"content": piece}))
+            send(chunk({}, "stop"))
+            if (request.get("stream_options") or {}).get("include_usage"):
+                send(json.dumps({"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                                 "model": model, "choices": [], "usage": usage}))
+            send("[DONE]")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client stopped reading, e.g. a cancelled stream
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                      token_rate: float = 0.0, tokens: int = 120, error_rate: float = 0.0,
+                      tail_rate: float = 0.0, tail_latency: float = 0.0, rpm: int = 0,
+                      tpm: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """Start the stub on a background thread. Returns the server and its base URL."""
+    handler = type("ConfiguredStubHandler", (StubHandler,), {
+        "latency": latency,
+        "token_rate": token_rate,
+        "tokens": tokens,
+        "error_rate": error_rate,
+        "tail_rate": tail_rate,
+        "tail_latency": tail_latency,
+        "prefix_cache": PrefixCache(),
+        "rate_limiter": RateLimiter(rpm, tpm)
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-server", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline OpenAI-compatible stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="tokens per second, 0 for instant")
+    parser.add_argument("--tokens", type=int, default=120, help="tokens per response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail with 503")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="fraction of requests that stall")
+    parser.add_argument("--tail-latency", type=float, default=5.0, help="extra seconds a stalled request takes")
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute before 429s, 0 for no limit")
+    parser.add_argument("--tpm", type=int, default=0, help="tokens per minute before 429s, 0 for no limit")
+    args = parser.parse_args()
+    
+    server, base_url = start_stub_server(args.host, args.port, args.latency, args.token_rate, args.tokens,
+                                         args.error_rate, args.tail_rate, args.tail_latency, args.rpm, args.tpm)
+    print(f"Stub server listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
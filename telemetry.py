@@ -0,0 +1,237 @@
+"""Per-turn phase timings and token usage with pluggable sinks."""
+
+import json
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from config import TELEMETRY_SINKS, TELEMETRY_JSONL_PATH, TELEMETRY_RING_SIZE, PROMETHEUS_PORT
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+class JsonlSink:
+    """Appends every event to a JSON-lines trace file."""
+    
+    def __init__(self, path: str = TELEMETRY_JSONL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+    
+    def write(self, event: Dict):
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(event) + "\n")
+
+
+class RingBufferSink:
+    """Keeps the most recent events in memory for the stats command."""
+    
+    def __init__(self, size: int = TELEMETRY_RING_SIZE):
+        self.events = deque(maxlen=size)
+        self._lock = threading.Lock()
+    
+    def write(self, event: Dict):
+        with self._lock:
+            self.events.append(event)
+    
+    def summary(self) -> Dict:
+        """Get p50/p95 per phase and token totals over the buffered events."""
+        with self._lock:
+            events = list(self.events)
+        
+        durations: Dict[str, List[float]] = {}
+        tokens = {"calls": 0, "prompt": 0, "completion": 0, "cached": 0, "by_call": {}}
+        for event in events:
+            if event["type"] == "span":
+                durations.setdefault(event["phase"], []).append(event["seconds"])
+            elif event["type"] == "usage":
+                tokens["calls"] += 1
+                tokens["prompt"] += event["prompt_tokens"]
+                tokens["completion"] += event["completion_tokens"]
+                tokens["cached"] += event["cached_tokens"]
+                by_call = tokens["by_call"]
+                by_call[event["call_type"]] = (by_call.get(event["call_type"], 0)
+                                               + event["prompt_tokens"] + event["completion_tokens"])
+        
+        tokens["cache_hit_rate"] = tokens["cached"] / tokens["prompt"] if tokens["prompt"] else 0.0
+        
+        phases = {
+            phase: {"count": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95)}
+            for phase, values in durations.items()
+        }
+        return {"phases": phases, "tokens": tokens}
+
+
+class PrometheusExporter:
+    """Aggregates events into Prometheus histograms and counters."""
+    
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    
+    def __init__(self):
+        self._histograms: Dict[str, List] = {}
+        self._tokens: Dict[tuple, int] = {}
+        self._speculation: Dict[str, int] = {}
+        self._failures: Dict[tuple, int] = {}
+        self.collectors: List[Callable[[], List[str]]] = []  # more metric lines, e.g. the rate-limit scheduler's
+        self._lock = threading.Lock()
+    
+    def write(self, event: Dict):
+        with self._lock:
+            if event["type"] == "span":
+                counts, total = self._histograms.setdefault(event["phase"], [[0] * (len(self.BUCKETS) + 1), 0.0])
+                for i, bound in enumerate(self.BUCKETS):
+                    if event["seconds"] <= bound:
+                        counts[i] += 1
+                counts[-1] += 1
+                self._histograms[event["phase"]][1] = total + event["seconds"]
+            elif event["type"] == "usage":
+                for kind in ("prompt", "completion", "cached"):
+                    key = (event["call_type"], kind)
+                    self._tokens[key] = self._tokens.get(key, 0) + event[f"{kind}_tokens"]
+            elif event["type"] == "speculation":
+                self._speculation[event["outcome"]] = self._speculation.get(event["outcome"], 0) + 1
+            elif event["type"] == "llm_failure":
+                key = (event["call_type"], event["reason"])
+                self._failures[key] = self._failures.get(key, 0) + 1
+    
+    def render(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP dungeon_master_phase_seconds Time spent in each phase of a turn.",
+            "# TYPE dungeon_master_phase_seconds histogram"
+        ]
+        with self._lock:
+            for phase, (counts, total) in sorted(self._histograms.items()):
+                for bound, count in zip(self.BUCKETS, counts):
+                    lines.append(f'dungeon_master_phase_seconds_bucket{{phase="{phase}",le="{bound}"}} {count}')
+                lines.append(f'dungeon_master_phase_seconds_bucket{{phase="{phase}",le="+Inf"}} {counts[-1]}')
+                lines.append(f'dungeon_master_phase_seconds_sum{{phase="{phase}"}} {total}')
+                lines.append(f'dungeon_master_phase_seconds_count{{phase="{phase}"}} {counts[-1]}')
+            lines.append("# HELP dungeon_master_tokens_total Tokens used by LLM calls.")
+            lines.append("# TYPE dungeon_master_tokens_total counter")
+            for (call_type, kind), count in sorted(self._tokens.items()):
+                lines.append(f'dungeon_master_tokens_total{{call="{call_type}",kind="{kind}"}} {count}')
+            lines.append("# HELP dungeon_master_speculation_total Speculated turns by whether a prepared choice was picked.")
+            lines.append("# TYPE dungeon_master_speculation_total counter")
+            for outcome, count in sorted(self._speculation.items()):
+                lines.append(f'dungeon_master_speculation_total{{outcome="{outcome}"}} {count}')
+            lines.append("# HELP dungeon_master_llm_failures_total LLM calls that failed after retries, by reason.")
+            lines.append("# TYPE dungeon_master_llm_failures_total counter")
+            for (call_type, reason), count in sorted(self._failures.items()):
+                lines.append(f'dungeon_master_llm_failures_total{{call="{call_type}",reason="{reason}"}} {count}')
+        for collector in self.collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+    
+    def serve(self, port: int) -> threading.Thread:
+        """Serve /metrics over HTTP on a background thread."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        
+        exporter = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, *args):
+                pass
+        
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        thread = threading.Thread(target=server.serve_forever, name="prometheus", daemon=True)
+        thread.start()
+        return thread
+
+
+class Telemetry:
+    """Times the phases of each turn and records token usage.
+    
+    Every event goes to all sinks. The ring buffer is per storyteller so the
+    stats command reports on the current session; the other sinks are shared.
+    """
+    
+    def __init__(self, sinks: Optional[List] = None, session: str = ""):
+        self.session = session
+        self.ring = RingBufferSink()
+        self.sinks = [self.ring] + (sinks if sinks is not None else shared_sinks())
+    
+    def emit(self, event: Dict):
+        event["ts"] = time.time()
+        if self.session:
+            event["session"] = self.session
+        for sink in self.sinks:
+            sink.write(event)
+    
+    def observe(self, phase: str, seconds: float, **attrs):
+        """Record how long a phase took."""
+        self.emit({"type": "span", "phase": phase, "seconds": seconds, **attrs})
+    
+    @contextmanager
+    def span(self, phase: str, **attrs):
+        """Time the enclosed block as a phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - start, **attrs)
+    
+    def record_usage(self, usage, call_type: str = "narration", **attrs):
+        """Record token counts from an API response's usage block."""
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.emit({
+            "type": "usage",
+            "call_type": call_type,
+            "prompt_tokens": usage.prompt_tokens or 0,
+            "completion_tokens": usage.completion_tokens or 0,
+            "cached_tokens": (getattr(details, "cached_tokens", None) or 0) if details else 0,
+            **attrs
+        })
+    
+    def summary(self) -> Dict:
+        """Get p50/p95 per phase and token totals for this session."""
+        return self.ring.summary()
+
+
+_shared_sinks: Optional[List] = None
+_shared_lock = threading.Lock()
+
+
+def get_prometheus_exporter() -> Optional[PrometheusExporter]:
+    """Get the shared Prometheus exporter, if it is enabled."""
+    for sink in shared_sinks():
+        if isinstance(sink, PrometheusExporter):
+            return sink
+    return None
+
+
+def shared_sinks() -> List:
+    """Build the process-wide sinks selected by TELEMETRY_SINKS, once."""
+    global _shared_sinks
+    with _shared_lock:
+        if _shared_sinks is None:
+            _shared_sinks = []
+            names = {name.strip() for name in TELEMETRY_SINKS.split(",") if name.strip()}
+            if "jsonl" in names:
+                _shared_sinks.append(JsonlSink())
+            if "prometheus" in names:
+                exporter = PrometheusExporter()
+                if PROMETHEUS_PORT:
+                    exporter.serve(PROMETHEUS_PORT)
+                _shared_sinks.append(exporter)
+        return _shared_sinks
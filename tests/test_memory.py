@@ -0,0 +1,37 @@
+"""Tests for folding old story events into bounded chapters."""
+
+import re
+
+import pytest
+
+import embeddings
+import memory
+from memory import MemoryManager
+from vector_store import create_store
+from test_response_cache import HashEmbeddings
+
+
+@pytest.fixture(autouse=True)
+def hash_embeddings(monkeypatch):
+    monkeypatch.setattr(embeddings, "_embedding_function", HashEmbeddings())
+
+
+def test_merged_chapters_keep_whole_events(tmp_path, monkeypatch):
+    # Small limits so a few events fold into chapters and the chapters get merged
+    monkeypatch.setattr(memory, "MAX_MEMORY_ITEMS", 4)
+    monkeypatch.setattr(memory, "CHAPTER_TURNS", 2)
+    monkeypatch.setattr(memory, "MAX_CHAPTERS", 2)
+    monkeypatch.setattr(memory, "CHAPTER_MAX_CHARS", 300)
+    manager = MemoryManager(str(tmp_path), store=create_store("numpy", str(tmp_path)))
+    
+    events = [f"At dusk on day {turn} the wardens held the river gate against the drowned." for turn in range(16)]
+    for turn, event in enumerate(events):
+        manager.add_story_event(f"event_{turn}", f"Turn {turn}: Player chose 'hold'. Result: {event}", {"turn": turn})
+        manager.flush()  # one turn at a time, as in play
+    
+    chapters = [(doc, meta) for _, doc, meta in manager.list_entries("story") if meta["type"] == "chapter"]
+    assert len(chapters) == 2
+    assert any(meta["turn_end"] - meta["turn_start"] + 1 > memory.CHAPTER_TURNS for _, meta in chapters)
+    for doc, _ in chapters:
+        sentences = re.split(r"(?<=\.) ", doc.split("): ", 1)[1])
+        assert sentences and all(sentence in events for sentence in sentences)
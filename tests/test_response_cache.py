@@ -0,0 +1,86 @@
+"""Tests for recording a campaign's LLM responses and replaying it offline."""
+
+import hashlib
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import embeddings
+from config import HISTORY_WINDOW, SUMMARY_BATCH_TURNS, SUMMARY_PROMPT
+from memory import MemoryManager
+from response_cache import ResponseCache
+from storyteller import StoryTeller
+from vector_store import create_store
+
+
+class HashEmbeddings:
+    """Deterministic stand-in for the ONNX model: a normalized hash of each word."""
+    
+    def __call__(self, input):
+        vectors = []
+        for document in input:
+            vector = np.zeros(64, dtype=np.float32)
+            for word in document.lower().split():
+                vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % 64] += 1.0
+            vectors.append(vector / (np.linalg.norm(vector) or 1.0))
+        return vectors
+    
+    def warmup(self):
+        pass
+
+
+class ScriptedCompletions:
+    """Answers chat completions deterministically from the request; summaries take a while."""
+    
+    def __init__(self, summary_delay: float):
+        self.summary_delay = summary_delay
+        self.calls = 0
+    
+    def create(self, model, messages, temperature, max_tokens, timeout=None, **kwargs):
+        self.calls += 1
+        digest = hashlib.sha256(repr(messages).encode()).hexdigest()[:8]
+        if messages[0]["content"] == SUMMARY_PROMPT:
+            time.sleep(self.summary_delay)
+            content = f"The story so far ({digest})."
+        else:
+            content = (f"Mirelle the smith waves you toward Blackwater Keep ({digest}).\n"
+                       "1. Press on\n2. Turn back")
+        usage = SimpleNamespace(prompt_tokens=100, completion_tokens=20, prompt_tokens_details=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+
+class OfflineCompletions:
+    def create(self, **kwargs):
+        raise AssertionError("replay-only mode called the API")
+
+
+def play(tmp_path, mode: str, completions, turns: int):
+    storyteller = StoryTeller(
+        client=SimpleNamespace(chat=SimpleNamespace(completions=completions)),
+        memory=MemoryManager(str(tmp_path / mode), store=create_store("numpy", str(tmp_path / mode))),
+        response_cache=ResponseCache(str(tmp_path / "responses.jsonl"), mode)
+    )
+    storyteller.set_character("Ayla", "Elf", "Mage", "Raised in the Ashen Moor.")
+    narrations = [storyteller.start_adventure("the Ashen Moor")]
+    for turn in range(turns):
+        narrations.append(storyteller.process_action(f"I search the ruins, step {turn}"))
+    storyteller.compactor.wait()
+    return narrations, storyteller.game_state.synopsis
+
+
+@pytest.fixture(autouse=True)
+def hash_embeddings(monkeypatch):
+    monkeypatch.setattr(embeddings, "_embedding_function", HashEmbeddings())
+
+
+def test_replay_past_the_history_window_hits_every_request(tmp_path):
+    # Enough turns that several summaries rewrite the synopsis while play goes on
+    turns = HISTORY_WINDOW // 2 + 3 * SUMMARY_BATCH_TURNS
+    recorded, synopsis = play(tmp_path, "record", ScriptedCompletions(summary_delay=0.05), turns)
+    assert synopsis.startswith("The story so far")
+    
+    replayed, replayed_synopsis = play(tmp_path, "replay-only", OfflineCompletions(), turns)
+    assert replayed == recorded
+    assert replayed_synopsis == synopsis
@@ -0,0 +1,157 @@
+"""Tests for the shared rate-limit scheduler in scheduler.py."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from scheduler import RateLimitScheduler, TokenBucket, estimate_tokens, parse_duration
+
+
+def wait_for_depth(scheduler: RateLimitScheduler, priority: str, depth: int):
+    """Wait until a priority class has depth callers queued."""
+    for _ in range(200):
+        if scheduler.stats()[priority]["depth"] == depth:
+            return
+        time.sleep(0.005)
+    raise AssertionError(f"{priority} queue never reached {depth}")
+
+
+@pytest.mark.parametrize("value, seconds", [
+    ("20ms", 0.02), ("1.5s", 1.5), ("6m0s", 360.0), ("1h2m", 3720.0), ("2", 2.0), ("", None), (None, None),
+    ("soon", None)
+])
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == (pytest.approx(seconds) if seconds is not None else None)
+
+
+def test_estimate_tokens_counts_characters_and_the_response_budget():
+    messages = [{"role": "user", "content": "x" * 400}, {"role": "system", "content": None}]
+    assert estimate_tokens(messages, 100) == 100 + 4 + 4 + 100
+
+
+def test_token_bucket_refills_over_a_minute():
+    bucket = TokenBucket(60)
+    bucket.take(60)
+    assert bucket.wait(1) == pytest.approx(1.0)
+    bucket.refill(bucket._updated + 30)
+    assert bucket.level == pytest.approx(30)
+    assert bucket.wait(1) == 0
+
+
+def test_unlimited_scheduler_never_queues():
+    scheduler = RateLimitScheduler(rpm=0, tpm=0)
+    for _ in range(100):
+        assert scheduler.try_acquire("turn", "a", 1000)
+    assert scheduler.acquire("summary", "a", 1000)
+
+
+def test_headers_set_unknown_limits():
+    scheduler = RateLimitScheduler(rpm=0, tpm=0)
+    scheduler.observe({"x-ratelimit-limit-requests": "500", "x-ratelimit-remaining-requests": "499",
+                       "x-ratelimit-limit-tokens": "90000", "x-ratelimit-remaining-tokens": "80000"})
+    stats = scheduler.stats()
+    assert (stats["rpm"], stats["tpm"]) == (500, 90000)
+    assert stats["requests_left"] == 499
+    assert stats["tokens_left"] == 80000
+
+
+def test_headers_never_raise_a_configured_limit():
+    scheduler = RateLimitScheduler(rpm=30, tpm=0)
+    scheduler.observe({"x-ratelimit-limit-requests": "500"})
+    assert scheduler.stats()["rpm"] == 30
+    scheduler.observe({"x-ratelimit-limit-requests": "10"})
+    assert scheduler.stats()["rpm"] == 10
+
+
+def test_exhausted_headers_pause_until_the_reset():
+    scheduler = RateLimitScheduler(rpm=0, tpm=0)
+    scheduler.observe({"x-ratelimit-limit-requests": "6000", "x-ratelimit-remaining-requests": "0",
+                       "x-ratelimit-reset-requests": "100ms"})
+    assert not scheduler.try_acquire("turn")
+    started = time.monotonic()
+    assert scheduler.acquire("turn", "a")
+    assert 0.08 <= time.monotonic() - started < 1.0
+
+
+def test_throttle_pauses_for_retry_after():
+    scheduler = RateLimitScheduler(rpm=0, tpm=0)
+    assert scheduler.throttled_for({"retry-after-ms": "100"}) == pytest.approx(0.1, abs=0.01)
+    assert not scheduler.try_acquire("turn")
+    started = time.monotonic()
+    assert scheduler.acquire("turn")
+    assert time.monotonic() - started >= 0.08
+    assert scheduler.stats()["throttled"] == 1
+
+
+def test_throttle_without_retry_after_backs_off_exponentially():
+    scheduler = RateLimitScheduler(rpm=0, tpm=0)
+    first = scheduler.throttled_for()
+    second = scheduler.throttled_for()
+    assert second > first
+
+
+def test_background_calls_leave_the_reserve_for_player_turns():
+    scheduler = RateLimitScheduler(rpm=100, tpm=0, background_kinds={"summary"}, background_reserve=0.2)
+    scheduler.requests.level = 10
+    assert not scheduler.try_acquire("summary")
+    assert scheduler.try_acquire("turn")
+
+
+def test_acquire_gives_up_at_the_deadline():
+    scheduler = RateLimitScheduler(rpm=0, tpm=0)
+    scheduler.throttled_for({"retry-after": "5"})
+    started = time.monotonic()
+    assert not scheduler.acquire("turn", "a", deadline_at=started + 0.05)
+    assert time.monotonic() - started < 1.0
+    stats = scheduler.stats()
+    assert stats["interactive"]["expired"] == 1
+    assert stats["interactive"]["depth"] == 0
+
+
+def test_player_turns_go_first_and_sessions_take_turns():
+    scheduler = RateLimitScheduler(rpm=0, tpm=0, background_kinds={"summary"})
+    scheduler.throttled_for({"retry-after-ms": "300"})  # every caller queues until the pause ends
+    order = []
+    
+    def call(kind: str, session: str, label: str):
+        assert scheduler.acquire(kind, session, deadline_at=time.monotonic() + 5)
+        order.append(label)
+    
+    threads = []
+    queued = {"interactive": 0, "background": 0}
+    for kind, session, label in [("summary", "a", "a1"), ("turn", "b", "b1"), ("turn", "b", "b2"),
+                                 ("turn", "c", "c1"), ("turn", "c", "c2")]:
+        threads.append(threading.Thread(target=call, args=(kind, session, label)))
+        threads[-1].start()
+        queued[scheduler.priority(kind)] += 1
+        wait_for_depth(scheduler, scheduler.priority(kind), queued[scheduler.priority(kind)])
+    for thread in threads:
+        thread.join(5)
+    
+    assert order == ["b1", "c1", "b2", "c2", "a1"]
+    stats = scheduler.stats()
+    assert stats["interactive"]["max_depth"] == 4
+    assert stats["background"]["granted"] == 1
+
+
+def test_async_callers_share_the_queue_with_threads():
+    scheduler = RateLimitScheduler(rpm=0, tpm=0, background_kinds={"summary"})
+    scheduler.throttled_for({"retry-after-ms": "200"})
+    order = []
+    
+    def blocking():
+        assert scheduler.acquire("summary", "a", deadline_at=time.monotonic() + 5)
+        order.append("thread")
+    
+    async def run():
+        thread = threading.Thread(target=blocking)
+        thread.start()
+        wait_for_depth(scheduler, "background", 1)
+        assert await scheduler.aacquire("turn", "b", deadline_at=time.monotonic() + 5)
+        order.append("task")
+        thread.join(5)
+    
+    asyncio.run(run())
+    assert order == ["task", "thread"]
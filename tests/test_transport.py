@@ -0,0 +1,202 @@
+"""Tests for the circuit breaker, retries and hedging in transport.py."""
+
+import asyncio
+import time
+from collections import deque
+from types import SimpleNamespace
+
+import pytest
+
+from scheduler import RateLimitScheduler
+from transport import CircuitBreaker, LLMError, LLMTransport, LLM_HEDGE_MIN_SAMPLES
+
+
+class StatusError(Exception):
+    """An API error with a status code, like the openai client's."""
+    
+    def __init__(self, status_code: int, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+def make_transport(**kwargs) -> LLMTransport:
+    options = {"deadline": 5.0, "attempt_timeout": 1.0, "max_retries": 3, "backoff_base": 0.001,
+               "backoff_max": 0.001, "hedge": False, "breaker": CircuitBreaker(3, 0.05),
+               "scheduler": RateLimitScheduler(rpm=0, tpm=0)}
+    options.update(kwargs)
+    return LLMTransport(**options)
+
+
+def failing(errors, result="ok"):
+    """A request that raises the given errors in turn, then returns result."""
+    errors = list(errors)
+    
+    def request(timeout):
+        if errors:
+            raise errors.pop(0)
+        return result
+    return request
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10.0)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.counts == {"opened": 1, "rejected": 1}
+
+
+def test_breaker_success_resets_the_failure_count():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10.0)
+    for _ in range(2):
+        breaker.record_failure()
+    breaker.record_success()
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_breaker_half_open_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()  # only one trial at a time
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_breaker_failed_trial_opens_the_circuit_again():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.counts["opened"] == 2
+
+
+def test_breaker_replaces_a_trial_that_never_reports_back():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+
+
+def test_retryable_errors_are_retried():
+    transport = make_transport()
+    assert transport.call(failing([TimeoutError(), StatusError(503)])) == "ok"
+    assert transport.counts["retries"] == 2
+    assert transport.counts["timeouts"] == 1
+    assert transport.breaker.state == "closed"
+
+
+def test_client_errors_fail_at_once_without_feeding_the_breaker():
+    transport = make_transport()
+    with pytest.raises(LLMError) as raised:
+        transport.call(failing([StatusError(400)]))
+    assert raised.value.reason == "error"
+    assert transport.counts["retries"] == 0
+    assert transport.breaker._failures == 0
+
+
+def test_repeated_failures_open_the_circuit_and_fail_fast():
+    transport = make_transport(max_retries=1)
+    for _ in range(2):
+        with pytest.raises(LLMError):
+            transport.call(failing([StatusError(500)] * 2))
+    assert transport.breaker.state == "open"
+    
+    calls = []
+    with pytest.raises(LLMError) as raised:
+        transport.call(lambda timeout: calls.append(timeout))
+    assert raised.value.reason == "circuit_open"
+    assert calls == []
+
+
+def test_rate_limited_responses_pause_instead_of_opening_the_circuit():
+    transport = make_transport()
+    started = time.monotonic()
+    result = transport.call(failing([StatusError(429, {"retry-after-ms": "50"})] * 3))
+    assert result == "ok"
+    assert transport.counts["throttled"] == 3
+    assert transport.breaker.state == "closed"
+    assert time.monotonic() - started >= 0.05
+
+
+def hedging_transport() -> LLMTransport:
+    transport = make_transport(hedge=True)
+    transport._latencies["narration"] = deque([0.02] * LLM_HEDGE_MIN_SAMPLES)
+    return transport
+
+
+def test_no_hedging_before_enough_latency_samples():
+    transport = make_transport(hedge=True)
+    assert transport.hedge_delay("narration") is None
+
+
+def test_slow_call_is_hedged_and_the_duplicate_wins():
+    transport = hedging_transport()
+    attempts = []
+    
+    def request(timeout):
+        attempts.append(timeout)
+        if len(attempts) == 1:
+            time.sleep(0.5)
+            return "slow"
+        return "fast"
+    
+    started = time.monotonic()
+    assert transport.call(request) == "fast"
+    assert time.monotonic() - started < 0.4
+    assert transport.counts["hedges"] == 1
+    assert transport.counts["hedge_wins"] == 1
+
+
+def test_no_hedge_when_the_rate_limits_have_no_room():
+    scheduler = RateLimitScheduler(rpm=60, tpm=0)
+    transport = hedging_transport()
+    transport.scheduler = scheduler
+    scheduler.requests.level = 1  # room for the primary only
+    
+    def request(timeout):
+        time.sleep(0.1)
+        return "primary"
+    
+    assert transport.call(request) == "primary"
+    assert transport.counts["hedges"] == 0
+
+
+def test_async_hedge_cancels_the_losing_request():
+    transport = hedging_transport()
+    attempts = []
+    cancelled = []
+    
+    async def request(timeout):
+        attempts.append(timeout)
+        if len(attempts) == 1:
+            try:
+                await asyncio.sleep(1.0)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+            return "slow"
+        return "fast"
+    
+    async def run():
+        result = await transport.acall(request)
+        await asyncio.sleep(0)  # let the cancellation land
+        return result
+    
+    assert asyncio.run(run()) == "fast"
+    assert cancelled == [True]
+    assert transport.counts["hedge_wins"] == 1
@@ -0,0 +1,412 @@
+"""Resilient LLM calls: deadlines, jittered retries, hedged requests, a circuit breaker and rate limits."""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from config import (
+    LLM_DEADLINE,
+    LLM_ATTEMPT_TIMEOUT,
+    LLM_MAX_RETRIES,
+    LLM_BACKOFF_BASE,
+    LLM_BACKOFF_MAX,
+    LLM_HEDGE,
+    LLM_HEDGE_MIN_SAMPLES,
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_RESET_TIMEOUT
+)
+from scheduler import RateLimitScheduler, get_scheduler
+from telemetry import percentile
+
+logger = logging.getLogger(__name__)
+
+# Text every failed call's result starts with
+LLM_ERROR_PREFIX = "Error communicating with AI"
+
+LATENCY_SAMPLES = 200  # recent latencies per call type, for the hedge delay
+
+# Runs primary and hedged requests for blocking calls that may be hedged
+_HEDGE_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm-hedge")
+
+
+class LLMFailure(str):
+    """The result of an LLM call that failed for good.
+    
+    It reads like any response, so it can be shown to the player as is,
+    but it is never narration: callers check isinstance(response, LLMFailure)
+    and keep it out of memory, history, the journal and the response cache.
+    """
+    
+    def __new__(cls, reason: str, detail: str = ""):
+        failure = super().__new__(cls, f"{LLM_ERROR_PREFIX}: {detail or reason}")
+        failure.reason = reason  # "timeout", "circuit_open", "rate_limited" or "error"
+        return failure
+
+
+class LLMError(Exception):
+    """Raised by the transport when a call has failed and will not be retried."""
+    
+    def __init__(self, reason: str, detail: str):
+        super().__init__(detail)
+        self.reason = reason
+    
+    def failure(self) -> LLMFailure:
+        return LLMFailure(self.reason, str(self))
+
+
+def is_timeout(error: BaseException) -> bool:
+    """Whether an error means the upstream did not answer in time."""
+    return isinstance(error, TimeoutError) or type(error).__name__ in ("APITimeoutError", "ReadTimeout")
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a failed call may succeed if tried again.
+    
+    Timeouts, dropped connections, 408, 409, 429 and 5xx responses are;
+    other 4xx responses mean the request itself is wrong.
+    """
+    if is_timeout(error) or isinstance(error, ConnectionError):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    # The openai client's connection errors carry no status code
+    return type(error).__name__ == "APIConnectionError"
+
+
+class CircuitBreaker:
+    """Fails calls fast while the upstream keeps failing.
+    
+    After failure_threshold consecutive failures the circuit opens and every
+    call is rejected for reset_timeout seconds. Then a single trial call is
+    let through: success closes the circuit, failure opens it again.
+    """
+    
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self.counts = {"opened": 0, "rejected": 0}
+    
+    def allow(self) -> bool:
+        """Whether a call may go out now."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if self.state == "open" and now - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_at = None
+            # A trial that never reported back (e.g. a cancelled call) is replaced after reset_timeout
+            if self.state == "half_open" and (self._trial_at is None or now - self._trial_at >= self.reset_timeout):
+                self._trial_at = now
+                return True
+            self.counts["rejected"] += 1
+            return False
+    
+    def retry_in(self) -> float:
+        """Seconds until the open circuit lets a trial call through."""
+        return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+    
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._trial_at = None
+    
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.counts["opened"] += 1
+                    logger.warning("LLM circuit opened after %d failures", self._failures)
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._trial_at = None
+
+
+class LLMTransport:
+    """Runs LLM requests with a deadline, retries, optional hedging, a circuit breaker and rate limits.
+    
+    A request is a function of the timeout for one attempt, e.g.
+    lambda timeout: client.chat.completions.create(..., timeout=timeout).
+    Retryable failures are retried with fully jittered exponential backoff
+    until max_retries or the deadline (the transport's, or one given per
+    call) runs out, and feed the circuit breaker. With hedging on, a call still running after the p95 latency of
+    recent calls of its kind gets one duplicate request, and the first to
+    succeed wins. Clients should be created with max_retries=0 so only the
+    transport retries.
+    
+    Every attempt waits its turn with the rate-limit scheduler first, as
+    the given session and with its estimated tokens; that wait counts
+    against the deadline. A 429 doesn't feed the breaker: the scheduler
+    holds every caller back for its Retry-After instead.
+    """
+    
+    def __init__(self, deadline: float = LLM_DEADLINE, attempt_timeout: float = LLM_ATTEMPT_TIMEOUT,
+                 max_retries: int = LLM_MAX_RETRIES, backoff_base: float = LLM_BACKOFF_BASE,
+                 backoff_max: float = LLM_BACKOFF_MAX, hedge: bool = LLM_HEDGE,
+                 breaker: Optional[CircuitBreaker] = None, scheduler: Optional[RateLimitScheduler] = None):
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker()
+        self.scheduler = scheduler or get_scheduler()
+        self._latencies: Dict[str, Deque[float]] = {}
+        self.counts = {"calls": 0, "retries": 0, "timeouts": 0, "throttled": 0, "hedges": 0, "hedge_wins": 0,
+                       "failures": 0}
+    
+    def hedge_delay(self, kind: str) -> Optional[float]:
+        """How long a call of this kind runs before it is hedged, or None to not hedge."""
+        latencies = self._latencies.get(kind)
+        if not self.hedge or latencies is None or len(latencies) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return percentile(list(latencies), 95)
+    
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            raise LLMError("circuit_open",
+                           f"The AI service is unavailable, trying again in {self.breaker.retry_in():.0f}s")
+    
+    def _attempt_timeout(self, deadline_at: float, deadline: float, admitted: bool) -> float:
+        """The timeout for an attempt the scheduler has, or has not, admitted in time."""
+        if not admitted:
+            raise LLMError("rate_limited", f"Rate limit: no capacity within {deadline:g}s")
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            raise LLMError("timeout", f"No response within {deadline:g}s")
+        return min(self.attempt_timeout, remaining)
+    
+    def _admit(self, deadline_at: float, deadline: float, kind: str, session: str, tokens: int) -> float:
+        """Check the breaker, then wait for rate-limit capacity. Returns the attempt's timeout."""
+        self._check_breaker()
+        admitted = self.scheduler.acquire(kind, session, tokens, deadline_at)
+        return self._attempt_timeout(deadline_at, deadline, admitted)
+    
+    async def _aadmit(self, deadline_at: float, deadline: float, kind: str, session: str, tokens: int) -> float:
+        """Check the breaker, then wait on the event loop for rate-limit capacity. Returns the attempt's timeout."""
+        self._check_breaker()
+        admitted = await self.scheduler.aacquire(kind, session, tokens, deadline_at)
+        return self._attempt_timeout(deadline_at, deadline, admitted)
+    
+    def _succeeded(self, kind: str, seconds: float):
+        self.breaker.record_success()
+        self._latencies.setdefault(kind, deque(maxlen=LATENCY_SAMPLES)).append(seconds)
+    
+    def _retry_delay(self, error: Exception, attempt: int, deadline_at: float) -> float:
+        """Account for a failed attempt. Returns the backoff before retrying, or raises LLMError."""
+        if isinstance(error, LLMError):
+            raise error
+        detail = str(error) or type(error).__name__
+        if not is_retryable(error):
+            # The upstream answered; it is the request that was refused
+            self.breaker.record_success()
+            self.counts["failures"] += 1
+            raise LLMError("error", detail) from error
+        
+        pause = 0.0
+        if getattr(error, "status_code", None) == 429:
+            # The upstream answered; we are over the rate limit, and the next attempt queues until it resets
+            self.breaker.record_success()
+            self.counts["throttled"] += 1
+            pause = self.scheduler.throttled_for(getattr(getattr(error, "response", None), "headers", None))
+        else:
+            self.breaker.record_failure()
+        reason = "timeout" if is_timeout(error) else "error"
+        if reason == "timeout":
+            self.counts["timeouts"] += 1
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if attempt >= self.max_retries or time.monotonic() + max(delay, pause) >= deadline_at:
+            self.counts["failures"] += 1
+            raise LLMError(reason, detail) from error
+        self.counts["retries"] += 1
+        logger.warning("LLM call failed (%s), retrying in %.2fs", detail, delay)
+        return delay
+    
+    def stream_failed(self, error: Exception):
+        """Report a stream that failed after it was opened. It is not retried."""
+        if is_retryable(error):
+            self.breaker.record_failure()
+        self.counts["failures"] += 1
+    
+    def call(self, request: Callable[[float], Any], kind: str = "narration",
+             deadline: Optional[float] = None, session: str = "", tokens: int = 0) -> Any:
+        """Run a blocking request to completion. Raises LLMError once it has failed for good."""
+        self.counts["calls"] += 1
+        deadline = deadline or self.deadline
+        deadline_at = time.monotonic() + deadline
+        attempt = 0
+        while True:
+            timeout = self._admit(deadline_at, deadline, kind, session, tokens)
+            started = time.monotonic()
+            try:
+                result = self._hedged(request, timeout, kind, session, tokens)
+            except Exception as e:
+                time.sleep(self._retry_delay(e, attempt, deadline_at))
+                attempt += 1
+                continue
+            self._succeeded(kind, time.monotonic() - started)
+            return result
+    
+    def _hedged(self, request: Callable[[float], Any], timeout: float, kind: str, session: str = "",
+                tokens: int = 0) -> Any:
+        """Run one attempt, sending a duplicate if it outlasts the hedge delay and the rate limits allow."""
+        delay = self.hedge_delay(kind)
+        if delay is None or delay >= timeout:
+            return request(timeout)
+        ends = time.monotonic() + timeout
+        primary = _HEDGE_POOL.submit(request, timeout)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        if not self.scheduler.try_acquire(kind, session, tokens):
+            # A duplicate would only queue behind other calls or add to a 429
+            return primary.result(timeout=max(0.0, ends - time.monotonic()))
+        
+        self.counts["hedges"] += 1
+        hedge = _HEDGE_POOL.submit(request, max(0.001, ends - time.monotonic()))
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            # The loser can't be interrupted; its response is dropped when it arrives
+            done, pending = wait(pending, timeout=max(0.0, ends - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f"No response within {timeout:g}s")
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self.counts["hedge_wins"] += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+    
+    def open_stream(self, request: Callable[[float], Any], kind: str = "narration",
+                    deadline: Optional[float] = None, session: str = "", tokens: int = 0) -> Any:
+        """Open a blocking stream, retrying until it is open. Raises LLMError once it has failed for good.
+        
+        Streams are not hedged or retried once open, since their text may
+        already have reached the player; report read failures with stream_failed().
+        """
+        self.counts["calls"] += 1
+        deadline = deadline or self.deadline
+        deadline_at = time.monotonic() + deadline
+        attempt = 0
+        while True:
+            timeout = self._admit(deadline_at, deadline, kind, session, tokens)
+            try:
+                stream = request(timeout)
+            except Exception as e:
+                time.sleep(self._retry_delay(e, attempt, deadline_at))
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return stream
+    
+    async def acall(self, request: Callable[[float], Awaitable[Any]], kind: str = "narration",
+                    deadline: Optional[float] = None, session: str = "", tokens: int = 0) -> Any:
+        """Run a non-blocking request to completion. Raises LLMError once it has failed for good."""
+        self.counts["calls"] += 1
+        deadline = deadline or self.deadline
+        deadline_at = time.monotonic() + deadline
+        attempt = 0
+        while True:
+            timeout = await self._aadmit(deadline_at, deadline, kind, session, tokens)
+            started = time.monotonic()
+            try:
+                result = await self._ahedged(request, timeout, kind, session, tokens)
+            except Exception as e:
+                await asyncio.sleep(self._retry_delay(e, attempt, deadline_at))
+                attempt += 1
+                continue
+            self._succeeded(kind, time.monotonic() - started)
+            return result
+    
+    async def _ahedged(self, request: Callable[[float], Awaitable[Any]], timeout: float, kind: str,
+                       session: str = "", tokens: int = 0) -> Any:
+        """Run one attempt, sending a duplicate if it outlasts the hedge delay and the rate limits allow.
+        
+        The loser is cancelled.
+        """
+        delay = self.hedge_delay(kind)
+        if delay is None or delay >= timeout:
+            return await asyncio.wait_for(request(timeout), timeout)
+        ends = time.monotonic() + timeout
+        tasks = [asyncio.ensure_future(request(timeout))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return tasks[0].result()
+            if not self.scheduler.try_acquire(kind, session, tokens):
+                done, _ = await asyncio.wait(tasks, timeout=max(0.0, ends - time.monotonic()))
+                if not done:
+                    raise TimeoutError(f"No response within {timeout:g}s")
+                return tasks[0].result()
+            
+            self.counts["hedges"] += 1
+            tasks.append(asyncio.ensure_future(request(max(0.001, ends - time.monotonic()))))
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(0.0, ends - time.monotonic()),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise TimeoutError(f"No response within {timeout:g}s")
+                for task in done:
+                    if task.exception() is None:
+                        if task is tasks[1]:
+                            self.counts["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def aopen_stream(self, request: Callable[[float], Awaitable[Any]], kind: str = "narration",
+                           deadline: Optional[float] = None, session: str = "", tokens: int = 0) -> Any:
+        """Open a non-blocking stream, retrying until it is open. Raises LLMError once it has failed for good."""
+        self.counts["calls"] += 1
+        deadline = deadline or self.deadline
+        deadline_at = time.monotonic() + deadline
+        attempt = 0
+        while True:
+            timeout = await self._aadmit(deadline_at, deadline, kind, session, tokens)
+            try:
+                stream = await asyncio.wait_for(request(timeout), timeout)
+            except Exception as e:
+                await asyncio.sleep(self._retry_delay(e, attempt, deadline_at))
+                attempt += 1
+                continue
+            self.breaker.record_success()
+            return stream
+    
+    def stats(self) -> Dict:
+        """Get the call counters and the circuit state."""
+        return {**self.counts, "circuit": self.breaker.state, **{f"circuit_{k}": v for k, v in self.breaker.counts.items()}}
+
+
+_shared: Optional[LLMTransport] = None
+_shared_lock = threading.Lock()
+
+
+def get_transport() -> LLMTransport:
+    """Get the process-wide transport, so every storyteller shares one circuit breaker."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = LLMTransport()
+        return _shared
@@ -0,0 +1,409 @@
+"""Pluggable vector storage backends for the memory system.
+
+Every backend hands out collections with the subset of the ChromaDB
+collection API that MemoryManager uses: upsert, query, get, delete and count.
+"""
+
+import heapq
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+from config import MEMORY_BACKEND, NUMPY_VECTOR_DTYPE
+
+
+class VectorStore:
+    """Interface for a store of named vector collections."""
+    
+    def get_or_create_collection(self, name: str, metadata: Optional[Dict] = None, embedding_function=None):
+        """Open a collection, creating it if needed."""
+        raise NotImplementedError
+    
+    def delete_collection(self, name: str):
+        """Delete a collection and everything in it."""
+        raise NotImplementedError
+    
+    def list_collections(self) -> List[str]:
+        """List the names of every collection in the store."""
+        raise NotImplementedError
+
+
+class ChromaStore(VectorStore):
+    """ChromaDB PersistentClient backend."""
+    
+    def __init__(self, persist_directory: str, client=None):
+        import chromadb
+        
+        self.client = client or chromadb.PersistentClient(path=persist_directory)
+    
+    def get_or_create_collection(self, name: str, metadata: Optional[Dict] = None, embedding_function=None):
+        if embedding_function is None:
+            return self.client.get_or_create_collection(name=name, metadata=metadata)
+        return self.client.get_or_create_collection(
+            name=name,
+            metadata=metadata,
+            embedding_function=embedding_function
+        )
+    
+    def delete_collection(self, name: str):
+        self.client.delete_collection(name)
+    
+    def list_collections(self) -> List[str]:
+        return [c if isinstance(c, str) else c.name for c in self.client.list_collections()]
+
+
+def _matches(metadata: Dict, where: Optional[Dict]) -> bool:
+    """Evaluate a ChromaDB-style metadata filter against one item."""
+    if not where:
+        return True
+    for field, condition in where.items():
+        if field == "$and":
+            if not all(_matches(metadata, clause) for clause in condition):
+                return False
+        elif field == "$or":
+            if not any(_matches(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(field)
+            for op, operand in condition.items():
+                if op == "$eq" and value != operand:
+                    return False
+                if op == "$ne" and value == operand:
+                    return False
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$nin" and value in operand:
+                    return False
+                if op in ("$gt", "$gte", "$lt", "$lte"):
+                    if value is None:
+                        return False
+                    if op == "$gt" and not value > operand:
+                        return False
+                    if op == "$gte" and not value >= operand:
+                        return False
+                    if op == "$lt" and not value < operand:
+                        return False
+                    if op == "$lte" and not value <= operand:
+                        return False
+        elif metadata.get(field) != condition:
+            return False
+    return True
+
+
+class NumpyCollection:
+    """A collection kept as a memory-mapped .npy matrix plus a JSON-lines side table.
+    
+    Vectors are L2-normalized on write, so search is a cosine top-k over
+    blocked matrix multiplies. The side table is append-only: each line records
+    the row, id, document and metadata of a write, or a deletion, and the last
+    line for a row wins when the collection is opened. Deleted rows are reused
+    by later writes, so a pruned collection keeps a bounded footprint.
+    """
+    
+    BLOCK_ROWS = 16384
+    
+    def __init__(self, directory: str, name: str, dtype: str = NUMPY_VECTOR_DTYPE):
+        import numpy as np
+        
+        self._np = np
+        self.name = name
+        self.dtype = np.dtype(dtype)
+        self._vector_path = os.path.join(directory, f"{name}.npy")
+        self._table_path = os.path.join(directory, f"{name}.jsonl")
+        self._lock = threading.RLock()
+        
+        self._ids: List[Optional[str]] = []
+        self._documents: List[Optional[str]] = []
+        self._metadatas: List[Optional[Dict]] = []
+        self._index: Dict[str, int] = {}
+        self._live = np.zeros(0, dtype=bool)
+        self._free: List[int] = []  # heap of deleted rows, reused lowest first
+        self._log_lines = 0
+        self._vectors = None
+        
+        self._load()
+    
+    def _load(self):
+        """Rebuild the in-memory table from disk and map the vectors."""
+        np = self._np
+        log_lines = 0
+        if os.path.exists(self._table_path):
+            with open(self._table_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    log_lines += 1
+                    record = json.loads(line)
+                    row = record["row"]
+                    self._grow_rows(row + 1)
+                    old_id = self._ids[row]
+                    if old_id is not None:
+                        self._index.pop(old_id, None)
+                    if record.get("deleted"):
+                        self._ids[row] = None
+                        self._documents[row] = None
+                        self._metadatas[row] = None
+                    else:
+                        self._ids[row] = record["id"]
+                        self._documents[row] = record["document"]
+                        self._metadatas[row] = record["metadata"]
+                        self._index[record["id"]] = row
+        
+        self._live = np.array([item_id is not None for item_id in self._ids], dtype=bool)
+        self._free = [row for row, item_id in enumerate(self._ids) if item_id is None]
+        if os.path.exists(self._vector_path):
+            self._vectors = np.load(self._vector_path, mmap_mode="r+")
+        
+        self._log_lines = log_lines
+        self._maybe_compact()
+    
+    def _maybe_compact(self):
+        """Rewrite the side table once superseded and deleted lines dominate it."""
+        if self._log_lines > 2 * max(len(self._index), 64):
+            self._rewrite_table()
+            self._log_lines = len(self._index)
+    
+    def _grow_rows(self, rows: int):
+        """Extend the side table so it has at least the given number of rows."""
+        while len(self._ids) < rows:
+            self._ids.append(None)
+            self._documents.append(None)
+            self._metadatas.append(None)
+        if len(self._live) < rows:
+            live = self._np.zeros(max(rows, 2 * len(self._live)), dtype=bool)
+            live[:len(self._live)] = self._live
+            self._live = live
+    
+    def _rewrite_table(self):
+        """Rewrite the side table with one line per live row."""
+        tmp_path = self._table_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for row, item_id in enumerate(self._ids):
+                if item_id is not None:
+                    f.write(json.dumps({
+                        "row": row,
+                        "id": item_id,
+                        "document": self._documents[row],
+                        "metadata": self._metadatas[row]
+                    }) + "\n")
+        os.replace(tmp_path, self._table_path)
+    
+    def _ensure_capacity(self, rows: int, dim: int):
+        """Grow the memory-mapped matrix so it holds at least the given rows."""
+        np = self._np
+        if self._vectors is not None and self._vectors.shape[0] >= rows:
+            return
+        capacity = max(64, rows, 2 * (self._vectors.shape[0] if self._vectors is not None else 0))
+        tmp_path = self._vector_path + ".tmp"
+        grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=self.dtype, shape=(capacity, dim))
+        if self._vectors is not None:
+            grown[:len(self._vectors)] = self._vectors
+        grown.flush()
+        del grown
+        self._vectors = None
+        os.replace(tmp_path, self._vector_path)
+        self._vectors = np.load(self._vector_path, mmap_mode="r+")
+    
+    def _normalize(self, embeddings) -> Any:
+        np = self._np
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix[None, :]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+    
+    def count(self) -> int:
+        return len(self._index)
+    
+    def add(self, ids: List[str], embeddings, documents: List[str], metadatas: Optional[List[Dict]] = None):
+        self.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+    
+    def upsert(self, ids: List[str], embeddings, documents: List[str], metadatas: Optional[List[Dict]] = None, **kwargs):
+        """Insert or replace items by id."""
+        if embeddings is None:
+            raise ValueError("NumpyCollection needs precomputed embeddings")
+        metadatas = metadatas or [{} for _ in ids]
+        vectors = self._normalize(embeddings)
+        
+        with self._lock:
+            rows = []
+            next_row = len(self._ids)
+            for item_id in ids:
+                row = self._index.get(item_id)
+                if row is None:
+                    # Fill rows freed by deletes first so pruned collections stay compact
+                    if self._free:
+                        row = heapq.heappop(self._free)
+                    else:
+                        row = next_row
+                        next_row += 1
+                    self._index[item_id] = row
+                rows.append(row)
+            
+            self._ensure_capacity(next_row, vectors.shape[1])
+            self._grow_rows(next_row)
+            
+            lines = []
+            for i, (row, item_id) in enumerate(zip(rows, ids)):
+                self._vectors[row] = vectors[i]
+                self._ids[row] = item_id
+                self._documents[row] = documents[i]
+                self._metadatas[row] = metadatas[i]
+                self._live[row] = True
+                lines.append(json.dumps({
+                    "row": row,
+                    "id": item_id,
+                    "document": documents[i],
+                    "metadata": metadatas[i]
+                }))
+            self._vectors.flush()
+            with open(self._table_path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            self._log_lines += len(lines)
+            self._maybe_compact()
+    
+    def _select_rows(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None) -> List[int]:
+        """Find live rows matching an id list and/or metadata filter."""
+        if ids is not None:
+            rows = [self._index[item_id] for item_id in ids if item_id in self._index]
+        else:
+            rows = [row for row, item_id in enumerate(self._ids) if item_id is not None]
+        if where:
+            rows = [row for row in rows if _matches(self._metadatas[row], where)]
+        return rows
+    
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None,
+            limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Optional[List[str]] = None) -> Dict:
+        """Fetch items by id and/or metadata filter."""
+        include = include or ["documents", "metadatas"]
+        with self._lock:
+            rows = self._select_rows(ids, where)
+            start = offset or 0
+            rows = rows[start:start + limit] if limit is not None else rows[start:]
+            result = {"ids": [self._ids[row] for row in rows]}
+            if "documents" in include:
+                result["documents"] = [self._documents[row] for row in rows]
+            if "metadatas" in include:
+                result["metadatas"] = [self._metadatas[row] for row in rows]
+            if "embeddings" in include:
+                result["embeddings"] = self._np.array(self._vectors[rows], dtype=self._np.float32) if rows else []
+        return result
+    
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None):
+        """Delete items by id and/or metadata filter."""
+        with self._lock:
+            rows = self._select_rows(ids, where)
+            if not rows:
+                return
+            for row in rows:
+                self._index.pop(self._ids[row], None)
+                self._ids[row] = None
+                self._documents[row] = None
+                self._metadatas[row] = None
+                self._live[row] = False
+                heapq.heappush(self._free, row)
+            with open(self._table_path, "a", encoding="utf-8") as f:
+                f.write("\n".join(json.dumps({"row": row, "deleted": True}) for row in rows) + "\n")
+            self._log_lines += len(rows)
+            self._maybe_compact()
+    
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[Dict] = None, **kwargs) -> Dict:
+        """Brute-force cosine top-k over the matrix, one block of rows at a time."""
+        np = self._np
+        queries = self._normalize(query_embeddings)
+        empty = {"ids": [[] for _ in queries], "documents": [[] for _ in queries],
+                 "metadatas": [[] for _ in queries], "distances": [[] for _ in queries]}
+        
+        with self._lock:
+            total = len(self._ids)
+            if self._vectors is None or not self._index:
+                return empty
+            
+            live = self._live[:total].copy()
+            if where:
+                for row in np.flatnonzero(live):
+                    live[row] = _matches(self._metadatas[row], where)
+            k = min(n_results, int(live.sum()))
+            if k == 0:
+                return empty
+            
+            best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+            best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+            for start in range(0, total, self.BLOCK_ROWS):
+                end = min(start + self.BLOCK_ROWS, total)
+                mask = live[start:end]
+                if not mask.any():
+                    continue
+                block = np.asarray(self._vectors[start:end], dtype=np.float32)
+                scores = queries @ block.T
+                scores[:, ~mask] = -np.inf
+                scores = np.concatenate([best_scores, scores], axis=1)
+                rows = np.concatenate([best_rows, np.broadcast_to(np.arange(start, end), (len(queries), end - start))], axis=1)
+                if scores.shape[1] > k:
+                    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                    scores = np.take_along_axis(scores, top, axis=1)
+                    rows = np.take_along_axis(rows, top, axis=1)
+                best_scores, best_rows = scores, rows
+            
+            result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+            for scores, rows in zip(best_scores, best_rows):
+                order = np.argsort(-scores)
+                picked = [(rows[i], scores[i]) for i in order if np.isfinite(scores[i])][:k]
+                result["ids"].append([self._ids[row] for row, _ in picked])
+                result["documents"].append([self._documents[row] for row, _ in picked])
+                result["metadatas"].append([self._metadatas[row] for row, _ in picked])
+                result["distances"].append([float(1.0 - score) for _, score in picked])
+        return result
+
+
+class NumpyStore(VectorStore):
+    """Lightweight in-process backend built on memory-mapped NumPy files."""
+    
+    def __init__(self, directory: str, dtype: str = NUMPY_VECTOR_DTYPE):
+        self.directory = directory
+        self.dtype = dtype
+        self._collections: Dict[str, NumpyCollection] = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+    
+    def get_or_create_collection(self, name: str, metadata: Optional[Dict] = None, embedding_function=None):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = NumpyCollection(self.directory, name, self.dtype)
+            return self._collections[name]
+    
+    def delete_collection(self, name: str):
+        with self._lock:
+            self._collections.pop(name, None)
+            for suffix in (".npy", ".jsonl"):
+                path = os.path.join(self.directory, name + suffix)
+                if os.path.exists(path):
+                    os.remove(path)
+    
+    def list_collections(self) -> List[str]:
+        return sorted(f[:-len(".jsonl")] for f in os.listdir(self.directory) if f.endswith(".jsonl"))
+
+
+def create_store(backend: str = MEMORY_BACKEND, directory: str = "./chroma_data") -> VectorStore:
+    """Create the vector store selected in config."""
+    if backend == "chroma":
+        return ChromaStore(directory)
+    if backend == "numpy":
+        return NumpyStore(directory)
+    raise ValueError(f"Unknown memory backend: {backend}")
+
+
+_stores: Dict[tuple, VectorStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(backend: str = MEMORY_BACKEND, directory: str = "./chroma_data") -> VectorStore:
+    """Get the process-wide store for a directory, so every campaign in it shares one client."""
+    key = (backend, os.path.abspath(directory))
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = create_store(backend, directory)
+        return _stores[key]